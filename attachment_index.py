@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# Attachment reuse configuration (via environment variables)
+# 'off'  - always upload the file
+# 'link' - repost the CDN URL of a previous upload of the same video instead of uploading again
+ATTACHMENT_REUSE_MODE = os.getenv('ATTACHMENT_REUSE_MODE', 'off').lower()
+ATTACHMENT_REUSE_TTL_SECONDS = int(os.getenv('ATTACHMENT_REUSE_TTL_SECONDS', str(12 * 3600)))  # 12 hours
+ATTACHMENT_INDEX_PATH = os.getenv('ATTACHMENT_INDEX_PATH', os.path.join(tempfile.gettempdir(), 'vxtwitter_attachments.json'))
+
+REUSE_MODES = ('off', 'link')
+
+# Don't hand out a CDN URL that is about to expire
+CDN_EXPIRY_MARGIN_SECONDS = 300
+
+
+def get_cdn_url_expiry(url):
+    """Return the expiry timestamp encoded in a signed Discord CDN URL ('ex' parameter), or None"""
+    try:
+        expiry = parse_qs(urlparse(url).query).get('ex')
+        return int(expiry[0], 16) if expiry else None
+    except (ValueError, IndexError):
+        return None
+
+
+class AttachmentIndex:
+    """
+    Index of videos already uploaded to Discord, keyed by (platform, canonical video id).
+
+    Each entry remembers where the upload lives (message id, channel id, attachment URL)
+    and how big it was, so repeat shares can point at the existing CDN copy instead of
+    uploading the same bytes again.
+    """
+
+    def __init__(self, index_path, ttl_seconds, mode='off'):
+        self.index_path = index_path
+        self.ttl_seconds = ttl_seconds
+        self.mode = mode if mode in REUSE_MODES else 'off'
+        self.entries = {}  # Maps "platform:video_id" to attachment info dict
+        self.lock = threading.Lock()
+        self.stats = {
+            'reuses': 0,
+            'bytes_saved': 0,
+            'registrations': 0,
+            'invalidations': 0,
+        }
+        if mode not in REUSE_MODES:
+            logger.warning(f"Unknown ATTACHMENT_REUSE_MODE '{mode}', attachment reuse disabled")
+        if self.enabled:
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @staticmethod
+    def make_key(platform, video_id):
+        return f"{platform}:{video_id}"
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f)
+            logger.info(f"Loaded attachment index with {len(self.entries)} entries")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable attachment index {self.index_path}: {e}")
+            self.entries = {}
+
+    def _save(self):
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Failed to save attachment index: {e}")
+
+    def _is_usable(self, entry, now):
+        if now - entry['created'] > self.ttl_seconds:
+            return False
+        expiry = entry.get('expires')
+        return expiry is None or now < expiry - CDN_EXPIRY_MARGIN_SECONDS
+
+    def lookup(self, platform, video_id, max_size_bytes):
+        """
+        Find a previous upload of a video that fits within max_size_bytes.
+
+        Returns:
+            dict: The attachment entry ('url', 'size', 'title', 'message_id', 'channel_id') or None.
+        """
+        if not self.enabled or not video_id:
+            return None
+        key = self.make_key(platform, video_id)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if not self._is_usable(entry, now):
+                del self.entries[key]
+                self._save()
+                return None
+            if entry['size'] > max_size_bytes:
+                return None
+            return dict(entry)
+
+    def record_reuse(self, entry):
+        """Count a repost of an existing attachment and the upload bytes it avoided"""
+        with self.lock:
+            self.stats['reuses'] += 1
+            self.stats['bytes_saved'] += entry['size']
+
+    def register(self, platform, video_id, sent_message, title=None):
+        """Remember the first attachment of a freshly sent message for later reuse"""
+        if not self.enabled or not video_id or not sent_message.attachments:
+            return
+        attachment = sent_message.attachments[0]
+        with self.lock:
+            self.entries[self.make_key(platform, video_id)] = {
+                'message_id': sent_message.id,
+                'channel_id': sent_message.channel.id,
+                'url': attachment.url,
+                'size': attachment.size,
+                'title': title,
+                'created': time.time(),
+                'expires': get_cdn_url_expiry(attachment.url),
+            }
+            self.stats['registrations'] += 1
+            self._save()
+
+    def invalidate_message(self, message_id):
+        """Drop every entry whose upload lived in a deleted message"""
+        if not self.enabled:
+            return 0
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry['message_id'] == message_id]
+            for key in stale:
+                del self.entries[key]
+            if stale:
+                self.stats['invalidations'] += len(stale)
+                self._save()
+        return len(stale)
+
+    def invalidate(self, platform, video_id):
+        """Drop the entry for a video, e.g. after its CDN URL turned out to be dead"""
+        with self.lock:
+            if self.entries.pop(self.make_key(platform, video_id), None) is not None:
+                self.stats['invalidations'] += 1
+                self._save()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        return stats
+
+
+attachment_index = AttachmentIndex(ATTACHMENT_INDEX_PATH, ATTACHMENT_REUSE_TTL_SECONDS, mode=ATTACHMENT_REUSE_MODE)
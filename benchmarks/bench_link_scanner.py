@@ -0,0 +1,90 @@
+"""
+Microbenchmark for the on_message link scan.
+
+Compares the previous approach (one finditer pass per platform regex over every message)
+with the combined LinkScanner and its substring prefilter, on a generated chat corpus
+where roughly 1% of messages contain a supported link.
+
+Usage:
+    python benchmarks/bench_link_scanner.py [--messages 200000] [--link-ratio 0.01]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from link_scanner import link_scanner, TWITTER_URL_REGEX  # noqa: E402
+from media_providers import iter_providers  # noqa: E402
+
+WORDS = (
+    "lol ok yeah no wait what did you see that game last night honestly i think we should "
+    "go tomorrow anyone up for ranked gg wp brb food time this is so true same here"
+).split()
+
+OTHER_LINKS = (
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://github.com/stef1949/VXtwitter-Link-Embedder",
+    "https://cdn.discordapp.com/attachments/1/2/image.png",
+    "https://en.wikipedia.org/wiki/Discord",
+)
+
+SUPPORTED_LINKS = (
+    "https://x.com/user/status/1790000000000000000",
+    "https://twitter.com/user/status/1790000000000000000",
+    "||https://x.com/user/status/1790000000000000000||",
+    "https://www.tiktok.com/@someone/video/7300000000000000000",
+    "https://vm.tiktok.com/ZMabc1234/",
+    "https://www.instagram.com/reel/C1a2B3c4D5e/",
+)
+
+
+def build_corpus(count, link_ratio, seed=1234):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(2, 25))]
+        roll = rng.random()
+        if roll < link_ratio:
+            words.insert(rng.randint(0, len(words)), rng.choice(SUPPORTED_LINKS))
+        elif roll < link_ratio * 4:
+            words.insert(rng.randint(0, len(words)), rng.choice(OTHER_LINKS))
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def legacy_scan(content, regexes):
+    found = 0
+    for regex in regexes:
+        found += len(list(regex.finditer(content)))
+    return found
+
+
+def measure(label, corpus, func):
+    start = time.perf_counter()
+    found = 0
+    for content in corpus:
+        found += func(content)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<10} {len(corpus) / elapsed:>12,.0f} msgs/s  ({found} links found)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200_000)
+    parser.add_argument('--link-ratio', type=float, default=0.01)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.messages, args.link_ratio)
+    regexes = [TWITTER_URL_REGEX] + [provider.url_regex for provider in iter_providers()]
+
+    legacy = measure('legacy', corpus, lambda content: legacy_scan(content, regexes))
+    scanner = measure('scanner', corpus, lambda content: len(link_scanner.scan(content)))
+    print(f"speedup    {legacy / scanner:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark for the layered token-bucket rate limiter.
+
+Drives RateLimiter.check with a synthetic clock at a fixed decision rate, spreading
+requests over a very large population of user ids (most of which are only seen once)
+and a few hundred guilds and channels. Reports decisions per second of wall time and
+how many entries each scope is tracking as simulated time passes, showing that memory
+is bounded by the number of recently active keys rather than by every user ever seen.
+
+Usage:
+    python benchmarks/bench_rate_limiter.py [--decisions 2000000] [--rate 10000] [--users 5000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from link_scanner import TWITTER  # noqa: E402
+from rate_limiter import RateLimiter, TokenBucket  # noqa: E402
+
+PLATFORMS = (TWITTER, 'tiktok', 'instagram')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--decisions', type=int, default=2_000_000)
+    parser.add_argument('--rate', type=int, default=10_000, help='simulated decisions per second')
+    parser.add_argument('--users', type=int, default=5_000_000)
+    parser.add_argument('--guilds', type=int, default=500)
+    parser.add_argument('--channels-per-guild', type=int, default=4)
+    parser.add_argument('--scope-limit', type=int, default=1_000_000,
+                        help='per-minute global/guild/channel budget; high by default so the per-user scope is exercised')
+    args = parser.parse_args()
+
+    rng = random.Random(1234)
+    requests = [
+        (
+            rng.choice(PLATFORMS),
+            rng.randrange(args.users),
+            guild := rng.randrange(args.guilds),
+            guild * args.channels_per_guild + rng.randrange(args.channels_per_guild),
+        )
+        for _ in range(args.decisions)
+    ]
+
+    limiter = RateLimiter()
+    limiter.get_global_limit = lambda platform: args.scope_limit
+    limiter.guilds = TokenBucket('guild', args.scope_limit, 60)
+    limiter.channels = TokenBucket('channel', args.scope_limit, 60)
+    step = 1.0 / args.rate
+    report_every = max(1, args.decisions // 10)
+    now = 0.0
+    start = time.perf_counter()
+    for index, (platform, user_id, guild_id, channel_id) in enumerate(requests, 1):
+        now += step
+        limiter.check(platform, user_id, guild_id, channel_id, now=now)
+        if index % report_every == 0:
+            state = limiter.get_state()
+            print(f"t={now:>7.1f}s  decisions={index:>9,}  users={state['tracked_users']:>7,}  "
+                  f"channels={state['tracked_channels']:>5,}  guilds={state['tracked_guilds']:>4,}")
+    elapsed = time.perf_counter() - start
+
+    state = limiter.get_state()
+    print(f"throughput {args.decisions / elapsed:,.0f} decisions/s  "
+          f"(allowed {state['allowed']:,}, dropped {state['dropped']:,})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Benchmark the stream-copy remux path against full encodes.
+
+Runs the pipeline's post-download decision (probe, remux if that is enough, otherwise
+compress) over local sample clips and prints how many clips took each path and the time
+spent in each. Without --clips, a set of sample clips is generated with ffmpeg's test
+sources: a non-faststart MP4, an MKV, an MP4 with a large extra audio
+track, and a high-bitrate clip that needs a real encode.
+
+Requires ffmpeg and ffprobe on PATH.
+
+Usage:
+    python benchmarks/bench_remux.py [--clips DIR] [--max-mb 1] [--seconds 10]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from media_probe import probe_media  # noqa: E402
+from video_processing import compress_video_to_limit, is_faststart_mp4, plan_remux, remux_video  # noqa: E402
+
+VIDEO_SOURCE = "testsrc2=size=1280x720:rate=30"
+AUDIO_SOURCE = "sine=frequency=440:sample_rate=48000"
+
+
+def generate_samples(folder, seconds):
+    """Create sample clips that exercise each path; returns their paths"""
+    inputs = ["-f", "lavfi", "-i", f"{VIDEO_SOURCE}:duration={seconds}", "-f", "lavfi", "-i", f"{AUDIO_SOURCE}:duration={seconds}"]
+    h264 = ["-c:v", "libx264", "-preset", "ultrafast", "-b:v", "400k", "-c:a", "aac", "-b:a", "96k"]
+    samples = {
+        # moov atom at the end (ffmpeg's default without +faststart)
+        "moov_at_end.mp4": inputs + ["-map", "0:v", "-map", "1:a"] + h264,
+        # Compatible codecs in a container Discord doesn't play inline
+        "container.mkv": inputs + ["-map", "0:v", "-map", "1:a"] + h264,
+        # Over the limit only because of a big second audio track
+        "extra_track.mp4": inputs + ["-map", "0:v", "-map", "1:a", "-map", "1:a"] + h264 + ["-b:a:1", "1500k"],
+        # Over the limit on its own: only an encode helps
+        "high_bitrate.mp4": inputs + ["-map", "0:v", "-map", "1:a"] + h264 + ["-b:v", "4M"],
+    }
+    paths = []
+    for name, args in samples.items():
+        path = os.path.join(folder, name)
+        subprocess.run(["ffmpeg", "-y", "-v", "error"] + args + ["-t", str(seconds), path], check=True)
+        paths.append(path)
+    return paths
+
+
+async def process_clip(path, max_size):
+    """Run the pipeline's decision for one clip; returns (path taken, seconds, output size)"""
+    started = time.perf_counter()
+    file_size = os.path.getsize(path)
+    faststart = is_faststart_mp4(path)
+    if file_size <= max_size and faststart:
+        return 'as-is', time.perf_counter() - started, file_size
+
+    probe = await probe_media(path)
+    reason = plan_remux(probe, file_size, max_size, faststart)
+    if reason:
+        remuxed = await remux_video(path)
+        if remuxed and os.path.getsize(remuxed) <= max_size:
+            return f'remux ({reason})', time.perf_counter() - started, os.path.getsize(remuxed)
+    if file_size <= max_size:
+        return 'as-is', time.perf_counter() - started, file_size
+
+    compressed = await compress_video_to_limit(path, max_size, probe)
+    output_size = os.path.getsize(compressed) if compressed else 0
+    return 'encode' if compressed else 'encode (failed)', time.perf_counter() - started, output_size
+
+
+async def run(paths, max_size):
+    totals = {}
+    for path in paths:
+        # Work on a copy so remux/encode outputs never touch the sample clips
+        with tempfile.TemporaryDirectory() as work_folder:
+            work_path = os.path.join(work_folder, os.path.basename(path))
+            shutil.copy(path, work_path)
+            label, elapsed, output_size = await process_clip(work_path, max_size)
+        print(f"{os.path.basename(path):<28} {label:<22} {elapsed * 1000:>9.1f} ms  "
+              f"{os.path.getsize(path) / 1024:>8.0f} KB -> {output_size / 1024:.0f} KB")
+        path_kind = label.split(' ')[0]
+        count, seconds = totals.get(path_kind, (0, 0.0))
+        totals[path_kind] = (count + 1, seconds + elapsed)
+
+    print()
+    total_seconds = sum(seconds for _, seconds in totals.values()) or 1e-9
+    for path_kind, (count, seconds) in sorted(totals.items()):
+        print(f"{path_kind:<8} {count:>3} clip(s) {seconds:>8.2f}s total  {seconds / count * 1000:>9.1f} ms avg  "
+              f"{seconds / total_seconds * 100:>5.1f}% of time")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', help="Folder of sample clips (default: generate samples)")
+    parser.add_argument('--max-mb', type=float, default=1.0, help="Upload limit in MB")
+    parser.add_argument('--seconds', type=int, default=10, help="Length of generated samples")
+    args = parser.parse_args()
+
+    for tool in ('ffmpeg', 'ffprobe'):
+        if shutil.which(tool) is None:
+            sys.exit(f"{tool} not found on PATH")
+
+    max_size = int(args.max_mb * 1024 * 1024)
+    sample_folder = None
+    if args.clips:
+        paths = sorted(
+            os.path.join(args.clips, name) for name in os.listdir(args.clips)
+            if os.path.isfile(os.path.join(args.clips, name))
+        )
+    else:
+        sample_folder = tempfile.mkdtemp(prefix='bench_remux_')
+        paths = generate_samples(sample_folder, args.seconds)
+    try:
+        asyncio.run(run(paths, max_size))
+    finally:
+        if sample_folder:
+            shutil.rmtree(sample_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
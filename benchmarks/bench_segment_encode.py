@@ -0,0 +1,86 @@
+"""
+Benchmark segment-parallel encoding against a single ffmpeg encode.
+
+Generates a test video with ffmpeg's test sources, plans an encode for the upload limit
+the way the bot does, then encodes it once in one piece and once per segment count,
+printing wall-clock time, output size and output duration for each.
+
+Requires ffmpeg and ffprobe on PATH.
+
+Usage:
+    python benchmarks/bench_segment_encode.py [--seconds 180] [--max-mb 8] [--segments 2 4 8]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from encode_planner import encode_planner  # noqa: E402
+from media_probe import probe_media  # noqa: E402
+from video_processing import encode_with_plan  # noqa: E402
+
+
+def generate_clip(path, seconds, size):
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-v", "error",
+            "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+            "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}",
+            "-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-b:v", "6M",
+            "-c:a", "aac", "-b:a", "128k",
+            path,
+        ],
+        check=True,
+    )
+
+
+async def run(clip, max_size, segment_counts, folder):
+    probe = await probe_media(clip)
+    plan = encode_planner.plan(probe, max_size, "libx264")
+    print(f"Source: {probe.duration:.1f}s, plan: {plan}")
+    print(f"CPU cores: {os.cpu_count()}\n")
+
+    baseline = None
+    for segments in [1] + segment_counts:
+        output = os.path.join(folder, f"out_{segments}.mp4")
+        started = time.perf_counter()
+        await encode_with_plan(clip, output, plan, segments)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        result = await probe_media(output)
+        size = os.path.getsize(output)
+        label = "single" if segments == 1 else f"{segments} segments"
+        print(f"{label:<12} {elapsed:>7.2f}s  {baseline / elapsed:>5.2f}x  "
+              f"{size / (1024 * 1024):>6.2f} MB {'(fits)' if size <= max_size else '(TOO LARGE)'}  "
+              f"{result.duration if result else 0:>7.2f}s long")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=int, default=180, help="Length of the generated video")
+    parser.add_argument('--size', default="1920x1080", help="Resolution of the generated video")
+    parser.add_argument('--max-mb', type=float, default=8.0, help="Upload limit in MB")
+    parser.add_argument('--segments', type=int, nargs='+', default=[2, 4, 8], help="Segment counts to compare")
+    args = parser.parse_args()
+
+    for tool in ('ffmpeg', 'ffprobe'):
+        if shutil.which(tool) is None:
+            sys.exit(f"{tool} not found on PATH")
+
+    folder = tempfile.mkdtemp(prefix='bench_segment_encode_')
+    try:
+        clip = os.path.join(folder, "source.mp4")
+        generate_clip(clip, args.seconds, args.size)
+        asyncio.run(run(clip, int(args.max_mb * 1024 * 1024), args.segments, folder))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
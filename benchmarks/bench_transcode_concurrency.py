@@ -0,0 +1,105 @@
+"""
+Sweep transcode concurrency and threads per encode on generated clips.
+
+Generates a batch of test clips with ffmpeg, then for each concurrency level encodes the
+whole batch through the transcode scheduler (threads per encode = cores / concurrency
+unless --threads is given) and prints total wall time and encode throughput. The first
+row starts every encode at once with one thread per core each, which is what concurrent
+encodes did before the scheduler.
+
+Requires ffmpeg and ffprobe on PATH.
+
+Usage:
+    python benchmarks/bench_transcode_concurrency.py [--clips 8] [--seconds 20] [--levels 1 2 4 8]
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from encode_planner import encode_planner  # noqa: E402
+from media_probe import probe_media  # noqa: E402
+from transcode_scheduler import available_cores, transcode_scheduler  # noqa: E402
+from video_processing import encode_with_plan  # noqa: E402
+
+
+def generate_clips(folder, count, seconds, size):
+    paths = []
+    for index in range(count):
+        path = os.path.join(folder, f"clip_{index}.mp4")
+        subprocess.run(
+            [
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30:duration={seconds}",
+                "-f", "lavfi", "-i", f"sine=frequency={220 + index * 40}:sample_rate=48000:duration={seconds}",
+                "-c:v", "libx264", "-preset", "ultrafast", "-b:v", "6M",
+                "-c:a", "aac", "-b:a", "128k",
+                path,
+            ],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+async def encode_batch(jobs, folder):
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        encode_with_plan(path, os.path.join(folder, f"out_{index}.mp4"), plan)
+        for index, (path, plan) in enumerate(jobs)
+    ))
+    return time.perf_counter() - started
+
+
+async def run(paths, max_size, levels, threads, cores, folder):
+    jobs = []
+    for path in paths:
+        probe = await probe_media(path)
+        jobs.append((path, encode_planner.plan(probe, max_size, "libx264")))
+    media_seconds = sum(plan.duration for _, plan in jobs)
+    print(f"{len(jobs)} clips, {media_seconds:.0f}s of video, {cores} cores\n")
+
+    rows = [("all at once", len(jobs), cores)]
+    rows += [(f"{level} at a time", level, threads or max(1, cores // level)) for level in levels]
+    for label, concurrency, threads_per_encode in rows:
+        transcode_scheduler.configure(threads_per_encode=threads_per_encode, max_concurrent=concurrency)
+        elapsed = await encode_batch(jobs, folder)
+        print(f"{label:<14} {threads_per_encode:>3} threads each  {elapsed:>7.2f}s total  "
+              f"{media_seconds / elapsed:>6.1f}x realtime")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', type=int, default=8, help="Clips encoded per run")
+    parser.add_argument('--seconds', type=int, default=20, help="Length of each clip")
+    parser.add_argument('--size', default="1280x720", help="Resolution of the generated clips")
+    parser.add_argument('--max-mb', type=float, default=8.0, help="Upload limit in MB")
+    parser.add_argument('--levels', type=int, nargs='+', help="Concurrency levels (default: powers of two up to the core count)")
+    parser.add_argument('--threads', type=int, help="Threads per encode (default: cores / concurrency)")
+    args = parser.parse_args()
+
+    for tool in ('ffmpeg', 'ffprobe'):
+        if shutil.which(tool) is None:
+            sys.exit(f"{tool} not found on PATH")
+
+    cores = available_cores()
+    levels = args.levels or [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+    # Measure the limits alone, not how busy the host happened to be
+    transcode_scheduler.load_aware = False
+
+    folder = tempfile.mkdtemp(prefix='bench_transcode_concurrency_')
+    try:
+        paths = generate_clips(folder, args.clips, args.seconds, args.size)
+        asyncio.run(run(paths, int(args.max_mb * 1024 * 1024), levels, args.threads, cores, folder))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark per-call YoutubeDL construction against the warm YoutubeDL pool.
+
+Serves generated media files from a local keep-alive HTTP server and downloads them
+with yt-dlp's generic extractor, once building a fresh YoutubeDL per download and once
+checking instances out of a YoutubeDLPool.
+
+Usage:
+    python benchmarks/bench_ytdlp_pool.py [--downloads 50] [--size-kb 512]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ytdlp_pool import YoutubeDLPool, youtubedl_session  # noqa: E402
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves the same payload for any /media/<name>.mp4 path with HTTP/1.1 keep-alive"""
+    protocol_version = 'HTTP/1.1'
+    payload = b''
+
+    def _send_headers(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        self._send_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run(label, downloads, base_url, output_folder, session_factory):
+    start = time.perf_counter()
+    for i in range(downloads):
+        with session_factory() as ydl:
+            ydl.extract_info(f"{base_url}/media/clip_{i}.mp4", download=True)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {downloads} downloads in {elapsed:.2f}s ({elapsed / downloads * 1000:.1f} ms/download)")
+    for name in os.listdir(output_folder):
+        os.remove(os.path.join(output_folder, name))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--downloads', type=int, default=50)
+    parser.add_argument('--size-kb', type=int, default=512)
+    args = parser.parse_args()
+
+    MediaHandler.payload = os.urandom(args.size_kb * 1024)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MediaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    output_folder = tempfile.mkdtemp(prefix='ytdlp_pool_bench_')
+    ydl_opts = {
+        'format': 'best',
+        'outtmpl': f'{output_folder}/%(id)s.%(ext)s',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+    }
+    try:
+        fresh = run('per-call', args.downloads, base_url, output_folder,
+                    lambda: youtubedl_session('bench', ydl_opts, pooled=False))
+        pool = YoutubeDLPool('bench', ydl_opts, size=1, max_uses=args.downloads + 1, max_age_seconds=3600)
+        pooled = run('pooled', args.downloads, base_url, output_folder, pool.checkout)
+        pool.close()
+        print(f"speedup      {fresh / pooled:.2f}x")
+    finally:
+        server.shutdown()
+        shutil.rmtree(output_folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Directory for state the bot keeps across restarts (via environment variable)
+BOT_DATA_DIR = os.getenv(
+    'BOT_DATA_DIR',
+    os.path.join(os.getenv('XDG_DATA_HOME') or os.path.expanduser('~/.local/share'), 'vxtwitter'),
+)
+
+
+def data_path(filename):
+    """Return the path of a state file in the bot's data directory, creating the directory (mode 700) if needed"""
+    try:
+        os.makedirs(BOT_DATA_DIR, mode=0o700, exist_ok=True)
+    except OSError as e:
+        logger.warning(f"Failed to create data directory {BOT_DATA_DIR}: {e}")
+    return os.path.join(BOT_DATA_DIR, filename)
@@ -7,8 +7,24 @@ import sys
 import asyncio
 import subprocess
 from discord.ext import commands
-from tiktok_handler import download_tiktok_video
-from instagram_handler import download_instagram_video
+from media_cache import media_cache
+from media_providers import iter_providers, get_provider
+from link_scanner import link_scanner, TWITTER
+from rate_limiter import rate_limiter, RATE_LIMIT_SECONDS, GLOBAL_RATE_LIMIT, MEDIA_GLOBAL_RATE_LIMIT
+from media_pipeline import prepare_video_for_upload, release_media_file, resolve_short_links, pipeline_stats, prepare_flights
+from video_processing import get_encode_stats
+from encode_planner import encode_planner
+from ytdlp_workers import ytdlp_workers, add_counts, YTDLP_WORKERS_ENABLED
+from stage_executors import get_executor_stats
+from transcode_scheduler import transcode_scheduler
+from media_queue import media_queue, MediaJob, MEDIA_MESSAGE_CONCURRENCY
+from attachment_index import attachment_index
+from webhook_cache import webhook_cache
+from media_extraction import info_cache
+from media_probe import probe_cache
+from link_resolver import link_resolver
+from negative_cache import negative_cache, DEFAULT_FAILURE_TTLS
+from ytdlp_pool import get_pool_stats, YTDLP_POOL_ENABLED
 
 # Configure logging to show the time, logger name, level, and message.
 logging.basicConfig(
@@ -30,21 +46,15 @@ if not TOKEN:
 intents = discord.Intents.default()
 intents.message_content = True
 
-client = discord.Client(intents=intents)
-tree = discord.app_commands.CommandTree(client)
-
-# Regex to match URLs that start with http(s):// and include twitter.com or x.com
-URL_REGEX = re.compile(r'(https?://(?:www\.)?(?:twitter\.com|x\.com)/\S+)', re.IGNORECASE)
-
-# Regex to match TikTok URLs
-TIKTOK_URL_REGEX = re.compile(r'(https?://(?:www\.)?(?:tiktok\.com|vm\.tiktok\.com)/\S+)', re.IGNORECASE)
-
-# Regex to match Instagram URLs (posts, reels, stories, and short URLs)
-INSTAGRAM_URL_REGEX = re.compile(r'(https?://(?:www\.)?(?:instagram\.com|instagr\.am)/(?:p|reels?|tv|stories)/\S+)', re.IGNORECASE)
+class EmbedBotClient(discord.Client):
+    async def close(self):
+        # Release the short link resolver's HTTP session and save the encode model before the event loop goes away
+        await link_resolver.close()
+        await encode_planner.flush()
+        await super().close()
 
-# Rate limiting configuration (per user)
-RATE_LIMIT_SECONDS = 10
-user_rate_limit = {}  # Dictionary mapping user ID to last processed timestamp
+client = EmbedBotClient(intents=intents)
+tree = discord.app_commands.CommandTree(client)
 
 # User preferences for emulation (True = emulate user, False = post as bot)
 user_emulation_preferences = {}  # Maps user ID to boolean preference
@@ -56,8 +66,6 @@ links_processed = 0
 version = "1.2.2"  # Bot version
 
 # Security settings
-GLOBAL_RATE_LIMIT = 30  # Maximum requests per minute across all users
-global_request_timestamps = []  # List of timestamps for global rate limiting
 BANNED_USERS = set()  # Set of banned user IDs
 SERVER_BLACKLIST = set()  # Set of blacklisted server IDs
 ADMIN_IDS = set()  # Set of bot admin user IDs
@@ -65,27 +73,18 @@ ADMIN_IDS = set()  # Set of bot admin user IDs
 # Server-specific settings
 server_settings = {}  # Maps server ID to settings dict
 
-# Timeouts for blocking operations (seconds)
-YTDLP_TIMEOUT_SECONDS = int(os.getenv("YTDLP_TIMEOUT_SECONDS", "120"))
-FFPROBE_TIMEOUT_SECONDS = int(os.getenv("FFPROBE_TIMEOUT_SECONDS", "15"))
-FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "120"))
+# Upload limit used outside guilds (boosted guilds allow more, see get_upload_limit)
+DEFAULT_UPLOAD_LIMIT = 8 * 1024 * 1024  # 8MB in bytes
+
+# Clip length used when a server turns on clip mode without choosing one
+DEFAULT_CLIP_SECONDS = 30
+
+# Minimum time between edits of a processing message with compression progress
+PROGRESS_EDIT_INTERVAL_SECONDS = 3
 
 persistent_views_registered = False
 
 # Utility functions for security
-def check_global_rate_limit():
-    """Check if the global rate limit has been exceeded"""
-    now = time.time()
-    # Remove timestamps older than 60 seconds
-    global global_request_timestamps
-    global_request_timestamps = [ts for ts in global_request_timestamps if now - ts < 60]
-    # Check if we've exceeded the global rate limit
-    if len(global_request_timestamps) >= GLOBAL_RATE_LIMIT:
-        return False
-    # Add current timestamp and return True (not rate limited)
-    global_request_timestamps.append(now)
-    return True
-
 def is_user_banned(user_id):
     """Check if a user is banned from using the bot"""
     return user_id in BANNED_USERS
@@ -150,194 +149,51 @@ def set_server_setting(server_id, key, value):
         server_settings[server_id] = {}
     server_settings[server_id][key] = value
 
-def sanitize_url(url):
-    """Sanitize a URL to prevent potential injection attacks"""
-    # For Twitter/X URLs, use basic sanitization
-    # Note: # (fragment identifier) is excluded for security
-    return re.sub(r'[^\w\.\/\:\-\?\&\=\%]', '', url)
-
-def validate_tiktok_url(url):
+def get_upload_limit(guild):
     """
-    Validate and sanitize a TikTok URL.
-    Returns the validated/sanitized URL. Logs a warning if URL doesn't match expected patterns.
+    Return the upload size limit in bytes for videos posted in a guild: the guild's
+    boost-tier limit, lowered by the server's max_upload_mb setting if one is set.
     """
-    # TikTok URL patterns we expect (checked with re.IGNORECASE)
-    case_insensitive_patterns = [
-        r'^https?://(?:www\.)?tiktok\.com/@[\w\.]+/video/\d+',
-        r'^https?://(?:www\.)?tiktok\.com/t/[\w]+',
-        r'^https?://vm\.tiktok\.com/[\w]+',
-    ]
-    
-    # Short URL pattern (case-sensitive path check to avoid matching common lowercase paths)
-    # TikTok short URLs are 8-12 characters total and start with uppercase letter or digit (e.g., ZNRrFcTFL)
-    # Pattern breakdown: [A-Z0-9] (1 char) + [A-Za-z0-9]{7,11} (7-11 chars) = 8-12 chars total
-    # This excludes common paths like "trending", "foryou", "following" which are all lowercase
-    # If a capitalized common path is matched (e.g., "Trending"), yt-dlp will handle it gracefully
-    short_url_pattern = r'^https?://(?:www\.)?tiktok\.com/[A-Z0-9][A-Za-z0-9]{7,11}/?$'
-    
-    # Check if URL matches any valid pattern
-    matched = False
-    for pattern in case_insensitive_patterns:
-        if re.match(pattern, url, re.IGNORECASE):
-            matched = True
-            break
-    
-    # Check short URL pattern without IGNORECASE for the path part
-    if not matched and re.match(short_url_pattern, url):
-        matched = True
-    
-    if not matched:
-        logger.warning(f"TikTok URL doesn't match expected patterns: {url}")
-    
-    # Basic sanitization - remove any trailing fragments or suspicious characters
-    # Keep only the base URL components, including @ symbol for TikTok usernames
-    return re.sub(r'[^\w\.\/\:\-\?\&\=\%\@]', '', url)
-
-def validate_instagram_url(url):
+    if guild is None:
+        return DEFAULT_UPLOAD_LIMIT
+    limit = getattr(guild, "filesize_limit", None) or DEFAULT_UPLOAD_LIMIT
+    override_mb = get_server_setting(guild.id, "max_upload_mb")
+    if override_mb:
+        limit = min(limit, override_mb * 1024 * 1024)
+    return limit
+
+def get_clip_settings(guild):
     """
-    Validate and sanitize an Instagram URL.
-    Returns the validated/sanitized URL. Logs a warning if URL doesn't match expected patterns.
+    Return (clip_after_seconds, clip_seconds) for a guild's clip mode, or (None, None) if it
+    is off: videos longer than clip_after_seconds are posted as their first clip_seconds.
     """
-    # Instagram URL patterns we expect
-    patterns = [
-        r'^https?://(?:www\.)?instagram\.com/p/[\w\-]+',  # Posts
-        r'^https?://(?:www\.)?instagram\.com/reels?/[\w\-]+',  # Reels (reel or reels)
-        r'^https?://(?:www\.)?instagram\.com/tv/[\w\-]+',  # IGTV
-        r'^https?://(?:www\.)?instagram\.com/stories/[\w\.]+/\d+',  # Stories
-        r'^https?://(?:www\.)?instagr\.am/p/[\w\-]+',  # Short URL posts
-        r'^https?://(?:www\.)?instagr\.am/reels?/[\w\-]+',  # Short URL reels
-    ]
-    
-    # Check if URL matches any valid pattern
-    matched = False
-    for pattern in patterns:
-        if re.match(pattern, url, re.IGNORECASE):
-            matched = True
-            break
-    
-    if not matched:
-        logger.warning(f"Instagram URL doesn't match expected patterns: {url}")
-    
-    # Basic sanitization - remove any trailing fragments or suspicious characters
-    # Keep only the base URL components
-    return re.sub(r'[^\w\.\/\:\-\?\&\=\%]', '', url)
+    if guild is None:
+        return None, None
+    clip_after = get_server_setting(guild.id, "clip_after_seconds")
+    if not clip_after:
+        return None, None
+    # /server_settings keeps clips shorter than the threshold; settings stored before that are clamped
+    return clip_after, min(get_server_setting(guild.id, "clip_seconds") or DEFAULT_CLIP_SECONDS, clip_after)
 
-def cleanup_file(filepath):
-    """Clean up a temporary file with proper error handling"""
-    try:
-        if os.path.exists(filepath):
-            os.remove(filepath)
-            logger.info(f"Cleaned up temporary file: {filepath}")
-    except OSError as e:
-        logger.warning(f"Failed to clean up file {filepath}: {e}")
-
-async def run_blocking(func, *args, timeout_seconds=None):
-    if timeout_seconds:
-        return await asyncio.wait_for(asyncio.to_thread(func, *args), timeout=timeout_seconds)
-    return await asyncio.to_thread(func, *args)
-
-def get_video_duration_seconds(filepath):
-    """Return video duration in seconds using ffprobe, or None on failure"""
-    try:
-        result = subprocess.run(
-            [
-                "ffprobe",
-                "-v", "error",
-                "-show_entries", "format=duration",
-                "-of", "default=noprint_wrappers=1:nokey=1",
-                filepath,
-            ],
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=FFPROBE_TIMEOUT_SECONDS,
-        )
-        duration_str = result.stdout.strip()
-        if not duration_str:
-            return None
-        duration = float(duration_str)
-        if duration <= 0:
-            return None
-        return duration
-    except subprocess.TimeoutExpired as e:
-        logger.warning(f"ffprobe timed out for {filepath}: {e}")
-        return None
-    except Exception as e:
-        logger.warning(f"Failed to get video duration for {filepath}: {e}")
-        return None
+def sanitize_url(url):
+    """Sanitize a URL to prevent potential injection attacks"""
+    # For Twitter/X URLs, use basic sanitization
+    # Note: # (fragment identifier) is excluded for security
+    return re.sub(r'[^\w\.\/\:\-\?\&\=\%]', '', url)
 
-def compress_video_to_limit(filepath, max_size_bytes):
+async def send_reused_attachment(channel, content, view, entry):
     """
-    Compress a video using ffmpeg to fit within max_size_bytes.
-    Returns the compressed filepath, or None on failure.
+    Post a link to an earlier upload of the same video instead of uploading it again.
+    Returns the sent message, or None if the caller should fall back to a normal upload.
     """
-    duration = get_video_duration_seconds(filepath)
-    if duration is None:
-        return None
-
-    # Reserve some headroom for container overhead and Discord metadata
-    target_total_bits = int(max_size_bytes * 8 * 0.95)
-    # Use a conservative audio bitrate and allocate the rest to video
-    audio_bitrate = 96_000
-    total_bitrate = max(int(target_total_bits / duration), audio_bitrate + 50_000)
-    video_bitrate = max(total_bitrate - audio_bitrate, 300_000)
-
-    output_dir = os.path.dirname(filepath) or "."
-    base_name, _ = os.path.splitext(os.path.basename(filepath))
-    compressed_path = os.path.join(output_dir, f"{base_name}_compressed.mp4")
-
-    use_nvidia_gpu = os.getenv('USE_NVIDIA_GPU', 'false').lower() in ('true', '1', 'yes')
-    if use_nvidia_gpu and os.name != "nt":
-        if not (os.path.exists("/dev/nvidia0") or os.path.exists("/dev/nvidiactl")):
-            logger.warning("NVIDIA device nodes not found; skipping NVENC and using libx264")
-            use_nvidia_gpu = False
-
-    def run_ffmpeg(video_codec, preset, extra_args=None):
-        if extra_args is None:
-            extra_args = []
-        ffmpeg_args = [
-            "ffmpeg",
-            "-y",
-            "-i", filepath,
-            "-c:v", video_codec,
-            *extra_args,
-            "-b:v", str(video_bitrate),
-            "-maxrate", str(video_bitrate),
-            "-bufsize", str(video_bitrate * 2),
-            "-preset", preset,
-            "-c:a", "aac",
-            "-b:a", str(audio_bitrate),
-            compressed_path,
-        ]
-        return subprocess.run(
-            ffmpeg_args,
-            capture_output=True,
-            text=True,
-            check=True,
-            timeout=FFMPEG_TIMEOUT_SECONDS,
-        )
-
     try:
-        if use_nvidia_gpu:
-            try:
-                run_ffmpeg("h264_nvenc", "p4", ["-gpu", "0"])
-            except Exception as e:
-                logger.warning(f"NVENC compression failed, falling back to libx264: {e}")
-                run_ffmpeg("libx264", "veryfast")
-        else:
-            run_ffmpeg("libx264", "veryfast")
-    except subprocess.TimeoutExpired as e:
-        logger.error(f"FFmpeg compression timed out for {filepath}: {e}")
-        return None
-    except Exception as e:
-        logger.error(f"FFmpeg compression failed for {filepath}: {e}")
+        sent_message = await channel.send(content=f"{content}\n{entry['url']}", view=view)
+    except (discord.HTTPException, discord.Forbidden) as e:
+        logger.error(f"Failed to repost cached attachment from message {entry['message_id']}: {e}")
         return None
-
-    if not os.path.exists(compressed_path):
-        logger.error(f"Compressed file not created: {compressed_path}")
-        return None
-
-    return compressed_path
+    attachment_index.record_reuse(entry)
+    logger.info(f"Reused attachment from message {entry['message_id']} ({entry['size']} bytes not uploaded)")
+    return sent_message
 
 async def delete_message_silently(message):
     """Delete a Discord message silently without raising errors"""
@@ -394,7 +250,40 @@ async def status(interaction: discord.Interaction):
         # Statistics section
         embed.add_field(name="🔄 Links Processed", value=links_processed, inline=True)
         embed.add_field(name="🏠 Servers", value=server_count, inline=True)
-        embed.add_field(name="⏳ Rate Limit", value=f"{RATE_LIMIT_SECONDS} seconds", inline=True)
+        limiter_state = rate_limiter.get_state()
+        embed.add_field(
+            name="⏳ Rate Limit",
+            value=(
+                f"{RATE_LIMIT_SECONDS} seconds per user\n"
+                f"Allowed: {limiter_state['allowed']} / Dropped: {limiter_state['dropped']}\n"
+                f"Tracking {limiter_state['tracked_users']} users, {limiter_state['tracked_channels']} channels"
+            ),
+            inline=True
+        )
+        
+        queue_stats = media_queue.get_stats()
+        embed.add_field(
+            name="📥 Media Queue",
+            value=(
+                f"Depth: {queue_stats['depth']}/{queue_stats['max_length']} (peak {queue_stats['max_depth']})\n"
+                f"Workers: {queue_stats['active']}/{queue_stats['workers']} busy\n"
+                f"Wait: {queue_stats['avg_wait']:.1f}s avg, {queue_stats['p95_wait']:.1f}s p95\n"
+                f"Service: {queue_stats['avg_service']:.1f}s avg, {queue_stats['p95_service']:.1f}s p95\n"
+                f"Refused: {queue_stats['rejected']} / Failed: {queue_stats['failed']}"
+            ),
+            inline=True
+        )
+        
+        stage_lines = [
+            f"{name}: {stage['running']}/{stage['workers']} busy, {stage['depth']} queued, {stage['avg_utilization']:.0%} avg"
+            for name, stage in get_executor_stats().items()
+        ]
+        scheduler = transcode_scheduler.get_stats()
+        stage_lines.append(
+            f"ffmpeg: {scheduler['running']}/{scheduler['max_concurrent']} encodes x {scheduler['threads_per_encode']} threads, "
+            f"{scheduler['waiting']} queued"
+        )
+        embed.add_field(name="⚙️ Executors", value="\n".join(stage_lines), inline=True)
         
         # Team and permissions section
         is_team_bot = False
@@ -513,6 +402,176 @@ async def emulate(interaction: discord.Interaction, enable: bool):
     except Exception as e:
         logger.error(f"Error responding to emulate command: {e}")
 
+# Slash command: /metrics
+@tree.command(name="metrics", description="[ADMIN] View media pipeline performance metrics")
+@discord.app_commands.checks.cooldown(1, 5.0)  # 1 use per 5 seconds per user
+async def metrics(interaction: discord.Interaction):
+    """Show media pipeline counters (admin only)"""
+    logger.info(f"Received /metrics command from {interaction.user}")
+    
+    # Only allow admins to use this command
+    if not is_admin(interaction.user.id):
+        log_security_event("UNAUTHORIZED_ADMIN_COMMAND", interaction.user.id, 
+                          interaction.guild_id if interaction.guild else None,
+                          "Attempted to view metrics")
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+    
+    embed = discord.Embed(
+        title="Media Pipeline Metrics",
+        color=0x1DA1F2,
+        timestamp=discord.utils.utcnow()
+    )
+    
+    cache_stats = media_cache.get_stats()
+    cache_lookups = cache_stats['hits'] + cache_stats['misses']
+    hit_rate = f"{cache_stats['hits'] / cache_lookups:.0%}" if cache_lookups else "N/A"
+    embed.add_field(
+        name="📦 Media Cache",
+        value=(
+            f"Enabled: {'Yes' if media_cache.enabled else 'No'}\n"
+            f"Hits: {cache_stats['hits']} / Misses: {cache_stats['misses']} ({hit_rate})\n"
+            f"Stores: {cache_stats['stores']}\n"
+            f"Evictions: {cache_stats['evictions']} / Expirations: {cache_stats['expirations']}\n"
+            f"Entries: {cache_stats['entries']} ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)"
+        ),
+        inline=False
+    )
+    
+    flight_stats = prepare_flights.get_stats()
+    embed.add_field(
+        name="🎞️ Pipeline",
+        value=(
+            f"Downloads: {pipeline_stats['downloads']}\n"
+            f"Fitting Rendition Chosen: {pipeline_stats['size_selected']}\n"
+            f"Transcodes: {pipeline_stats['transcodes']} / Remuxes: {pipeline_stats['remuxes']}\n"
+            f"Clips: {pipeline_stats['clips']} ({pipeline_stats['clips_copied']} without encoding)\n"
+            f"Coalesced Requests: {flight_stats['coalesced']} ({flight_stats['in_flight']} in flight)\n"
+            f"Transcodes Avoided by Boosted Limits: {pipeline_stats['transcodes_avoided']}"
+        ),
+        inline=False
+    )
+    
+    failure_stats = negative_cache.get_stats()
+    failure_hits = ", ".join(
+        f"{error_class}: {count}" for error_class, count in sorted(failure_stats['hits_by_class'].items())
+    ) or "None"
+    embed.add_field(
+        name="🚫 Negative Cache",
+        value=(
+            f"Enabled: {'Yes' if negative_cache.enabled else 'No'}\n"
+            f"Download Failures: {pipeline_stats['download_failures']} / Failed From Cache: {pipeline_stats['known_failures']}\n"
+            f"Hits by Class: {failure_hits}\n"
+            f"Entries: {failure_stats['entries']} (Purged: {failure_stats['purged']})"
+        ),
+        inline=False
+    )
+    
+    encode = get_encode_stats()
+    planner = encode_planner.get_stats()
+    embed.add_field(
+        name="🎬 FFmpeg",
+        value=(
+            f"Encodes: {encode['encodes']} / Failed: {encode['failed']} / Killed: {encode['killed']}\n"
+            f"Speed: {encode['avg_speed']:.1f}x realtime avg, {encode['recent_speed']:.1f}x recent\n"
+            f"Avg Time: {encode['avg_encode_seconds']:.1f}s per encode, {encode['avg_remux_seconds'] * 1000:.0f}ms per remux\n"
+            f"Fit on First Try: {planner['first_try_rate']:.0%} ({planner['retries']} retries, {planner['retry_fits']} fit)\n"
+            f"Size Prediction Error: {planner['avg_abs_error']:.1%} avg over {planner['encodes']} encodes"
+        ),
+        inline=False
+    )
+    
+    # In subprocess mode the metadata cache and YoutubeDL pools live in the workers, which report them
+    worker_stats = ytdlp_workers.get_stats()
+    stats_scope = f" (summed over {worker_stats['alive']} workers)" if YTDLP_WORKERS_ENABLED else ""
+    info_stats = add_counts(info_cache.get_stats(), worker_stats['info_cache'])
+    embed.add_field(
+        name="🧾 Metadata Cache",
+        value=f"Hits: {info_stats['hits']} / Misses: {info_stats['misses']}\nEntries: {info_stats['entries']}{stats_scope}",
+        inline=False
+    )
+    
+    probe_stats = probe_cache.get_stats()
+    embed.add_field(
+        name="🔬 Probe Cache",
+        value=(
+            f"Hits: {probe_stats['hits']} / Misses: {probe_stats['misses']} / Failures: {probe_stats['failures']}\n"
+            f"Entries: {probe_stats['entries']}"
+        ),
+        inline=False
+    )
+    
+    link_stats = link_resolver.get_stats()
+    embed.add_field(
+        name="🔗 Short Links",
+        value=(
+            f"Enabled: {'Yes' if link_resolver.enabled else 'No'}\n"
+            f"Hits: {link_stats['hits']} / Misses: {link_stats['misses']} / Coalesced: {link_stats['coalesced']}\n"
+            f"Expanded: {link_stats['resolved']} / Failed: {link_stats['failures']} in {link_stats['batches']} batches "
+            f"(avg {link_stats['avg_resolve_seconds'] * 1000:.0f}ms)\n"
+            f"Entries: {link_stats['entries']}"
+        ),
+        inline=False
+    )
+    
+    pool_stats = add_counts(get_pool_stats(), worker_stats['pool'])
+    embed.add_field(
+        name="🏊 YoutubeDL Pool",
+        value=(
+            f"Enabled: {'Yes' if YTDLP_POOL_ENABLED else 'No'}\n"
+            f"Checkouts: {pool_stats['checkouts']} / Created: {pool_stats['created']}\n"
+            f"Recycled: {pool_stats['recycled']} / Overflow: {pool_stats['overflow']}\n"
+            f"Warm Instances: {pool_stats['pooled']} ({pool_stats['idle']} idle){stats_scope}"
+        ),
+        inline=False
+    )
+    
+    stage_stats = get_executor_stats()
+    leaked_threads = sum(stage['leaked'] for stage in stage_stats.values())
+    abandoned_jobs = sum(stage['abandoned'] for stage in stage_stats.values())
+    embed.add_field(
+        name="🧵 yt-dlp Workers",
+        value=(
+            f"Mode: {'Subprocess' if YTDLP_WORKERS_ENABLED else 'Thread'}\n"
+            f"Workers: {worker_stats['alive']}/{worker_stats['size']} ({worker_stats['idle']} idle)\n"
+            f"Jobs: {worker_stats['jobs']} / Recycled: {worker_stats['recycled']}\n"
+            f"Killed: {worker_stats['kills']} / Crashed: {worker_stats['crashes']}\n"
+            f"Leftover Files Removed: {worker_stats['cleaned_files']}\n"
+            f"Leaked Threads: {leaked_threads} running ({abandoned_jobs} abandoned)"
+        ),
+        inline=False
+    )
+    
+    attachment_stats = attachment_index.get_stats()
+    embed.add_field(
+        name="♻️ Attachment Reuse",
+        value=(
+            f"Mode: {attachment_index.mode}\n"
+            f"Reuses: {attachment_stats['reuses']}\n"
+            f"Bytes Saved: {attachment_stats['bytes_saved'] / (1024 * 1024):.1f} MB\n"
+            f"Indexed Uploads: {attachment_stats['entries']} (Invalidated: {attachment_stats['invalidations']})"
+        ),
+        inline=False
+    )
+    
+    webhook_stats = webhook_cache.get_stats()
+    embed.add_field(
+        name="🪝 Webhook Cache",
+        value=(
+            f"Enabled: {'Yes' if webhook_cache.enabled else 'No'}\n"
+            f"Channels: {webhook_stats['channels']} / Sends: {webhook_stats['sends']}\n"
+            f"Created: {webhook_stats['created']} / Adopted: {webhook_stats['adopted']}\n"
+            f"Revalidated: {webhook_stats['revalidations']} / Evicted: {webhook_stats['evictions']}\n"
+            f"REST Calls Saved: {webhook_stats['rest_calls_saved']} ({webhook_stats['rest_calls_saved_per_minute']}/min)"
+        ),
+        inline=False
+    )
+    
+    dropped = "\n".join(f"{key}: {count}" for key, count in sorted(rate_limiter.get_state()['drops'].items())) or "None"
+    embed.add_field(name="🚦 Rate Limit Drops", value=dropped, inline=False)
+    
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # Admin only commands
 @tree.command(name="listadmins", description="List all bot administrators")
 @discord.app_commands.checks.cooldown(1, 5.0)  # 1 use per 5 seconds per user
@@ -651,11 +710,85 @@ async def server_blacklist(interaction: discord.Interaction, server_id: str, add
     except ValueError:
         await interaction.response.send_message("Invalid server ID format. Please provide a valid ID.", ephemeral=True)
 
+@tree.command(name="negative_cache", description="[ADMIN] Inspect or purge cached download failures")
+@discord.app_commands.checks.cooldown(1, 5.0)  # 1 use per 5 seconds per user
+@discord.app_commands.describe(
+    url="Only the failure cached for this video link",
+    error_class="Only failures of this class",
+    purge="Remove the matching failures so the next share downloads again"
+)
+@discord.app_commands.choices(error_class=[
+    discord.app_commands.Choice(name=error_class, value=error_class) for error_class in DEFAULT_FAILURE_TTLS
+])
+async def negative_cache_command(interaction: discord.Interaction, url: str = None, error_class: str = None,
+                                 purge: bool = False):
+    """List or purge the download failures in the negative cache (admin only)"""
+    logger.info(f"Received /negative_cache command from {interaction.user} (url={url}, class={error_class}, purge={purge})")
+    
+    # Only allow admins to use this command
+    if not is_admin(interaction.user.id):
+        log_security_event("UNAUTHORIZED_ADMIN_COMMAND", interaction.user.id, 
+                          interaction.guild_id if interaction.guild else None,
+                          "Attempted to use the negative cache command")
+        await interaction.response.send_message("You don't have permission to use this command.", ephemeral=True)
+        return
+    
+    await interaction.response.defer(ephemeral=True)
+    
+    # Failures are keyed like the pipeline keys them: canonical video ID, or the URL without one
+    provider_key = key = None
+    if url:
+        matches = [match for match in link_scanner.scan(url) if match.platform != TWITTER]
+        if not matches:
+            await interaction.followup.send("That isn't a supported video link.", ephemeral=True)
+            return
+        provider = get_provider(matches[0].platform)
+        provider, validated_url = (await resolve_short_links([(provider, provider.validate_url(matches[0].url))]))[0]
+        provider_key, key = provider.key, provider.extract_video_id(validated_url) or validated_url
+    
+    if purge:
+        removed = negative_cache.purge(provider_key, key, error_class)
+        log_security_event("NEGATIVE_CACHE_PURGED", interaction.user.id,
+                          interaction.guild_id if interaction.guild else None,
+                          f"Purged {removed} entr{'y' if removed == 1 else 'ies'} (url={url}, class={error_class})")
+        await interaction.followup.send(f"Purged {removed} cached failure(s).", ephemeral=True)
+        return
+    
+    if key is not None:
+        entry = negative_cache.peek(provider_key, key)
+        entries = [((provider_key, key), entry)] if entry else []
+    else:
+        entries = negative_cache.snapshot()
+    if error_class:
+        entries = [(entry_key, entry) for entry_key, entry in entries if entry.error_class == error_class]
+    if not entries:
+        await interaction.followup.send("No matching cached failures.", ephemeral=True)
+        return
+    
+    now = time.time()
+    lines = [f"**Cached download failures ({len(entries)}):**"]
+    for (entry_provider, entry_key), entry in entries[:15]:
+        lines.append(
+            f"• `{entry_provider}` `{entry_key}` - **{entry.error_class}**, expires in "
+            f"{int(entry.expires - now) // 60}m, {entry.hits} hit(s)\n  {entry.error[:150]}"
+        )
+    if len(entries) > 15:
+        lines.append(f"...and {len(entries) - 15} more")
+    await interaction.followup.send("\n".join(lines)[:2000], ephemeral=True)
+
 # Server configuration commands (for server admins)
 @tree.command(name="server_settings", description="Configure bot settings for this server (requires Manage Server permission)")
 @discord.app_commands.checks.cooldown(1, 5.0)  # 1 use per 5 seconds per user
 @discord.app_commands.checks.has_permissions(manage_guild=True)
-async def configure_server(interaction: discord.Interaction, enable_bot: bool = None, allowed_channels: bool = None):
+@discord.app_commands.describe(
+    max_upload_mb="Largest video upload in MB (0 to use the server's boost-tier limit)",
+    clip_after_seconds="Post only the beginning of videos longer than this that don't fit the upload limit (0 to turn off)",
+    clip_seconds="How many seconds of a long video to post in clip mode"
+)
+async def configure_server(interaction: discord.Interaction, enable_bot: bool = None, allowed_channels: bool = None,
+                           max_upload_mb: discord.app_commands.Range[int, 0, 500] = None,
+                           clip_after_seconds: discord.app_commands.Range[int, 0, 3600] = None,
+                           clip_seconds: discord.app_commands.Range[int, 5, 300] = None):
     """Configure server-specific settings for the bot"""
     logger.info(f"Received /server_settings command from {interaction.user} in guild {interaction.guild}")
     
@@ -671,6 +804,18 @@ async def configure_server(interaction: discord.Interaction, enable_bot: bool =
             "restricted_to_channels": False
         }
     
+    # A clip has to be shorter than the videos it is cut from
+    new_clip_after = get_server_setting(interaction.guild.id, "clip_after_seconds") if clip_after_seconds is None else clip_after_seconds
+    new_clip_seconds = get_server_setting(interaction.guild.id, "clip_seconds") if clip_seconds is None else clip_seconds
+    if (clip_after_seconds is not None or clip_seconds is not None) and new_clip_after and new_clip_seconds \
+            and new_clip_seconds >= new_clip_after:
+        await interaction.response.send_message(
+            f"❌ `clip_seconds` ({new_clip_seconds}s) must be shorter than `clip_after_seconds` ({new_clip_after}s). "
+            "No settings were changed.",
+            ephemeral=True
+        )
+        return
+    
     # Update settings if provided
     settings_updated = False
     if enable_bot is not None:
@@ -681,6 +826,18 @@ async def configure_server(interaction: discord.Interaction, enable_bot: bool =
         set_server_setting(interaction.guild.id, "restricted_to_channels", allowed_channels)
         settings_updated = True
     
+    if max_upload_mb is not None:
+        set_server_setting(interaction.guild.id, "max_upload_mb", max_upload_mb or None)
+        settings_updated = True
+    
+    if clip_after_seconds is not None:
+        set_server_setting(interaction.guild.id, "clip_after_seconds", clip_after_seconds or None)
+        settings_updated = True
+    
+    if clip_seconds is not None:
+        set_server_setting(interaction.guild.id, "clip_seconds", clip_seconds)
+        settings_updated = True
+    
     # Send current settings
     current_settings = server_settings[interaction.guild.id]
     embed = discord.Embed(
@@ -691,6 +848,12 @@ async def configure_server(interaction: discord.Interaction, enable_bot: bool =
     
     embed.add_field(name="Bot Enabled", value="✅ Yes" if current_settings.get("enabled", True) else "❌ No", inline=True)
     embed.add_field(name="Channel Restriction", value="✅ Enabled" if current_settings.get("restricted_to_channels", False) else "❌ Disabled", inline=True)
+    upload_limit_mb = get_upload_limit(interaction.guild) / (1024 * 1024)
+    upload_limit_source = "server setting" if current_settings.get("max_upload_mb") else "boost tier"
+    embed.add_field(name="Upload Limit", value=f"{upload_limit_mb:.0f} MB ({upload_limit_source})", inline=True)
+    clip_after, clip_length = get_clip_settings(interaction.guild)
+    clip_mode = f"First {clip_length}s of videos over {clip_after}s" if clip_after else "❌ Disabled"
+    embed.add_field(name="Clip Mode", value=clip_mode, inline=True)
     
     # Add additional fields for other settings as needed
     
@@ -1138,6 +1301,12 @@ class InstagramControlView(discord.ui.View):
     
 
 
+# Control views for media posts, keyed by provider
+MEDIA_CONTROL_VIEWS = {
+    "tiktok": TikTokControlView,
+    "instagram": InstagramControlView,
+}
+
 def register_persistent_views():
     global persistent_views_registered
     if persistent_views_registered:
@@ -1186,6 +1355,31 @@ async def on_error(event, *args, **kwargs):
     """Handle global errors"""
     logger.error(f"Discord error in {event}: {sys.exc_info()[1]}")
 
+@client.event
+async def on_raw_message_delete(payload):
+    """Forget indexed uploads whose message was deleted, since their CDN URLs stop working"""
+    removed = attachment_index.invalidate_message(payload.message_id)
+    if removed:
+        logger.info(f"Invalidated {removed} reusable attachment(s) from deleted message {payload.message_id}")
+
+@client.event
+async def on_guild_channel_delete(channel):
+    """Forget the emulation webhook of a deleted channel"""
+    webhook_cache.invalidate(channel.id, "channel deleted")
+
+@client.event
+async def on_guild_channel_update(before, after):
+    """Forget the emulation webhook when the bot can no longer manage webhooks in a channel"""
+    if isinstance(after, discord.TextChannel) and not after.permissions_for(after.guild.me).manage_webhooks:
+        webhook_cache.invalidate(after.id, "missing Manage Webhooks permission")
+
+@client.event
+async def on_guild_remove(guild):
+    """Forget every emulation webhook in a guild the bot left or was removed from"""
+    removed = webhook_cache.invalidate_guild(guild.id, "removed from guild")
+    if removed:
+        logger.info(f"Evicted {removed} cached webhook(s) for guild {guild.id}")
+
 # Periodic security tasks
 async def security_maintenance():
     """Perform periodic security-related maintenance tasks"""
@@ -1195,11 +1389,13 @@ async def security_maintenance():
             logger.info(f"Bot Stats: {links_processed} links processed, {len(user_emulation_preferences)} user preferences stored")
             logger.info(f"Security: {len(BANNED_USERS)} banned users, {len(SERVER_BLACKLIST)} blacklisted servers")
             
-            # Prune old rate limit data
-            now = time.time()
-            for user_id in list(user_rate_limit.keys()):
-                if now - user_rate_limit[user_id] > 3600:  # Remove entries older than 1 hour
-                    del user_rate_limit[user_id]
+            # Drop expired media cache entries
+            expired = media_cache.purge_expired()
+            if expired:
+                logger.info(f"Purged {expired} expired media cache entries")
+            
+            # Expire idle rate limit entries (they are also dropped lazily on every decision)
+            rate_limiter.sweep()
             
             # Wait for 1 hour before the next run
             await asyncio.sleep(3600)
@@ -1261,10 +1457,208 @@ async def on_ready():
     
     # Log startup security information
     logger.info(f"Bot started with {len(ADMIN_IDS)} admin(s), {len(BANNED_USERS)} banned user(s), and {len(SERVER_BLACKLIST)} blacklisted server(s)")
-    logger.info(f"Global rate limit set to {GLOBAL_RATE_LIMIT} requests per minute")
+    logger.info(f"Global rate limit set to {GLOBAL_RATE_LIMIT} Twitter/X and {MEDIA_GLOBAL_RATE_LIMIT} video requests per minute")
     
     # Start background tasks
     client.loop.create_task(security_maintenance())
+    media_queue.start(process_media_job)
+
+def media_content_prefix(provider, message):
+    return f"{provider.emoji} **{provider.name} video shared by <@{message.author.id}>:**\n"
+
+def create_media_view(provider, message, validated_url):
+    """Create the control buttons attached to a posted video"""
+    media_view = MEDIA_CONTROL_VIEWS[provider.key](original_url=validated_url, timeout=604800)  # 7 days timeout
+    media_view.original_author_id = message.author.id
+    return media_view
+
+async def repost_media_attachment(message, provider, validated_url, entry):
+    """Point at an earlier upload of the same video. Returns True if it was posted"""
+    global links_processed
+    media_view = create_media_view(provider, message, validated_url)
+    sent_message = await send_reused_attachment(
+        message.channel,
+        f"{media_content_prefix(provider, message)}{entry['title'] or ''}",
+        media_view,
+        entry
+    )
+    if not sent_message:
+        return False
+    media_view.message = sent_message
+    links_processed += 1
+    return True
+
+async def upload_media_result(message, provider, validated_url, result):
+    """Upload one prepared video file and remember the upload. Returns True on success"""
+    global links_processed
+    filepath = result['filepath']
+    try:
+        # Create a view with buttons for the post
+        media_view = create_media_view(provider, message, validated_url)
+        
+        # Upload the video
+        with open(filepath, 'rb') as f:
+            file = discord.File(f, filename=os.path.basename(filepath))
+            content = f"{media_content_prefix(provider, message)}{result['title']}"
+            if result.get('clipped'):
+                content += f"\n✂️ First {result['clipped']} seconds only. Full video: <{validated_url}>"
+            sent_message = await message.channel.send(
+                content=content,
+                file=file,
+                view=media_view
+            )
+            media_view.message = sent_message
+            logger.info(f"Successfully uploaded {provider.name} video: {result['title']}")
+        
+        # Remember the upload so later shares of this video can reuse it (a clip isn't the video)
+        if not result.get('clipped'):
+            attachment_index.register(provider.key, result['id'], sent_message, result['title'])
+        
+        # Increment the links processed counter
+        links_processed += 1
+        return True
+    except (discord.HTTPException, discord.Forbidden, OSError, IOError) as e:
+        logger.error(f"Error uploading {provider.name} video: {e}")
+        return False
+    finally:
+        # Clean up the file (cached files are kept for later shares)
+        release_media_file(filepath)
+
+class ProcessingStatus:
+    """
+    Shows compression progress on a processing message.
+    Edits are throttled to one per PROGRESS_EDIT_INTERVAL_SECONDS to stay within Discord's rate limits.
+    """
+
+    def __init__(self, message, text):
+        self.message = message
+        self.text = text
+        self.progress = {}  # Maps video number to encoded fraction
+        self.last_edit = 0.0
+        self.editing = False
+
+    def reporter(self, number):
+        """Return an on_progress callback for one video of the message"""
+        return lambda fraction: self.report(number, fraction)
+
+    def report(self, number, fraction):
+        self.progress[number] = fraction
+        now = time.monotonic()
+        if self.message is None or self.editing or now - self.last_edit < PROGRESS_EDIT_INTERVAL_SECONDS:
+            return
+        self.last_edit = now
+        self.editing = True
+        asyncio.ensure_future(self._edit())
+
+    async def _edit(self):
+        lines = [self.text]
+        for number, fraction in sorted(self.progress.items()):
+            label = "Compressing" if len(self.progress) == 1 and number == 1 else f"Compressing video {number}"
+            lines.append(f"🎞️ {label}: {fraction:.0%}")
+        try:
+            if self.message is not None:
+                await self.message.edit(content="\n".join(lines))
+        except (discord.NotFound, discord.HTTPException) as e:
+            logger.debug(f"Could not update processing message: {e}")
+        finally:
+            self.editing = False
+
+    def detach(self):
+        """Stop editing (the processing message is about to be deleted)"""
+        self.message = None
+
+async def process_media_job(job):
+    """
+    Media queue handler: download (or reuse) and post every video link of one message.
+    Links are fetched concurrently, within per-message and per-guild limits, and posted
+    in the order they appeared as soon as everything before them has been posted.
+    """
+    message = job.message
+    
+    # Discord's upload limit depends on the guild's boost tier (and the server may lower it)
+    max_size = get_upload_limit(message.guild)
+    clip_after_seconds, clip_seconds = get_clip_settings(message.guild)
+    
+    # Validate and sanitize the URLs, expand short links so their video IDs are known,
+    # and look for earlier uploads of the same videos
+    links = await resolve_short_links([(provider, provider.validate_url(media_url)) for provider, media_url in job.links])
+    items = []
+    for provider, validated_url in links:
+        video_id = provider.extract_video_id(validated_url)
+        reused = attachment_index.lookup(provider.key, video_id, max_size)
+        items.append((provider, validated_url, video_id, reused))
+    
+    message_slots = asyncio.Semaphore(MEDIA_MESSAGE_CONCURRENCY)
+    guild_slots = media_queue.guild_slots(message.guild.id if message.guild else None)
+    
+    # One processing message for all the videos that have to be downloaded
+    downloads = [item for item in items if not item[3]]
+    processing_msg = None
+    status = None
+    if downloads:
+        if len(downloads) == 1:
+            placeholder = f"⏳ Downloading {downloads[0][0].name} video from <@{message.author.id}>..."
+        else:
+            placeholder = f"⏳ Downloading {len(downloads)} videos from <@{message.author.id}>..."
+        processing_msg = await message.channel.send(placeholder)
+        status = ProcessingStatus(processing_msg, placeholder)
+    
+    async def prepare(number, provider, validated_url, video_id):
+        on_progress = status.reporter(number) if status else None
+        async with message_slots, guild_slots:
+            return await prepare_video_for_upload(
+                provider, validated_url, video_id, max_size, on_progress, clip_after_seconds, clip_seconds
+            )
+    
+    tasks = [
+        None if reused else asyncio.create_task(prepare(number, provider, validated_url, video_id))
+        for number, (provider, validated_url, video_id, reused) in enumerate(items, 1)
+    ]
+    posted = 0
+    handed_off = set()  # Tasks whose result went to upload_media_result, which releases the file
+    try:
+        for number, ((provider, validated_url, video_id, reused), task) in enumerate(zip(items, tasks), 1):
+            if reused and await repost_media_attachment(message, provider, validated_url, reused):
+                posted += 1
+                continue
+            # Fall back to a download if reposting an earlier upload failed
+            result = await task if task else await prepare(number, provider, validated_url, video_id)
+            if not result:
+                continue
+            if processing_msg:
+                status.detach()
+                await delete_message_silently(processing_msg)
+                processing_msg = None
+            if task:
+                handed_off.add(task)
+            if await upload_media_result(message, provider, validated_url, result):
+                posted += 1
+    finally:
+        # Only reached with unfinished or unposted tasks if posting was interrupted
+        for task in tasks:
+            if task is None or task in handed_off:
+                continue
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled() and task.exception() is None and task.result():
+                release_media_file(task.result()['filepath'])
+        if processing_msg:
+            status.detach()
+            await delete_message_silently(processing_msg)
+    
+    if not posted:
+        return
+    
+    # Try to delete the original message
+    try:
+        await message.delete()
+        logger.info(f"Deleted original media message {message.id} from {message.author}")
+    except discord.NotFound:
+        pass
+    except discord.Forbidden:
+        logger.warning(f"Missing permissions to delete media message {message.id} from {message.author}")
+    except discord.HTTPException as e:
+        logger.error(f"Failed to delete media message {message.id}: {e}")
 
 @client.event
 async def on_message(message):
@@ -1298,34 +1692,30 @@ async def on_message(message):
                 logger.info(f"Ignoring message in non-whitelisted channel {message.channel.id}")
                 return
     
-    # Check global rate limit
-    if not check_global_rate_limit():
-        logger.warning("Global rate limit exceeded, ignoring message")
+    # Find every supported link in one pass (messages without links are rejected by a cheap prefilter)
+    links = link_scanner.scan(message.content)
+    if not links:
         return
-
-    # Process only messages that contain twitter.com or x.com links using re.finditer
-    matches = list(URL_REGEX.finditer(message.content))
-    if matches:
-        spoiler_urls = []
-        non_spoiler_urls = []
-        for match in matches:
-            url = match.group(0)
-            start_index = match.start()
-            end_index = match.end()
-            # Check if the URL is wrapped in spoiler tags '||'
-            if start_index >= 2 and end_index + 2 <= len(message.content) and \
-               message.content[start_index-2:start_index] == "||" and \
-               message.content[end_index:end_index+2] == "||":
-                spoiler_urls.append(url)
-            else:
-                non_spoiler_urls.append(url)
-        
-        now = time.time()
-        last_time = user_rate_limit.get(message.author.id, 0)
-        if now - last_time < RATE_LIMIT_SECONDS:
-            logger.info(f"User {message.author} is rate limited. Time since last processing: {now - last_time:.2f} seconds.")
-            return
-        user_rate_limit[message.author.id] = now
+    
+    # Process twitter.com or x.com links
+    twitter_links = [link for link in links if link.platform == TWITTER]
+    guild_id = message.guild.id if message.guild else None
+    # The user is charged once per message: after the first platform is admitted, later checks skip the user scope
+    charge_user_id = message.author.id
+    if twitter_links:
+        # Check rate limits (only messages that actually contain a supported link are charged)
+        allowed, limited_scope = rate_limiter.check(TWITTER, charge_user_id, guild_id, message.channel.id)
+        if not allowed:
+            if limited_scope == "user":
+                logger.info(f"User {message.author} is rate limited for Twitter/X links.")
+                return
+            logger.warning(f"{limited_scope.capitalize()} rate limit exceeded for Twitter/X links, ignoring them")
+            twitter_links = []
+        else:
+            charge_user_id = None
+    if twitter_links:
+        spoiler_urls = [link.url for link in twitter_links if link.spoiler]
+        non_spoiler_urls = [link.url for link in twitter_links if not link.spoiler]
 
         # Attempt to delete the original message once
         try:
@@ -1384,12 +1774,10 @@ async def on_message(message):
                     webhook_permissions = bot_permissions.manage_webhooks
 
                 if webhook_permissions:
-                    webhook = None
                     try:
-                        webhook = await message.channel.create_webhook(name="TempWebhook")
-                        logger.info(f"Created temporary webhook in channel {message.channel} for message {message.id}")
-
-                        sent_message = await webhook.send(
+                        sent_message = await webhook_cache.send(
+                            message.channel,
+                            client,
                             content=response,
                             username=message.author.display_name,
                             avatar_url=message.author.display_avatar.url,
@@ -1415,15 +1803,9 @@ async def on_message(message):
                             logger.info(f"Sent modified message via bot fallback for message {message.id}")
                         except Exception as e2:
                             logger.error(f"Failed to send fallback message for message {message.id}: {e2}")
-                    finally:
-                        if webhook:
-                            try:
-                                await webhook.delete()
-                                logger.info(f"Deleted temporary webhook for message {message.id}")
-                            except Exception as e:
-                                logger.warning(f"Failed to delete temporary webhook for message {message.id}: {e}")
                 else:
                     logger.warning(f"No webhook permissions in channel {message.channel.id}, using fallback method")
+                    webhook_cache.invalidate(message.channel.id, "missing Manage Webhooks permission")
                     try:
                         user_id_mention = f"<@{message.author.id}>"
                         sent_message = await message.channel.send(f"**Link shared by {user_id_mention}:**\n{response}", view=view)
@@ -1440,245 +1822,37 @@ async def on_message(message):
                 except Exception as e:
                     logger.error(f"Failed to send message as bot for message {message.id}: {e}")
     
-    # Process TikTok links
-    tiktok_matches = list(TIKTOK_URL_REGEX.finditer(message.content))
-    if tiktok_matches:
-        # Check rate limit
-        now = time.time()
-        last_time = user_rate_limit.get(message.author.id, 0)
-        if now - last_time < RATE_LIMIT_SECONDS:
-            logger.info(f"User {message.author} is rate limited for TikTok link. Time since last processing: {now - last_time:.2f} seconds.")
-            return
-        user_rate_limit[message.author.id] = now
+    # Process video links (TikTok, Instagram, ...) through the media pipeline
+    allowed_platforms = set()
+    for provider in iter_providers():
+        media_urls = [link.url for link in links if link.platform == provider.key]
+        if not media_urls:
+            continue
         
-        # Extract TikTok URLs
-        tiktok_urls = [match.group(0) for match in tiktok_matches]
-        logger.info(f"Processing TikTok links from {message.author} (ID: {message.id}) with URLs: {tiktok_urls}")
+        # Check rate limits (video downloads have a separate, smaller global budget per platform)
+        allowed, limited_scope = rate_limiter.check(provider.key, charge_user_id, guild_id, message.channel.id)
+        if not allowed:
+            if limited_scope == "user":
+                # Only possible before any platform of this message was admitted, so nothing was charged
+                logger.info(f"User {message.author} is rate limited for {provider.name} link.")
+                return
+            logger.warning(f"{limited_scope.capitalize()} rate limit exceeded for {provider.name} links, ignoring them")
+            continue
+        charge_user_id = None
         
-        # Process each TikTok link
-        for tiktok_url in tiktok_urls:
-            # Validate and sanitize the URL
-            validated_url = validate_tiktok_url(tiktok_url)
-            
-            # Send a processing message
-            processing_msg = await message.channel.send(f"⏳ Downloading TikTok video from <@{message.author.id}>...")
-            
-            # Download the video
-            try:
-                result = await run_blocking(
-                    download_tiktok_video,
-                    validated_url,
-                    timeout_seconds=YTDLP_TIMEOUT_SECONDS
-                )
-            except asyncio.TimeoutError:
-                logger.error(f"TikTok download timed out for URL: {validated_url}")
-                await delete_message_silently(processing_msg)
-                continue
-            
-            if result['success']:
-                try:
-                    # Check file size (Discord has a file size limit)
-                    original_filepath = result['filepath']
-                    filepath = original_filepath
-                    file_size = os.path.getsize(filepath)
-                    
-                    # Discord's file size limit is 8MB for non-nitro, 50MB for nitro level 1, 100MB for nitro level 2
-                    # We'll use 8MB as a safe limit
-                    max_size = 8 * 1024 * 1024  # 8MB in bytes
-                    
-                    if file_size > max_size:
-                        logger.warning(f"TikTok video too large ({file_size} bytes). Attempting compression.")
-                        compressed_path = None
-                        try:
-                            compressed_path = await run_blocking(
-                                compress_video_to_limit,
-                                filepath,
-                                max_size,
-                                timeout_seconds=FFMPEG_TIMEOUT_SECONDS
-                            )
-                        except asyncio.TimeoutError:
-                            logger.error(f"FFmpeg compression timed out for {filepath}")
-                        if not compressed_path:
-                            # Clean up the file
-                            cleanup_file(filepath)
-                            # Delete the processing message silently
-                            await delete_message_silently(processing_msg)
-                            continue
-                        filepath = compressed_path
-                        file_size = os.path.getsize(filepath)
-                        if file_size > max_size:
-                            logger.warning(f"Compressed TikTok video still too large: {file_size} bytes")
-                            cleanup_file(filepath)
-                            if filepath != original_filepath:
-                                cleanup_file(original_filepath)
-                            await delete_message_silently(processing_msg)
-                            continue
-                        if filepath != original_filepath:
-                            cleanup_file(original_filepath)
-                    # Create a view with buttons for TikTok controls
-                    tiktok_view = TikTokControlView(original_url=validated_url, timeout=604800)  # 7 days timeout
-                    tiktok_view.original_author_id = message.author.id
-                    
-                    # Upload the video
-                    with open(filepath, 'rb') as f:
-                        file = discord.File(f, filename=os.path.basename(filepath))
-                        # Delete processing message and send new message with file
-                        await processing_msg.delete()
-                        sent_message = await message.channel.send(
-                            content=f"🎵 **TikTok video shared by <@{message.author.id}>:**\n{result['title']}",
-                            file=file,
-                            view=tiktok_view
-                        )
-                        tiktok_view.message = sent_message
-                        logger.info(f"Successfully uploaded TikTok video: {result['title']}")
-                    
-                    # Clean up the file
-                    cleanup_file(filepath)
-                    
-                    # Increment the links processed counter
-                    links_processed += 1
-                    
-                    # Try to delete the original message
-                    try:
-                        await message.delete()
-                        logger.info(f"Deleted original TikTok message {message.id} from {message.author}")
-                    except discord.Forbidden:
-                        logger.warning(f"Missing permissions to delete TikTok message {message.id} from {message.author}")
-                    except discord.HTTPException as e:
-                        logger.error(f"Failed to delete TikTok message {message.id}: {e}")
-                
-                except (discord.HTTPException, discord.Forbidden, OSError, IOError) as e:
-                    logger.error(f"Error uploading TikTok video: {e}")
-                    # Clean up the file if it exists
-                    cleanup_file(result['filepath'])
-                    if 'filepath' in locals() and filepath != result['filepath']:
-                        cleanup_file(filepath)
-                    # Delete the processing message silently
-                    await delete_message_silently(processing_msg)
-            else:
-                logger.error(f"TikTok download failed: {result.get('error', 'Unknown error')}")
-                # Delete the processing message silently
-                await delete_message_silently(processing_msg)
+        logger.info(f"Processing {provider.name} links from {message.author} (ID: {message.id}) with URLs: {media_urls}")
+        allowed_platforms.add(provider.key)
     
-    # Process Instagram links
-    instagram_matches = list(INSTAGRAM_URL_REGEX.finditer(message.content))
-    if instagram_matches:
-        # Check rate limit
-        now = time.time()
-        last_time = user_rate_limit.get(message.author.id, 0)
-        if now - last_time < RATE_LIMIT_SECONDS:
-            logger.info(f"User {message.author} is rate limited for Instagram link. Time since last processing: {now - last_time:.2f} seconds.")
-            return
-        user_rate_limit[message.author.id] = now
-        
-        # Extract Instagram URLs
-        instagram_urls = [match.group(0) for match in instagram_matches]
-        logger.info(f"Processing Instagram links from {message.author} (ID: {message.id}) with URLs: {instagram_urls}")
-        
-        # Process each Instagram link
-        for instagram_url in instagram_urls:
-            # Validate and sanitize the URL
-            validated_url = validate_instagram_url(instagram_url)
-            
-            # Send a processing message
-            processing_msg = await message.channel.send(f"⏳ Downloading Instagram video from <@{message.author.id}>...")
-            
-            # Download the video
-            try:
-                result = await run_blocking(
-                    download_instagram_video,
-                    validated_url,
-                    timeout_seconds=YTDLP_TIMEOUT_SECONDS
-                )
-            except asyncio.TimeoutError:
-                logger.error(f"Instagram download timed out for URL: {validated_url}")
-                await delete_message_silently(processing_msg)
-                continue
-            
-            if result['success']:
-                try:
-                    # Check file size (Discord has a file size limit)
-                    original_filepath = result['filepath']
-                    filepath = original_filepath
-                    file_size = os.path.getsize(filepath)
-                    
-                    # Discord's file size limit is 8MB for non-nitro, 50MB for nitro level 1, 100MB for nitro level 2
-                    # We'll use 8MB as a safe limit
-                    max_size = 8 * 1024 * 1024  # 8MB in bytes
-                    
-                    if file_size > max_size:
-                        logger.warning(f"Instagram video too large ({file_size} bytes). Attempting compression.")
-                        compressed_path = None
-                        try:
-                            compressed_path = await run_blocking(
-                                compress_video_to_limit,
-                                filepath,
-                                max_size,
-                                timeout_seconds=FFMPEG_TIMEOUT_SECONDS
-                            )
-                        except asyncio.TimeoutError:
-                            logger.error(f"FFmpeg compression timed out for {filepath}")
-                        if not compressed_path:
-                            # Clean up the file
-                            cleanup_file(filepath)
-                            # Delete the processing message silently
-                            await delete_message_silently(processing_msg)
-                            continue
-                        filepath = compressed_path
-                        file_size = os.path.getsize(filepath)
-                        if file_size > max_size:
-                            logger.warning(f"Compressed Instagram video still too large: {file_size} bytes")
-                            cleanup_file(filepath)
-                            if filepath != original_filepath:
-                                cleanup_file(original_filepath)
-                            await delete_message_silently(processing_msg)
-                            continue
-                        if filepath != original_filepath:
-                            cleanup_file(original_filepath)
-                    # Create a view with buttons for Instagram controls
-                    instagram_view = InstagramControlView(original_url=validated_url, timeout=604800)  # 7 days timeout
-                    instagram_view.original_author_id = message.author.id
-                    
-                    # Upload the video
-                    with open(filepath, 'rb') as f:
-                        file = discord.File(f, filename=os.path.basename(filepath))
-                        # Delete processing message and send new message with file
-                        await processing_msg.delete()
-                        sent_message = await message.channel.send(
-                            content=f"📸 **Instagram video shared by <@{message.author.id}>:**\n{result['title']}",
-                            file=file,
-                            view=instagram_view
-                        )
-                        instagram_view.message = sent_message
-                        logger.info(f"Successfully uploaded Instagram video: {result['title']}")
-                    
-                    # Clean up the file
-                    cleanup_file(filepath)
-                    
-                    # Increment the links processed counter
-                    links_processed += 1
-                    
-                    # Try to delete the original message
-                    try:
-                        await message.delete()
-                        logger.info(f"Deleted original Instagram message {message.id} from {message.author}")
-                    except discord.Forbidden:
-                        logger.warning(f"Missing permissions to delete Instagram message {message.id} from {message.author}")
-                    except discord.HTTPException as e:
-                        logger.error(f"Failed to delete Instagram message {message.id}: {e}")
-                
-                except (discord.HTTPException, discord.Forbidden, OSError, IOError) as e:
-                    logger.error(f"Error uploading Instagram video: {e}")
-                    # Clean up the file if it exists
-                    cleanup_file(result['filepath'])
-                    if 'filepath' in locals() and filepath != result['filepath']:
-                        cleanup_file(filepath)
-                    # Delete the processing message silently
-                    await delete_message_silently(processing_msg)
-            else:
-                logger.error(f"Instagram download failed: {result.get('error', 'Unknown error')}")
-                # Delete the processing message silently
-                await delete_message_silently(processing_msg)
+    # Queue the message's video links, in the order they appear, as one job so the event handler returns immediately
+    media_links = [(get_provider(link.platform), link.url) for link in links if link.platform in allowed_platforms]
+    if media_links and not media_queue.submit(MediaJob(message, media_links)):
+        try:
+            await message.channel.send(
+                "⚠️ Too many videos are being processed right now. Please share the link again in a minute.",
+                delete_after=15
+            )
+        except (discord.HTTPException, discord.Forbidden) as e:
+            logger.warning(f"Failed to send queue full notice for message {message.id}: {e}")
 
 # Run the bot
 client.run(TOKEN)
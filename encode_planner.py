@@ -0,0 +1,319 @@
+import asyncio
+import collections
+import json
+import logging
+import math
+import os
+import time
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+# Encode planner configuration (via environment variables)
+ENCODE_MODEL_PATH = os.getenv('ENCODE_MODEL_PATH') or data_path('encode_model.json')
+ENCODE_MODEL_SAMPLES = int(os.getenv('ENCODE_MODEL_SAMPLES', '500'))  # Past encodes the size model is fitted on
+ENCODE_MODEL_SAVE_SECONDS = float(os.getenv('ENCODE_MODEL_SAVE_SECONDS', '60'))  # Minimum time between model saves
+
+# (short side in pixels, max fps) from best to worst; a portrait 1080x1920 clip is a 1080 rung
+RESOLUTION_LADDER = ((1080, 60), (1080, 30), (720, 30), (540, 30), (480, 30), (360, 30), (240, 24))
+
+# Below this many bits per pixel per frame a rung looks worse than the next one down at the same bitrate
+MIN_BITS_PER_PIXEL = 0.04
+MIN_VIDEO_BITRATE = 64_000
+DEFAULT_AUDIO_BITRATE = 96_000
+
+# Share of the upload limit the predicted output may use (container overhead, Discord metadata)
+SIZE_HEADROOM = 0.95
+
+# Encodes needed (per encoder) before the fitted model replaces the 1:1 prior
+MIN_FIT_SAMPLES = 8
+# Fitted output/requested size ratios are clamped to this range
+RATIO_BOUNDS = (0.7, 2.0)
+
+
+def _features(bits_per_pixel, duration):
+    return [1.0, math.log(max(bits_per_pixel, 1e-4)), 1.0 / max(duration, 1.0)]
+
+
+def _solve(matrix, vector):
+    """Solve a small dense linear system by Gaussian elimination; None if it is singular"""
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(rows[r][col]))
+        if abs(rows[pivot][col]) < 1e-12:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for r in range(n):
+            if r != col:
+                factor = rows[r][col] / rows[col][col]
+                rows[r] = [a - factor * b for a, b in zip(rows[r], rows[col])]
+    return [rows[i][n] / rows[i][i] for i in range(n)]
+
+
+def fit_ratio_model(samples, ridge=1e-3):
+    """
+    Least-squares fit of output/requested size ratio against _features.
+    Returns the coefficients, or None if there are too few samples.
+    """
+    if len(samples) < MIN_FIT_SAMPLES:
+        return None
+    size = 3
+    xtx = [[0.0] * size for _ in range(size)]
+    xty = [0.0] * size
+    for sample in samples:
+        x = _features(sample['bpp'], sample['duration'])
+        for i in range(size):
+            xty[i] += x[i] * sample['ratio']
+            for j in range(size):
+                xtx[i][j] += x[i] * x[j]
+    for i in range(1, size):
+        xtx[i][i] += ridge  # Keeps the fit stable when every sample has a similar shape
+    return _solve(xtx, xty)
+
+
+class EncodePlan:
+    """Output resolution, frame rate and bitrates chosen for one encode"""
+    __slots__ = ('width', 'height', 'fps', 'source_width', 'source_height', 'source_fps',
+                 'video_bitrate', 'audio_bitrate', 'duration', 'rung', 'ratio', 'encoder')
+
+    def __init__(self, width, height, fps, source, video_bitrate, audio_bitrate, duration, rung, ratio, encoder):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.source_width, self.source_height, self.source_fps = source
+        self.video_bitrate = int(video_bitrate)
+        self.audio_bitrate = int(audio_bitrate)
+        self.duration = duration
+        self.rung = rung  # Index into the candidate rungs for this source
+        self.ratio = ratio  # Predicted output/requested size ratio
+        self.encoder = encoder
+
+    @property
+    def bits_per_pixel(self):
+        if not (self.width and self.height and self.fps):
+            return MIN_BITS_PER_PIXEL
+        return self.video_bitrate / (self.width * self.height * self.fps)
+
+    @property
+    def requested_size(self):
+        """Output size in bytes if the encoder hit the requested bitrates exactly"""
+        return (self.video_bitrate + self.audio_bitrate) * self.duration / 8
+
+    @property
+    def predicted_size(self):
+        return self.requested_size * self.ratio
+
+    def video_filter_args(self):
+        """ffmpeg arguments that scale and/or drop frames to this plan's rung"""
+        args = []
+        if self.width and self.source_width and (self.width, self.height) != (self.source_width, self.source_height):
+            args += ["-vf", f"scale={self.width}:{self.height}"]
+        if self.fps and self.source_fps and self.fps < self.source_fps - 0.5:
+            args += ["-r", f"{self.fps:g}"]
+        return args
+
+    def __repr__(self):
+        return (f"<EncodePlan {self.width}x{self.height}@{self.fps or 0:g} "
+                f"video={self.video_bitrate} audio={self.audio_bitrate} predicted={self.predicted_size:.0f}>")
+
+
+class EncodePlanner:
+    """
+    Chooses resolution, frame rate and bitrate together so the output fits the upload limit.
+
+    The highest rung of RESOLUTION_LADDER that still gets MIN_BITS_PER_PIXEL at the
+    affordable bitrate is used. Encoders don't hit the requested bitrate exactly, so the
+    affordable bitrate comes from a model of output/requested size fitted on past encodes
+    (per encoder, persisted to model_path at most every save_interval seconds, off the
+    event loop). When an encode still comes out too large, one retry is planned at the
+    next rung down using the miss observed on that file.
+    """
+
+    def __init__(self, model_path, max_samples, save_interval=ENCODE_MODEL_SAVE_SECONDS):
+        self.model_path = model_path
+        self.save_interval = save_interval
+        self.dirty = False  # Samples recorded since the last save
+        self.last_save = 0.0  # time.monotonic() of the last save
+        self.save_task = None
+        self.save_lock = asyncio.Lock()  # One write of the model file at a time
+        self.samples = collections.deque(maxlen=max(MIN_FIT_SAMPLES, max_samples))
+        self.coefficients = {}  # Maps encoder name to fitted coefficients
+        self.stats = {
+            'encodes': 0,  # Encodes measured against their prediction
+            'first_tries': 0,
+            'first_try_fits': 0,
+            'retries': 0,
+            'retry_fits': 0,
+            'abs_error_sum': 0.0,  # Sum of |actual - predicted| / predicted
+        }
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.model_path):
+            return
+        try:
+            with open(self.model_path, 'r', encoding='utf-8') as f:
+                self.samples.extend(json.load(f).get('samples', []))
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring unreadable encode model {self.model_path}: {e}")
+            return
+        for encoder in {sample['encoder'] for sample in self.samples}:
+            self._refit(encoder)
+        logger.info(f"Loaded encode size model with {len(self.samples)} sample(s)")
+
+    def _write(self, samples):
+        tmp_path = f"{self.model_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'samples': samples}, f)
+            os.replace(tmp_path, self.model_path)
+        except OSError as e:
+            logger.warning(f"Failed to save encode model: {e}")
+
+    async def _save_soon(self):
+        # Samples recorded while waiting or writing are picked up by the next round
+        while self.dirty:
+            await asyncio.sleep(max(0.0, self.last_save + self.save_interval - time.monotonic()))
+            await self.flush()
+
+    def _schedule_save(self):
+        self.dirty = True
+        if self.save_task is not None and not self.save_task.done():
+            return
+        try:
+            self.save_task = asyncio.get_running_loop().create_task(self._save_soon())
+        except RuntimeError:
+            # No event loop (e.g. a benchmark script): write right away
+            self.dirty = False
+            self._write(list(self.samples))
+
+    async def flush(self):
+        """Write unsaved samples now, in a worker thread (also called on shutdown)"""
+        async with self.save_lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+            self.last_save = time.monotonic()
+            await asyncio.to_thread(self._write, list(self.samples))
+
+    def _refit(self, encoder):
+        self.coefficients[encoder] = fit_ratio_model([s for s in self.samples if s['encoder'] == encoder])
+
+    def predict_ratio(self, encoder, bits_per_pixel, duration):
+        """Predicted output/requested size ratio for an encode"""
+        coefficients = self.coefficients.get(encoder)
+        if coefficients is None:
+            return 1.0
+        ratio = sum(c * x for c, x in zip(coefficients, _features(bits_per_pixel, duration)))
+        return min(max(ratio, RATIO_BOUNDS[0]), RATIO_BOUNDS[1])
+
+    @staticmethod
+    def candidate_rungs(width, height, fps):
+        """(width, height, fps) per ladder rung for a source, without upscaling or duplicates"""
+        if not (width and height):
+            return [(None, None, fps)]
+        short_side = min(width, height)
+        rungs = []
+        for rung_short, rung_fps in RESOLUTION_LADDER:
+            scale = min(1.0, rung_short / short_side)
+            # libx264 needs even dimensions
+            rung = (
+                max(2, int(round(width * scale / 2)) * 2),
+                max(2, int(round(height * scale / 2)) * 2),
+                min(fps, rung_fps) if fps else rung_fps,
+            )
+            if rung not in rungs:
+                rungs.append(rung)
+        return rungs
+
+    def plan(self, probe, max_size_bytes, encoder, below_rung=None, min_ratio=None):
+        """
+        Plan an encode of a probed file for max_size_bytes.
+
+        Args:
+            below_rung: Only consider rungs below this one (used for the retry)
+            min_ratio: Lower bound for the predicted size ratio (the miss observed on this file)
+
+        Returns:
+            EncodePlan, or None without a known duration or with no rung left.
+        """
+        duration = probe.duration if probe is not None else None
+        if duration is None:
+            return None
+        video, audio = probe.video, probe.audio
+        audio_bitrate = 0
+        if audio is not None:
+            audio_bitrate = min(DEFAULT_AUDIO_BITRATE, audio.bit_rate) if audio.bit_rate else DEFAULT_AUDIO_BITRATE
+        source = (video.width, video.height, video.fps) if video is not None else (None, None, None)
+        budget_bps = max_size_bytes * 8 * SIZE_HEADROOM / duration
+
+        rungs = self.candidate_rungs(*source)
+        first = 0 if below_rung is None else below_rung + 1
+        if first >= len(rungs):
+            return None
+        chosen = None
+        for index in range(first, len(rungs)):
+            width, height, fps = rungs[index]
+            pixels_per_second = (width * height * fps) if width and fps else None
+            video_bitrate = budget_bps - audio_bitrate
+            ratio = 1.0
+            # The ratio depends on bits per pixel, which depends on the bitrate: two rounds converge well enough
+            for _ in range(2):
+                bpp = video_bitrate / pixels_per_second if pixels_per_second else MIN_BITS_PER_PIXEL
+                ratio = self.predict_ratio(encoder, bpp, duration)
+                if min_ratio:
+                    ratio = max(ratio, min_ratio)
+                video_bitrate = max(budget_bps / ratio - audio_bitrate, MIN_VIDEO_BITRATE)
+            if video is not None and video.bit_rate:
+                # Spending more bits than the source has doesn't improve it
+                video_bitrate = min(video_bitrate, video.bit_rate)
+            chosen = EncodePlan(width, height, fps, source, video_bitrate, audio_bitrate, duration, index, ratio, encoder)
+            if not pixels_per_second or video_bitrate / pixels_per_second >= MIN_BITS_PER_PIXEL:
+                break
+        return chosen
+
+    def replan(self, probe, plan, actual_size, max_size_bytes):
+        """Plan the single retry after plan produced actual_size bytes (over the limit)"""
+        self.stats['retries'] += 1
+        observed_ratio = actual_size / max(plan.requested_size, 1)
+        retry = self.plan(probe, max_size_bytes, plan.encoder, below_rung=plan.rung, min_ratio=observed_ratio)
+        if retry is None:
+            # Already at the lowest rung: stay there with the observed ratio
+            retry = self.plan(probe, max_size_bytes, plan.encoder, below_rung=plan.rung - 1, min_ratio=observed_ratio)
+        return retry
+
+    def record(self, plan, actual_size, max_size_bytes, retry=False):
+        """Add a finished encode to the model and the accuracy stats"""
+        predicted = plan.predicted_size
+        fits = actual_size <= max_size_bytes
+        self.stats['encodes'] += 1
+        if not retry:
+            self.stats['first_tries'] += 1
+        if predicted > 0:
+            self.stats['abs_error_sum'] += abs(actual_size - predicted) / predicted
+        if fits:
+            self.stats['retry_fits' if retry else 'first_try_fits'] += 1
+        if plan.requested_size > 0:
+            self.samples.append({
+                'encoder': plan.encoder,
+                'bpp': plan.bits_per_pixel,
+                'duration': plan.duration,
+                'ratio': actual_size / plan.requested_size,
+            })
+            self._refit(plan.encoder)
+            self._schedule_save()
+        logger.info(
+            f"Encode at {plan.width}x{plan.height}: {actual_size} bytes, predicted {predicted:.0f} "
+            f"({(actual_size - predicted) / max(predicted, 1) * 100:+.1f}%)"
+        )
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['first_try_rate'] = stats['first_try_fits'] / stats['first_tries'] if stats['first_tries'] else 0.0
+        stats['avg_abs_error'] = stats['abs_error_sum'] / stats['encodes'] if stats['encodes'] else 0.0
+        stats['samples'] = len(self.samples)
+        return stats
+
+
+encode_planner = EncodePlanner(ENCODE_MODEL_PATH, ENCODE_MODEL_SAMPLES)
@@ -0,0 +1,187 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+from urllib.parse import urljoin
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Short link resolver configuration (via environment variables)
+SHORT_LINK_RESOLVER_ENABLED = os.getenv('SHORT_LINK_RESOLVER_ENABLED', 'true').lower() in ('true', '1', 'yes')
+# A short link always points at the same video, so expansions can be kept for a long time
+SHORT_LINK_TTL_SECONDS = int(os.getenv('SHORT_LINK_TTL_SECONDS', str(7 * 24 * 3600)))
+SHORT_LINK_MAX_ENTRIES = int(os.getenv('SHORT_LINK_MAX_ENTRIES', '4096'))
+SHORT_LINK_TIMEOUT_SECONDS = float(os.getenv('SHORT_LINK_TIMEOUT_SECONDS', '5'))
+SHORT_LINK_CONCURRENCY = int(os.getenv('SHORT_LINK_CONCURRENCY', '8'))  # Expansions in flight at once
+
+# Redirects followed per short link before giving up (vm.tiktok.com normally needs one)
+MAX_REDIRECTS = 5
+
+# TikTok answers the default aiohttp user agent with a bot check page instead of a redirect
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+)
+
+
+class ShortLinkResolver:
+    """
+    Expands short links (vm.tiktok.com/..., tiktok.com/t/...) to their canonical URL.
+
+    Each short link is expanded once by following its redirects (without downloading the
+    page they end on) until a URL the provider can take a video ID from, and the mapping
+    is cached for ttl_seconds. Links resolved together share one keep-alive session and
+    run concurrently; a link already being expanded by another message is awaited rather
+    than requested twice. Failed expansions are not cached: the original link is used
+    and yt-dlp follows the redirect itself.
+    """
+
+    def __init__(self, ttl_seconds, max_entries, timeout, concurrency, enabled=True):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.enabled = enabled
+        self.entries = collections.OrderedDict()  # Maps short URL to (expiry timestamp, canonical URL), LRU order
+        self.pending = {}  # Maps short URL to the future of its running expansion
+        self.slots = asyncio.Semaphore(max(1, concurrency))
+        self.session = None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,  # Lookups that joined an expansion already in flight
+            'resolved': 0,
+            'failures': 0,
+            'batches': 0,
+            'resolve_seconds': 0.0,
+        }
+
+    def get(self, short_url):
+        """Return the cached canonical URL for short_url, or None"""
+        cached = self.entries.get(short_url)
+        if cached is None:
+            return None
+        if cached[0] <= time.time():
+            del self.entries[short_url]
+            return None
+        self.entries.move_to_end(short_url)
+        return cached[1]
+
+    def put(self, short_url, canonical_url):
+        self.entries[short_url] = (time.time() + self.ttl_seconds, canonical_url)
+        self.entries.move_to_end(short_url)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': USER_AGENT},
+            )
+        return self.session
+
+    async def _expand(self, short_url, canonicalize):
+        """Follow short_url's redirects until canonicalize() accepts one; None if none does"""
+        url = short_url
+        session = self._get_session()
+        async with self.slots:
+            for _ in range(MAX_REDIRECTS):
+                async with session.get(url, allow_redirects=False) as response:
+                    location = response.headers.get('Location')
+                    if response.status not in (301, 302, 303, 307, 308) or not location:
+                        return None
+                url = urljoin(url, location)
+                canonical = canonicalize(url)
+                if canonical:
+                    return canonical
+        return None
+
+    async def _resolve(self, short_url, canonicalize):
+        started = time.perf_counter()
+        try:
+            canonical = await self._expand(short_url, canonicalize)
+        except Exception as e:
+            # Network errors, but also malformed redirects (bad Location header, URL decoding):
+            # any failure just means the original link goes to yt-dlp
+            logger.warning(f"Failed to expand short link {short_url}: {e!r}")
+            canonical = None
+        self.stats['resolve_seconds'] += time.perf_counter() - started
+        if canonical is None:
+            self.stats['failures'] += 1
+            return None
+        self.stats['resolved'] += 1
+        self.put(short_url, canonical)
+        logger.info(f"Expanded short link {short_url} to {canonical}")
+        return canonical
+
+    @staticmethod
+    def cache_key(short_url):
+        """Share-tracking query strings (?_t=...&_r=1) don't change where a short link points"""
+        return short_url.split('?', 1)[0].rstrip('/')
+
+    async def resolve_many(self, short_urls, canonicalize):
+        """
+        Expand a batch of short links concurrently.
+
+        Args:
+            short_urls: Short links to expand (links differing only in their query string are expanded once)
+            canonicalize: Function returning the canonical URL for a redirect target,
+                or None if the target isn't a video URL yet
+
+        Returns:
+            dict: Maps each short link to its canonical URL, or None if it couldn't be expanded
+        """
+        if not self.enabled:
+            return {url: None for url in short_urls}
+        results = {}
+        waiting = {}  # Maps cache key to the future of its expansion
+        started = False
+        for url in short_urls:
+            key = self.cache_key(url)
+            if key in waiting or key in results:
+                continue
+            canonical = self.get(key)
+            if canonical is not None:
+                self.stats['hits'] += 1
+                results[key] = canonical
+                continue
+            self.stats['misses'] += 1
+            future = self.pending.get(key)
+            if future is not None:
+                self.stats['coalesced'] += 1
+            else:
+                future = asyncio.ensure_future(self._resolve(key, canonicalize))
+                self.pending[key] = future
+                future.add_done_callback(lambda _, key=key: self.pending.pop(key, None))
+                started = True
+            waiting[key] = future
+        if started:
+            self.stats['batches'] += 1
+        if waiting:
+            # Shielded so one message going away doesn't cancel an expansion another one shares
+            expanded = await asyncio.gather(*(asyncio.shield(f) for f in waiting.values()))
+            results.update(zip(waiting, expanded))
+        return {url: results[self.cache_key(url)] for url in short_urls}
+
+    async def resolve(self, short_url, canonicalize):
+        return (await self.resolve_many([short_url], canonicalize))[short_url]
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        expansions = stats['resolved'] + stats['failures']
+        stats['avg_resolve_seconds'] = stats['resolve_seconds'] / expansions if expansions else 0.0
+        stats['entries'] = len(self.entries)
+        stats['in_flight'] = len(self.pending)
+        return stats
+
+
+link_resolver = ShortLinkResolver(
+    SHORT_LINK_TTL_SECONDS, SHORT_LINK_MAX_ENTRIES, SHORT_LINK_TIMEOUT_SECONDS, SHORT_LINK_CONCURRENCY,
+    SHORT_LINK_RESOLVER_ENABLED,
+)
@@ -0,0 +1,78 @@
+import re
+from media_providers import iter_providers
+
+# Platform key for Twitter/X links, which are rewritten rather than downloaded
+TWITTER = 'twitter'
+
+# Regex to match URLs that start with http(s):// and include twitter.com or x.com
+TWITTER_URL_REGEX = re.compile(r'(https?://(?:www\.)?(?:twitter\.com|x\.com)/\S+)', re.IGNORECASE)
+TWITTER_DOMAINS = ('twitter.com', 'x.com')
+
+
+class LinkMatch:
+    """A supported link found in a message"""
+    __slots__ = ('platform', 'url', 'start', 'end', 'spoiler')
+
+    def __init__(self, platform, url, start, end, spoiler):
+        self.platform = platform
+        self.url = url
+        self.start = start
+        self.end = end
+        self.spoiler = spoiler
+
+    def __repr__(self):
+        return f"<LinkMatch {self.platform} {self.url!r} spoiler={self.spoiler}>"
+
+
+class LinkScanner:
+    """
+    Finds every supported link in a message with a single regex pass.
+
+    Most messages contain no link at all, so scan() first checks for '://' and 'http' and
+    then for a known domain with plain substring tests, and only runs the combined pattern
+    (one named group per platform) when all of them succeed.
+    """
+
+    def __init__(self, providers):
+        patterns = [(TWITTER, TWITTER_URL_REGEX.pattern)]
+        domains = list(TWITTER_DOMAINS)
+        for provider in providers:
+            patterns.append((provider.key, provider.url_regex.pattern))
+            domains.extend(provider.domains)
+        self.domains = tuple(domains)
+        self.regex = re.compile(
+            '|'.join(f'(?P<{key}>{pattern})' for key, pattern in patterns),
+            re.IGNORECASE
+        )
+
+    def might_contain_links(self, content):
+        """Cheap prefilter: False means the message definitely has no supported link"""
+        # '://' has no case variants, so it rejects almost every message without lowercasing it
+        if '://' not in content:
+            return False
+        lowered = content.lower()
+        if 'http' not in lowered:
+            return False
+        return any(domain in lowered for domain in self.domains)
+
+    def scan(self, content):
+        """
+        Scan message content for supported links.
+
+        Returns:
+            list: LinkMatch objects in the order they appear in the message.
+        """
+        if not content or not self.might_contain_links(content):
+            return []
+        links = []
+        content_length = len(content)
+        for match in self.regex.finditer(content):
+            start, end = match.span()
+            # Check if the URL is wrapped in spoiler tags '||'
+            spoiler = (start >= 2 and end + 2 <= content_length and
+                       content[start - 2:start] == '||' and content[end:end + 2] == '||')
+            links.append(LinkMatch(match.lastgroup, match.group(0), start, end, spoiler))
+        return links
+
+
+link_scanner = LinkScanner(iter_providers())
@@ -0,0 +1,293 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Media cache configuration (via environment variables)
+MEDIA_CACHE_ENABLED = os.getenv('MEDIA_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'vxtwitter_media_cache'))
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))  # 2GB
+MEDIA_CACHE_TTL_SECONDS = int(os.getenv('MEDIA_CACHE_TTL_SECONDS', str(24 * 3600)))  # 24 hours
+
+# Variant name for the untouched yt-dlp download. Size-limited variants use the limit in bytes.
+RAW_VARIANT = 'raw'
+
+INDEX_FILENAME = 'index.json'
+
+# Subdirectory holding the private links handed out by get() (emptied on startup)
+CHECKOUT_DIRNAME = 'checkout'
+
+
+class MediaCache:
+    """
+    On-disk cache for downloaded and compressed videos.
+
+    Entries are keyed by (platform, canonical video id, variant), where the variant is
+    either RAW_VARIANT for the original download or the upload size limit (in bytes)
+    the file was compressed for. The cache is bounded by a total byte budget with LRU
+    eviction, and every entry expires after ttl_seconds.
+
+    Callers never work on the cached files themselves: get() hands out a private hard
+    link (a copy where links aren't possible) and put() links the caller's file into the
+    cache, so eviction, expiry or a concurrent put can't delete a file a job is still
+    probing, encoding or uploading, and every returned path is the caller's to clean up.
+    """
+
+    def __init__(self, cache_dir, max_bytes, ttl_seconds, enabled=True):
+        self.cache_dir = cache_dir
+        self.checkout_dir = os.path.join(cache_dir, CHECKOUT_DIRNAME)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.entries = OrderedDict()  # Maps cache key to entry dict, least recently used first
+        self.pins = Counter()  # Keys of entries being copied out by get(), which must not be removed meanwhile
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+        if self.enabled:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Checkouts left behind by a previous run are no longer used by anyone
+                shutil.rmtree(self.checkout_dir, ignore_errors=True)
+                os.makedirs(self.checkout_dir, exist_ok=True)
+                self._load_index()
+            except OSError as e:
+                logger.error(f"Failed to initialise media cache at {self.cache_dir}, disabling it: {e}")
+                self.enabled = False
+
+    @staticmethod
+    def make_key(platform, video_id, variant):
+        """Build the cache key for a platform/video/variant triple"""
+        return f"{platform}:{video_id}:{variant}"
+
+    def _entry_path(self, platform, video_id, variant, ext):
+        safe_id = ''.join(c for c in str(video_id) if c.isalnum() or c in '-_')
+        return os.path.join(self.cache_dir, f"{platform}_{safe_id}_{variant}{ext}")
+
+    def _load_index(self):
+        """Load the persisted index, dropping entries whose files have disappeared"""
+        index_path = os.path.join(self.cache_dir, INDEX_FILENAME)
+        if not os.path.exists(index_path):
+            return
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable media cache index {index_path}: {e}")
+            return
+
+        # Entries were saved in LRU order, so re-inserting keeps the recency information
+        for key, entry in stored:
+            if os.path.exists(entry.get('path', '')):
+                self.entries[key] = entry
+                self.total_bytes += entry.get('size', 0)
+        logger.info(f"Loaded media cache index with {len(self.entries)} entries ({self.total_bytes} bytes)")
+
+    def _save_index(self):
+        """Persist the index atomically so a crash never leaves a half-written file"""
+        index_path = os.path.join(self.cache_dir, INDEX_FILENAME)
+        tmp_path = f"{index_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(list(self.entries.items()), f)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            logger.warning(f"Failed to save media cache index: {e}")
+
+    def _remove_entry(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_bytes -= entry.get('size', 0)
+        try:
+            if os.path.exists(entry['path']):
+                os.remove(entry['path'])
+        except OSError as e:
+            logger.warning(f"Failed to remove cached file {entry['path']}: {e}")
+
+    def _is_expired(self, entry, now):
+        return now - entry.get('created', 0) > self.ttl_seconds
+
+    def _evict_to_budget(self):
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self.pins:
+                continue
+            logger.info(f"Evicting media cache entry {key} to stay within {self.max_bytes} bytes")
+            self._remove_entry(key)
+            self.stats['evictions'] += 1
+
+    def _lookup(self, key, now):
+        """Return the live entry for key (refreshing its recency) or None. Caller holds the lock."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry, now) or not os.path.exists(entry['path']):
+            if key not in self.pins:
+                self._remove_entry(key)
+                self.stats['expirations'] += 1
+            return None
+        entry['last_access'] = now
+        self.entries.move_to_end(key)
+        return entry
+
+
+    def get(self, platform, video_id, variant):
+        """
+        Look up a cached file.
+
+        Returns:
+            dict: A copy of the entry ('path', 'size', 'title', ...) or None on a miss. Its
+                'path' is a private link to the cached file that the caller must clean up.
+        """
+        if not self.enabled or not video_id:
+            return None
+        key = self.make_key(platform, video_id, variant)
+        with self.lock:
+            entry = self._lookup(key, time.time())
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            entry = dict(entry)
+            base, ext = os.path.splitext(os.path.basename(entry['path']))
+            checkout_path = os.path.join(self.checkout_dir, f"{base}_{uuid.uuid4().hex[:8]}{ext}")
+            try:
+                os.link(entry['path'], checkout_path)
+                linked = True
+            except OSError:
+                # No hard links here: copy outside the lock, with the entry pinned meanwhile
+                linked = False
+                self.pins[key] += 1
+
+        if not linked:
+            try:
+                shutil.copyfile(entry['path'], checkout_path)
+            except OSError as e:
+                logger.warning(f"Failed to check out cached file {entry['path']}: {e}")
+                try:
+                    os.remove(checkout_path)
+                except OSError:
+                    pass
+                checkout_path = None
+            with self.lock:
+                self.pins[key] -= 1
+                if not self.pins[key]:
+                    del self.pins[key]
+                    self._evict_to_budget()  # Catch up on evictions skipped while pinned
+
+        with self.lock:
+            if checkout_path is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+        return dict(entry, path=checkout_path)
+
+    def put(self, platform, video_id, variant, source_path, title=None):
+        """
+        Add a finished file to the cache.
+
+        The file is hard linked (copied where links aren't possible) into the cache, so the
+        caller keeps source_path and remains responsible for cleaning it up. A live entry
+        for the same variant is kept rather than replaced. Returns source_path.
+        """
+        if not self.enabled or not video_id:
+            return source_path
+        try:
+            size = os.path.getsize(source_path)
+        except OSError as e:
+            logger.warning(f"Cannot cache missing file {source_path}: {e}")
+            return source_path
+        if size > self.max_bytes:
+            logger.info(f"Not caching {source_path}: {size} bytes exceeds cache budget")
+            return source_path
+
+        _, ext = os.path.splitext(source_path)
+        key = self.make_key(platform, video_id, variant)
+        cached_path = self._entry_path(platform, video_id, variant, ext)
+
+        # Linked (or copied) under a temporary name first, so a slow copy doesn't hold the lock
+        staged_path = f"{cached_path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            try:
+                os.link(source_path, staged_path)
+            except OSError:
+                shutil.copyfile(source_path, staged_path)
+        except OSError as e:
+            logger.warning(f"Failed to add {source_path} to media cache: {e}")
+            return source_path
+
+        with self.lock:
+            if self._lookup(key, time.time()) is not None:
+                # Another job stored this variant first; its file may be checked out, so keep it
+                try:
+                    os.remove(staged_path)
+                except OSError as e:
+                    logger.warning(f"Failed to remove staged file {staged_path}: {e}")
+                logger.info(f"Keeping existing media cache entry {key}")
+                return source_path
+            try:
+                os.replace(staged_path, cached_path)
+            except OSError as e:
+                logger.warning(f"Failed to add {source_path} to media cache: {e}")
+                try:
+                    os.remove(staged_path)
+                except OSError:
+                    pass
+                return source_path
+
+            now = time.time()
+            self.entries[key] = {
+                'path': cached_path,
+                'size': size,
+                'title': title,
+                'created': now,
+                'last_access': now,
+            }
+            self.total_bytes += size
+            self.stats['stores'] += 1
+            self._evict_to_budget()
+            self._save_index()
+
+        logger.info(f"Stored {key} in media cache ({size} bytes)")
+        return source_path
+
+    def purge_expired(self):
+        """Drop expired entries; called from the periodic maintenance task"""
+        if not self.enabled:
+            return 0
+        now = time.time()
+        with self.lock:
+            expired = [key for key, entry in self.entries.items()
+                       if self._is_expired(entry, now) and key not in self.pins]
+            for key in expired:
+                self._remove_entry(key)
+            self.stats['expirations'] += len(expired)
+            if expired:
+                self._save_index()
+        return len(expired)
+
+    def get_stats(self):
+        """Return counters and current usage for status reporting"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.total_bytes
+        return stats
+
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_TTL_SECONDS, enabled=MEDIA_CACHE_ENABLED)
@@ -0,0 +1,223 @@
+import copy
+import glob
+import logging
+import os
+import threading
+import time
+from ytdlp_pool import youtubedl_session
+
+logger = logging.getLogger(__name__)
+
+# How long extracted yt-dlp metadata is reused before extracting again (seconds).
+# Media URLs inside the info dict are signed and expire, so keep this well below a few hours.
+INFO_CACHE_TTL_SECONDS = int(os.getenv('INFO_CACHE_TTL_SECONDS', '600'))
+INFO_CACHE_MAX_ENTRIES = int(os.getenv('INFO_CACHE_MAX_ENTRIES', '500'))
+
+
+class InfoCache:
+    """Thread-safe TTL cache of yt-dlp info dicts keyed by URL"""
+
+    def __init__(self, ttl_seconds, max_entries):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = {}  # Maps URL to (expiry timestamp, info dict)
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, url):
+        """Return a private copy of the cached info dict for url, or None"""
+        now = time.time()
+        with self.lock:
+            cached = self.entries.get(url)
+            if cached is None or cached[0] <= now:
+                self.entries.pop(url, None)
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            info = cached[1]
+        # yt-dlp mutates the info dict while downloading, so never hand out the shared copy
+        return copy.deepcopy(info)
+
+    def put(self, url, info):
+        now = time.time()
+        with self.lock:
+            if len(self.entries) >= self.max_entries:
+                # Drop expired entries first, then the entry closest to expiry
+                for key in [k for k, (expiry, _) in self.entries.items() if expiry <= now]:
+                    del self.entries[key]
+                if len(self.entries) >= self.max_entries:
+                    del self.entries[min(self.entries, key=lambda k: self.entries[k][0])]
+            self.entries[url] = (now + self.ttl_seconds, copy.deepcopy(info))
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        return stats
+
+
+info_cache = InfoCache(INFO_CACHE_TTL_SECONDS, INFO_CACHE_MAX_ENTRIES)
+
+
+def extract_info_once(ydl, video_url):
+    """
+    Resolve metadata for a URL with a single extraction, reusing a cached info dict if available.
+
+    The returned dict is fully processed (formats selected, title, duration, filesize)
+    and can be passed straight to ydl.process_ie_result(info, download=True).
+    """
+    info = info_cache.get(video_url)
+    if info is not None:
+        logger.info(f"Using cached metadata for {video_url}")
+        return info
+    info = ydl.extract_info(video_url, download=False)
+    info_cache.put(video_url, info)
+    return info
+
+
+def get_estimated_filesize(info):
+    """Return the (approximate) size in bytes of the selected format, or None if unknown"""
+    size = info.get('filesize') or info.get('filesize_approx')
+    if size:
+        return size
+    requested = info.get('requested_formats') or []
+    sizes = [f.get('filesize') or f.get('filesize_approx') for f in requested]
+    if requested and all(sizes):
+        return sum(sizes)
+    return None
+
+
+# Only trust a size estimate derived from bitrates (not an exact filesize) up to this fraction of the limit
+APPROX_SIZE_HEADROOM = 0.9
+
+
+def estimate_format_size(fmt, duration):
+    """
+    Return (size_in_bytes, exact) for one format entry, or (None, False) if it can't be estimated.
+    Uses filesize, then filesize_approx, then total bitrate (kbit/s) x duration.
+    """
+    if fmt.get('filesize'):
+        return fmt['filesize'], True
+    if fmt.get('filesize_approx'):
+        return fmt['filesize_approx'], False
+    tbr = fmt.get('tbr')
+    if tbr and duration:
+        return int(tbr * 1000 / 8 * duration), False
+    return None, False
+
+
+def select_format_for_size(info, max_size_bytes):
+    """
+    Pick the best rendition that already fits within max_size_bytes.
+
+    Only formats carrying both audio and video are considered, which is what 'best' picks
+    from as well, so the result needs no merging. yt-dlp sorts formats from worst to best,
+    so the last one that fits is the best that fits.
+
+    Returns:
+        dict: The chosen format entry, or None if no rendition is known to fit.
+    """
+    duration = info.get('duration')
+    for fmt in reversed(info.get('formats') or []):
+        if fmt.get('vcodec') == 'none' or fmt.get('acodec') == 'none':
+            continue
+        size, exact = estimate_format_size(fmt, duration)
+        if size is None:
+            continue
+        limit = max_size_bytes if exact else max_size_bytes * APPROX_SIZE_HEADROOM
+        if size <= limit:
+            return fmt
+    return None
+
+
+def download_with_ytdlp(video_url, ydl_opts, output_folder, platform_name, max_size_bytes=None):
+    """
+    Download a video with yt-dlp using a single metadata extraction.
+
+    Args:
+        video_url: The video URL to download
+        ydl_opts: yt-dlp options for the platform
+        output_folder: Folder the video is saved to (must match the outtmpl in ydl_opts)
+        platform_name: Human readable platform name used in log messages
+        max_size_bytes: Optional upload limit; the best rendition that fits it is downloaded
+            instead of the overall best one when the metadata says one exists
+
+    Returns:
+        dict: A dictionary containing:
+            - 'success': bool indicating if download was successful
+            - 'filepath': str path to the downloaded video file (if successful)
+            - 'title': str title of the video (if available)
+            - 'id': str platform video ID (if successful)
+            - 'duration': float duration in seconds (if known)
+            - 'filesize': int estimated size in bytes (if known)
+            - 'fits_limit': bool, True if a rendition within max_size_bytes was chosen
+            - 'error': str error message (if unsuccessful)
+    """
+    try:
+        logger.info(f"Attempting to download {platform_name} video: {video_url}")
+
+        # Check out a warm, pre-configured YoutubeDL instance (or build one if pooling is disabled)
+        with youtubedl_session(platform_name, ydl_opts) as ydl:
+            # Extract info once; the same dict drives the title, the download and later decisions
+            info = extract_info_once(ydl, video_url)
+            video_title = info.get('title', 'Unknown Title')
+
+            logger.info(f"Found {platform_name} video: {video_title}")
+
+            # Prefer a rendition that is already small enough over downloading 'best' and transcoding it
+            chosen_format = select_format_for_size(info, max_size_bytes) if max_size_bytes else None
+            default_selector = ydl.format_selector
+            if chosen_format is not None:
+                logger.info(
+                    f"Selected {platform_name} format {chosen_format.get('format_id')} "
+                    f"({chosen_format.get('height') or '?'}p) to fit {max_size_bytes} bytes"
+                )
+                ydl.format_selector = ydl.build_format_selector(chosen_format['format_id'])
+            try:
+                # Perform the download from the already-resolved metadata
+                info = ydl.process_ie_result(info, download=True)
+            finally:
+                # Pooled instances are reused, so don't leave a per-job selector behind
+                ydl.format_selector = default_selector
+
+            # Get the filepath
+            filepath = ydl.prepare_filename(info)
+
+            # Verify the file was actually downloaded
+            if not os.path.exists(filepath):
+                # Try to find the file with the video ID
+                video_id = info.get('id', '')
+                logger.warning(f"Expected file not found at {filepath}, searching for video ID: {video_id}")
+                possible_files = glob.glob(f"{output_folder}/{video_id}.*")
+                if possible_files:
+                    # Use the first match (should only be one)
+                    filepath = possible_files[0]
+                    logger.info(f"Found file: {filepath}")
+                else:
+                    raise FileNotFoundError(f"Downloaded file not found for video ID: {video_id}")
+
+        logger.info(f"Successfully downloaded {platform_name} video: {video_title} to {filepath}")
+
+        return {
+            'success': True,
+            'filepath': filepath,
+            'title': video_title,
+            'id': info.get('id'),
+            'duration': info.get('duration'),
+            'filesize': get_estimated_filesize(info),
+            'fits_limit': chosen_format is not None,
+        }
+
+    except (OSError, IOError) as e:
+        logger.error(f"File system error downloading {platform_name} video: {e}")
+        return {
+            'success': False,
+            'error': f"File system error: {str(e)}"
+        }
+    except Exception as e:
+        # Catch yt-dlp exceptions and other unexpected errors
+        logger.error(f"Error downloading {platform_name} video: {e}")
+        return {
+            'success': False,
+            'error': str(e)
+        }
@@ -0,0 +1,383 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import uuid
+from media_cache import media_cache, RAW_VARIANT
+from media_extraction import download_with_ytdlp
+from video_processing import clip_video, compress_video_to_limit, is_faststart_mp4, is_upload_compatible, plan_remux, remux_video
+from media_probe import probe_media
+from stage_executors import get_executor
+from ytdlp_workers import ytdlp_workers, YTDLP_WORKERS_ENABLED
+from singleflight import SingleFlight
+from link_resolver import link_resolver
+from negative_cache import negative_cache
+
+logger = logging.getLogger(__name__)
+
+# Timeouts for blocking operations (seconds)
+YTDLP_TIMEOUT_SECONDS = int(os.getenv("YTDLP_TIMEOUT_SECONDS", "120"))
+
+
+def cleanup_file(filepath):
+    """Clean up a temporary file with proper error handling"""
+    try:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            logger.info(f"Cleaned up temporary file: {filepath}")
+    except OSError as e:
+        logger.warning(f"Failed to clean up file {filepath}: {e}")
+
+
+def release_media_file(filepath):
+    """Clean up a prepared media file (the media cache keeps its own link to cached files)"""
+    if filepath:
+        cleanup_file(filepath)
+
+
+# Counters for how downloads reached the upload limit
+pipeline_stats = {
+    'downloads': 0,  # Videos fetched with yt-dlp
+    'size_selected': 0,  # ...of which a rendition that already fit the limit was chosen
+    'transcodes': 0,  # Videos that had to be compressed with ffmpeg
+    'remuxes': 0,  # Videos made uploadable by a stream-copy remux instead of an encode
+    'clips': 0,  # Long videos posted as a clip of their beginning (clip mode)
+    'clips_copied': 0,  # ...of which the clip needed no encode
+    'transcodes_avoided': 0,  # Videos over BASELINE_UPLOAD_LIMIT uploaded as-is thanks to a higher guild limit
+    'download_failures': 0,  # yt-dlp downloads that failed or timed out
+    'known_failures': 0,  # Requests failed straight away from the negative cache
+}
+
+# Concurrent requests for the same video, limit and clip settings share one download/encode
+prepare_flights = SingleFlight()
+
+# The fixed limit every upload used to be compressed for, before per-guild limits
+BASELINE_UPLOAD_LIMIT = 8 * 1024 * 1024
+
+
+async def run_blocking(func, *args, timeout_seconds=None, stage=None):
+    """
+    Run a blocking function in a thread and await it.
+    With a stage name it runs on that stage's dedicated executor instead of the default pool.
+    """
+    call = get_executor(stage).run(func, *args) if stage else asyncio.to_thread(func, *args)
+    if timeout_seconds:
+        return await asyncio.wait_for(call, timeout=timeout_seconds)
+    return await call
+
+
+def download_video(provider, video_url, output_folder=None, max_size_bytes=None):
+    """
+    Downloads a video for a provider from a given URL using yt-dlp.
+
+    Args:
+        provider: The MediaProvider the URL belongs to
+        video_url: The video URL to download
+        output_folder: Optional folder to save the video. If None, the video is downloaded
+            into a folder of its own and moved to a unique name in the temporary directory.
+        max_size_bytes: Optional upload limit used to pick a rendition that already fits
+
+    Returns:
+        dict: The result of download_with_ytdlp ('success', 'filepath', 'title', 'id', ...)
+    """
+    if output_folder is not None:
+        ydl_opts = provider.ydl_opts(output_folder)
+        return download_with_ytdlp(video_url, ydl_opts, output_folder, provider.name, max_size_bytes)
+
+    # Files are named after the video ID, so concurrent downloads of one video (e.g. for
+    # different size limits) would overwrite each other in a shared folder
+    job_folder = tempfile.mkdtemp(prefix='vxtwitter_download_')
+    try:
+        result = download_with_ytdlp(video_url, provider.ydl_opts(job_folder), job_folder, provider.name, max_size_bytes)
+        if result['success']:
+            base_name, ext = os.path.splitext(os.path.basename(result['filepath']))
+            destination = os.path.join(tempfile.gettempdir(), f"{base_name}_{uuid.uuid4().hex[:8]}{ext}")
+            os.replace(result['filepath'], destination)
+            result['filepath'] = destination
+        return result
+    finally:
+        shutil.rmtree(job_folder, ignore_errors=True)
+
+
+async def resolve_short_links(links):
+    """
+    Expand the short links among (provider, url) pairs to canonical video URLs, so their
+    video IDs are known before cache lookups and downloads. Short links are expanded in
+    one batch per provider; links that can't be expanded are returned unchanged.
+    """
+    short_links = {}  # Maps provider key to its short links
+    for provider, url in links:
+        if provider.is_short_link and provider.is_short_link(url):
+            short_links.setdefault(provider.key, []).append(url)
+    if not short_links:
+        return list(links)
+    providers = {provider.key: provider for provider, _ in links}
+    batches = await asyncio.gather(*(
+        link_resolver.resolve_many(urls, providers[key].canonical_url)
+        for key, urls in short_links.items()
+    ))
+    expanded = {}
+    for key, batch in zip(short_links, batches):
+        for url, canonical in batch.items():
+            expanded[(key, url)] = canonical
+    return [(provider, expanded.get((provider.key, url)) or url) for provider, url in links]
+
+
+def selected_variant(max_size):
+    """Media cache variant of a download whose rendition yt-dlp picked to fit max_size"""
+    return f"{max_size}-selected"
+
+
+def clip_variant(max_size, clip_seconds):
+    """Media cache variant of a clip-mode upload (kept apart from full-length variants)"""
+    return f"{max_size}-clip{clip_seconds}"
+
+
+async def make_clip(provider, filepath, max_size, probe, clip_seconds, on_progress=None):
+    """
+    Cut the first clip_seconds of a long video, stream-copied when the codecs allow and
+    encoded (a bounded amount of work) only if the copy doesn't fit max_size.
+    Returns the clip's filepath, or None on failure. The source file is left alone.
+    """
+    copy_ok = is_upload_compatible(probe)
+    async with get_executor('probe').slot():
+        clip_path = await clip_video(filepath, clip_seconds, to_mp4=copy_ok)
+    if not clip_path:
+        return None
+    try:
+        clip_size = os.path.getsize(clip_path)
+    except OSError as e:
+        logger.warning(f"Failed to read size of {provider.name} clip {clip_path}: {e}")
+        cleanup_file(clip_path)
+        return None
+    if copy_ok and clip_size <= max_size:
+        pipeline_stats['clips_copied'] += 1
+        return clip_path
+
+    compressed_path = None
+    try:
+        async with get_executor('probe').slot():
+            clip_probe = await probe_media(clip_path)
+        if clip_probe is not None:
+            compressed_path = await compress_video_to_limit(clip_path, max_size, clip_probe, on_progress)
+    finally:
+        cleanup_file(clip_path)
+    return compressed_path
+
+
+def share_media_file(filepath):
+    """
+    Give a coalesced caller its own name for a prepared file, so each caller can release
+    its file after uploading.
+    """
+    base, ext = os.path.splitext(filepath)
+    shared_path = f"{base}_{uuid.uuid4().hex[:8]}{ext}"
+    try:
+        os.link(filepath, shared_path)
+    except OSError:
+        shutil.copyfile(filepath, shared_path)
+    return shared_path
+
+
+async def prepare_video_for_upload(provider, url, video_id, max_size, on_progress=None,
+                                   clip_after_seconds=None, clip_seconds=None):
+    """
+    Resolve a video URL to a file that fits within max_size bytes (see _prepare_video_for_upload).
+
+    Requests for the same video (by canonical id, or URL while the id is unknown) with the
+    same limit and clip settings that arrive while one is being prepared wait for it instead
+    of downloading and encoding the video again. Every caller gets its own result and file
+    (the first caller to receive it keeps the original).
+    """
+    key = (provider.key, video_id or url, max_size, clip_after_seconds, clip_seconds)
+
+    def prepare(report):
+        return _prepare_video_for_upload(provider, url, video_id, max_size, report, clip_after_seconds, clip_seconds)
+
+    result, shared = await prepare_flights.do(key, prepare, on_progress)
+    if result is None or not shared:
+        return result
+    logger.info(f"Joined in-flight preparation of {provider.name} video {video_id or url}")
+    result = dict(result)
+    try:
+        # Synchronous on purpose: the first caller may release the file as soon as it has uploaded it
+        result['filepath'] = share_media_file(result['filepath'])
+    except OSError as e:
+        logger.error(f"Failed to share prepared {provider.name} video {result['filepath']}: {e}")
+        return None
+    return result
+
+
+async def _prepare_video_for_upload(provider, url, video_id, max_size, on_progress=None,
+                                    clip_after_seconds=None, clip_seconds=None):
+    """
+    Resolve a video URL to a file that fits within max_size bytes.
+    Consults the media cache first so repeat shares skip yt-dlp and ffmpeg.
+    on_progress, if given, is called with the encoded fraction while compressing.
+    With clip_after_seconds set, a video longer than that which doesn't fit as it is gets cut
+    to its first clip_seconds instead of being compressed whole (clip mode).
+    Returns a dict with 'filepath', 'title' and 'id' ('clipped' set to the clip length for
+    clips), or None on failure.
+    """
+    clip_mode = bool(clip_after_seconds and clip_seconds)
+    if clip_mode:
+        cached = media_cache.get(provider.key, video_id, clip_variant(max_size, clip_seconds)) if video_id else None
+        if cached:
+            logger.info(f"Media cache hit for {provider.name} clip of video {video_id}")
+            return {'filepath': cached['path'], 'title': cached['title'], 'id': video_id, 'clipped': clip_seconds}
+
+    # Only files this pipeline made uploadable for the limit are stored under it
+    cached = media_cache.get(provider.key, video_id, max_size)
+    if cached:
+        logger.info(f"Media cache hit for {provider.name} video {video_id}")
+        return {'filepath': cached['path'], 'title': cached['title'], 'id': video_id}
+
+    # A cached download goes through the same checks as a fresh one (fit, faststart, remux)
+    source_entry = None
+    if video_id:
+        source_entry = (media_cache.get(provider.key, video_id, selected_variant(max_size))
+                        or media_cache.get(provider.key, video_id, RAW_VARIANT))
+    if source_entry:
+        logger.info(f"Using cached {provider.name} download for video {video_id}")
+        filepath = source_entry['path']
+        title = source_entry['title']
+    else:
+        # Videos that just failed to download (private, removed, ...) fail again without yt-dlp
+        failure = negative_cache.get(provider.key, video_id or url)
+        if failure:
+            pipeline_stats['known_failures'] += 1
+            logger.info(f"Skipping {provider.name} video {video_id or url}: {failure.error_class} failure is cached")
+            return None
+        try:
+            if YTDLP_WORKERS_ENABLED:
+                # Runs in a worker process that is killed (and its files removed) on timeout
+                result = await ytdlp_workers.download(provider.key, url, max_size, timeout_seconds=YTDLP_TIMEOUT_SECONDS)
+            else:
+                result = await run_blocking(
+                    download_video,
+                    provider,
+                    url,
+                    None,
+                    max_size,
+                    timeout_seconds=YTDLP_TIMEOUT_SECONDS,
+                    stage='extract'
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"{provider.name} download timed out for URL: {url}")
+            pipeline_stats['download_failures'] += 1
+            negative_cache.record(provider.key, video_id or url, f"Timed out after {YTDLP_TIMEOUT_SECONDS}s", url, 'timeout')
+            return None
+        if not result['success']:
+            error = result.get('error', 'Unknown error')
+            logger.error(f"{provider.name} download failed: {error}")
+            pipeline_stats['download_failures'] += 1
+            negative_cache.record(provider.key, video_id or url, error, url)
+            return None
+        title = result['title']
+        # Short links only reveal their video ID once yt-dlp has resolved them
+        video_id = video_id or result.get('id')
+        pipeline_stats['downloads'] += 1
+        # A rendition picked to fit this limit isn't the original, so it isn't reused for other limits
+        variant = RAW_VARIANT
+        if result.get('fits_limit'):
+            pipeline_stats['size_selected'] += 1
+            variant = selected_variant(max_size)
+        filepath = await run_blocking(media_cache.put, provider.key, video_id, variant, result['filepath'], title, stage='io')
+
+    try:
+        file_size = os.path.getsize(filepath)
+    except OSError as e:
+        logger.error(f"Failed to read size of {provider.name} video {filepath}: {e}")
+        release_media_file(filepath)
+        return None
+
+    # An MP4 that fits and already plays while loading needs no ffmpeg work at all
+    faststart = await run_blocking(is_faststart_mp4, filepath, stage='io')
+    if file_size <= max_size and faststart:
+        if file_size > BASELINE_UPLOAD_LIMIT:
+            pipeline_stats['transcodes_avoided'] += 1
+        return {'filepath': filepath, 'title': title, 'id': video_id}
+
+    # ffprobe and ffmpeg run as asyncio subprocesses (killed on timeout or cancellation);
+    # the stage slots keep a backlog of long encodes from delaying quick probes and remuxes
+    try:
+        async with get_executor('probe').slot():
+            # Memoized by content, so a cached download shared again at another limit isn't re-probed
+            probe = await probe_media(filepath)
+            remux_reason = plan_remux(probe, file_size, max_size, faststart)
+            remuxed_path = await remux_video(filepath) if remux_reason else None
+    except asyncio.CancelledError:
+        release_media_file(filepath)
+        raise
+
+    if remuxed_path:
+        try:
+            remuxed_size = os.path.getsize(remuxed_path)
+        except OSError as e:
+            logger.warning(f"Failed to read size of remuxed {provider.name} video {remuxed_path}: {e}")
+            remuxed_size = None
+        if remuxed_size is not None and remuxed_size <= max_size:
+            logger.info(f"Remuxed {provider.name} video {video_id} ({remux_reason}) instead of re-encoding it")
+            pipeline_stats['remuxes'] += 1
+            release_media_file(filepath)
+            remuxed_path = await run_blocking(media_cache.put, provider.key, video_id, max_size, remuxed_path, title, stage='io')
+            return {'filepath': remuxed_path, 'title': title, 'id': video_id}
+        cleanup_file(remuxed_path)
+
+    if file_size <= max_size:
+        # Fits, just not in the ideal container; upload it as it is
+        if file_size > BASELINE_UPLOAD_LIMIT:
+            pipeline_stats['transcodes_avoided'] += 1
+        return {'filepath': filepath, 'title': title, 'id': video_id}
+
+    if clip_mode and probe is not None and probe.duration and probe.duration > clip_after_seconds:
+        logger.info(f"{provider.name} video {video_id} is {probe.duration:.0f}s long, posting its first {clip_seconds}s")
+        try:
+            clip_path = await make_clip(provider, filepath, max_size, probe, clip_seconds, on_progress)
+        finally:
+            release_media_file(filepath)
+        if not clip_path:
+            return None
+        try:
+            clip_size = os.path.getsize(clip_path)
+        except OSError as e:
+            logger.error(f"Failed to read size of {provider.name} clip {clip_path}: {e}")
+            return None
+        if clip_size > max_size:
+            logger.warning(f"{provider.name} clip still too large: {clip_size} bytes")
+            cleanup_file(clip_path)
+            return None
+        pipeline_stats['clips'] += 1
+        clip_path = await run_blocking(
+            media_cache.put, provider.key, video_id, clip_variant(max_size, clip_seconds), clip_path, title, stage='io'
+        )
+        return {'filepath': clip_path, 'title': title, 'id': video_id, 'clipped': clip_seconds}
+
+    logger.warning(f"{provider.name} video too large ({file_size} bytes). Attempting compression.")
+    pipeline_stats['transcodes'] += 1
+    compressed_path = None
+    try:
+        if probe is not None:
+            # Each ffmpeg encode inside waits for the transcode scheduler, which alone limits encodes
+            compressed_path = await compress_video_to_limit(filepath, max_size, probe, on_progress)
+    except asyncio.CancelledError:
+        release_media_file(filepath)
+        raise
+    # The media cache keeps its own link to the download for other size limits
+    release_media_file(filepath)
+    if not compressed_path:
+        return None
+
+    try:
+        file_size = os.path.getsize(compressed_path)
+    except OSError as e:
+        logger.error(f"Failed to read size of compressed {provider.name} video {compressed_path}: {e}")
+        return None
+    if file_size > max_size:
+        logger.warning(f"Compressed {provider.name} video still too large: {file_size} bytes")
+        cleanup_file(compressed_path)
+        return None
+
+    compressed_path = await run_blocking(media_cache.put, provider.key, video_id, max_size, compressed_path, title, stage='io')
+    return {'filepath': compressed_path, 'title': title, 'id': video_id}
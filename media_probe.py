@@ -0,0 +1,184 @@
+import asyncio
+import collections
+import hashlib
+import json
+import logging
+import os
+from video_processing import run_process, FFPROBE_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Probe cache configuration (via environment variables)
+PROBE_CACHE_MAX_ENTRIES = int(os.getenv('PROBE_CACHE_MAX_ENTRIES', '512'))
+
+# Bytes hashed from each end of a file to recognise it after it was moved or copied
+FINGERPRINT_CHUNK_BYTES = 64 * 1024
+
+PROBE_ENTRIES = (
+    "format=format_name,duration,bit_rate,size:"
+    "stream=index,codec_type,codec_name,bit_rate,width,height,avg_frame_rate,channels,channel_layout:"
+    "stream_disposition=attached_pic"
+)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_frame_rate(value):
+    """Parse ffprobe's 'num/den' frame rate (e.g. '30000/1001'); None for '0/0' or garbage"""
+    try:
+        num, _, den = str(value).partition('/')
+        rate = float(num) / float(den or 1)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    return rate if rate > 0 else None
+
+
+class StreamInfo:
+    """One stream of a probed file"""
+    __slots__ = ('index', 'codec_type', 'codec_name', 'bit_rate', 'width', 'height', 'fps',
+                 'channels', 'channel_layout', 'attached_pic')
+
+    def __init__(self, stream):
+        self.index = _to_int(stream.get('index'))
+        self.codec_type = stream.get('codec_type')
+        self.codec_name = stream.get('codec_name')
+        self.bit_rate = _to_int(stream.get('bit_rate'))
+        self.width = _to_int(stream.get('width'))
+        self.height = _to_int(stream.get('height'))
+        self.fps = _parse_frame_rate(stream.get('avg_frame_rate'))
+        self.channels = _to_int(stream.get('channels'))
+        self.channel_layout = stream.get('channel_layout')
+        # Cover art shows up as a one-frame video stream
+        self.attached_pic = bool((stream.get('disposition') or {}).get('attached_pic'))
+
+    def __repr__(self):
+        if self.codec_type == 'video':
+            return f"<StreamInfo #{self.index} {self.codec_name} {self.width}x{self.height}@{self.fps or 0:.2f}>"
+        return f"<StreamInfo #{self.index} {self.codec_type} {self.codec_name}>"
+
+
+class MediaProbe:
+    """
+    Everything the pipeline needs to know about a media file, from a single ffprobe run:
+    container, duration, overall bitrate and every stream's codec, bitrate, resolution,
+    frame rate and audio layout.
+    """
+    __slots__ = ('format_name', 'duration', 'bit_rate', 'size', 'streams')
+
+    def __init__(self, data):
+        fmt = data.get('format') or {}
+        self.format_name = fmt.get('format_name') or ''
+        duration = _to_float(fmt.get('duration'))
+        self.duration = duration if duration and duration > 0 else None
+        self.bit_rate = _to_int(fmt.get('bit_rate'))
+        self.size = _to_int(fmt.get('size'))
+        self.streams = [StreamInfo(stream) for stream in data.get('streams') or []]
+
+    @property
+    def video(self):
+        """The first real video stream (cover art excluded), or None"""
+        return next((s for s in self.streams if s.codec_type == 'video' and not s.attached_pic), None)
+
+    @property
+    def audio(self):
+        """The first audio stream, or None"""
+        return next((s for s in self.streams if s.codec_type == 'audio'), None)
+
+    @property
+    def is_mp4(self):
+        return 'mp4' in self.format_name
+
+    def __repr__(self):
+        return f"<MediaProbe {self.format_name} {self.duration}s streams={self.streams}>"
+
+
+def file_fingerprint(filepath):
+    """
+    Identify a file by its size and a hash of its first and last FINGERPRINT_CHUNK_BYTES.
+    The fingerprint survives the file being moved into the media cache, unlike its path,
+    and costs two small reads instead of hashing the whole video.
+    """
+    size = os.path.getsize(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_CHUNK_BYTES))
+        if size > FINGERPRINT_CHUNK_BYTES:
+            f.seek(max(FINGERPRINT_CHUNK_BYTES, size - FINGERPRINT_CHUNK_BYTES))
+            digest.update(f.read(FINGERPRINT_CHUNK_BYTES))
+    return f"{size}:{digest.hexdigest()}"
+
+
+class ProbeCache:
+    """LRU cache of MediaProbe records keyed by file fingerprint"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max(1, max_entries)
+        self.entries = collections.OrderedDict()  # Maps fingerprint to MediaProbe
+        self.stats = {'hits': 0, 'misses': 0, 'failures': 0}
+
+    def get(self, key):
+        probe = self.entries.get(key)
+        if probe is None:
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return probe
+
+    def put(self, key, probe):
+        self.entries[key] = probe
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['entries'] = len(self.entries)
+        return stats
+
+
+probe_cache = ProbeCache(PROBE_CACHE_MAX_ENTRIES)
+
+
+async def probe_media(filepath):
+    """
+    Return the MediaProbe for a file, running ffprobe only if the same content wasn't probed before.
+    Returns None if the file can't be read or probed.
+    """
+    try:
+        key = file_fingerprint(filepath)
+    except OSError as e:
+        logger.warning(f"Failed to fingerprint {filepath}: {e}")
+        return None
+    probe = probe_cache.get(key)
+    if probe is not None:
+        return probe
+
+    try:
+        output = await run_process(
+            ["ffprobe", "-v", "error", "-show_entries", PROBE_ENTRIES, "-of", "json", filepath],
+            FFPROBE_TIMEOUT_SECONDS,
+        )
+        probe = MediaProbe(json.loads(output))
+    except asyncio.TimeoutError:
+        probe_cache.stats['failures'] += 1
+        logger.warning(f"ffprobe timed out for {filepath}")
+        return None
+    except Exception as e:
+        probe_cache.stats['failures'] += 1
+        logger.warning(f"Failed to probe {filepath}: {e}")
+        return None
+    probe_cache.put(key, probe)
+    return probe
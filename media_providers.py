@@ -0,0 +1,232 @@
+import logging
+import os
+import re
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Check if NVIDIA GPU encoding should be enabled (via environment variable)
+USE_NVIDIA_GPU = os.getenv('USE_NVIDIA_GPU', 'false').lower() in ('true', '1', 'yes')
+
+
+def build_ydl_opts(output_folder=None):
+    """Return the yt-dlp options shared by every provider"""
+    if output_folder is None:
+        output_folder = tempfile.gettempdir()
+
+    # Configuration options for yt-dlp
+    ydl_opts = {
+        'format': 'best',  # Download the best quality available
+        'outtmpl': f'{output_folder}/%(id)s.%(ext)s',  # Use video ID for safe filename
+        'noplaylist': True,  # Ensure we only download a single video, not a playlist
+        'quiet': True,      # Minimize terminal output
+        'no_warnings': True,
+    }
+
+    # Add NVIDIA GPU hardware encoding if enabled
+    if USE_NVIDIA_GPU:
+        logger.info("NVIDIA GPU encoding enabled")
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegVideoConvertor',
+            'preferedformat': 'mp4',
+        }]
+        # FFmpeg arguments for NVIDIA NVENC hardware encoding
+        ydl_opts['postprocessor_args'] = [
+            '-c:v', 'h264_nvenc',           # Use NVIDIA H.264 hardware encoder
+            '-preset', 'p4',                 # Preset (p1-p7, p4 is balanced)
+            '-tune', 'hq',                   # High quality tuning
+            '-b:v', '5M',                    # Target bitrate
+            '-maxrate', '8M',                # Maximum bitrate
+            '-bufsize', '10M',               # Buffer size
+            '-c:a', 'copy',                  # Copy audio stream without re-encoding
+        ]
+        logger.info("Using NVIDIA NVENC hardware encoding with h264_nvenc")
+
+    return ydl_opts
+
+
+class MediaProvider:
+    """
+    Describes one video platform handled by the media pipeline.
+
+    Attributes:
+        key: Short identifier used in cache keys and metrics (e.g. 'tiktok')
+        name: Human readable platform name used in messages and logs
+        emoji: Emoji prefixed to the upload message
+        url_regex: Compiled pattern that finds the platform's links in a message
+        domains: Lowercase domain fragments used to cheaply prefilter messages before any regex work
+        validate_url: Function returning a validated/sanitized copy of a matched URL
+        extract_video_id: Function returning the canonical video ID for a URL, or None
+        ydl_opts: Function returning yt-dlp options for an output folder
+        is_short_link: Function telling whether a URL is a short link that redirects to the video, or None
+        canonical_url: Function returning the canonical video URL for a short link's redirect target,
+            or None if the target isn't a video URL (needed with is_short_link)
+    """
+
+    def __init__(self, key, name, emoji, url_regex, domains, validate_url, extract_video_id, ydl_opts=build_ydl_opts,
+                 is_short_link=None, canonical_url=None):
+        self.key = key
+        self.name = name
+        self.emoji = emoji
+        self.url_regex = url_regex
+        self.domains = tuple(domains)
+        self.validate_url = validate_url
+        self.extract_video_id = extract_video_id
+        self.ydl_opts = ydl_opts
+        self.is_short_link = is_short_link
+        self.canonical_url = canonical_url
+
+    def __repr__(self):
+        return f"<MediaProvider {self.key}>"
+
+
+# Registered providers, in the order their links are processed
+PROVIDERS = {}
+
+
+def register_provider(provider):
+    """Add a provider to the registry (replacing any provider with the same key)"""
+    PROVIDERS[provider.key] = provider
+    return provider
+
+
+def get_provider(key):
+    return PROVIDERS.get(key)
+
+
+def iter_providers():
+    return list(PROVIDERS.values())
+
+
+# --- TikTok ---
+
+def validate_tiktok_url(url):
+    """
+    Validate and sanitize a TikTok URL.
+    Returns the validated/sanitized URL. Logs a warning if URL doesn't match expected patterns.
+    """
+    # TikTok URL patterns we expect (checked with re.IGNORECASE)
+    case_insensitive_patterns = [
+        r'^https?://(?:www\.)?tiktok\.com/@[\w\.]+/video/\d+',
+        r'^https?://(?:www\.)?tiktok\.com/t/[\w]+',
+        r'^https?://vm\.tiktok\.com/[\w]+',
+    ]
+
+    # Short URL pattern (case-sensitive path check to avoid matching common lowercase paths)
+    # TikTok short URLs are 8-12 characters total and start with uppercase letter or digit (e.g., ZNRrFcTFL)
+    # Pattern breakdown: [A-Z0-9] (1 char) + [A-Za-z0-9]{7,11} (7-11 chars) = 8-12 chars total
+    # This excludes common paths like "trending", "foryou", "following" which are all lowercase
+    # If a capitalized common path is matched (e.g., "Trending"), yt-dlp will handle it gracefully
+    short_url_pattern = r'^https?://(?:www\.)?tiktok\.com/[A-Z0-9][A-Za-z0-9]{7,11}/?$'
+
+    # Check if URL matches any valid pattern
+    matched = False
+    for pattern in case_insensitive_patterns:
+        if re.match(pattern, url, re.IGNORECASE):
+            matched = True
+            break
+
+    # Check short URL pattern without IGNORECASE for the path part
+    if not matched and re.match(short_url_pattern, url):
+        matched = True
+
+    if not matched:
+        logger.warning(f"TikTok URL doesn't match expected patterns: {url}")
+
+    # Basic sanitization - remove any trailing fragments or suspicious characters
+    # Keep only the base URL components, including @ symbol for TikTok usernames
+    return re.sub(r'[^\w\.\/\:\-\?\&\=\%\@]', '', url)
+
+
+def extract_tiktok_video_id(url):
+    """Return the numeric TikTok video ID from a full video URL, or None for short links"""
+    match = re.search(r'tiktok\.com/@[\w\.]+/video/(\d+)', url, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+# Short links (vm.tiktok.com/..., tiktok.com/t/... and bare short codes like tiktok.com/ZNRrFcTFL)
+TIKTOK_SHORT_LINK_PATTERNS = (
+    re.compile(r'^https?://vm\.tiktok\.com/[\w]+/?(?:\?\S*)?$', re.IGNORECASE),
+    re.compile(r'^https?://(?:www\.)?tiktok\.com/t/[\w]+/?(?:\?\S*)?$', re.IGNORECASE),
+    # Case-sensitive, like the short code pattern in validate_tiktok_url
+    re.compile(r'^https?://(?:www\.)?tiktok\.com/[A-Z0-9][A-Za-z0-9]{7,11}/?(?:\?\S*)?$'),
+)
+
+
+def is_tiktok_short_link(url):
+    """Whether url is a TikTok short link (which only redirects to the video page)"""
+    return any(pattern.match(url) for pattern in TIKTOK_SHORT_LINK_PATTERNS)
+
+
+def canonical_tiktok_url(url):
+    """Return https://www.tiktok.com/@user/video/<id> for a TikTok video URL, or None"""
+    match = re.search(r'tiktok\.com/(@[\w\.]+)/video/(\d+)', url, re.IGNORECASE)
+    if not match:
+        return None
+    return f"https://www.tiktok.com/{match.group(1)}/video/{match.group(2)}"
+
+
+register_provider(MediaProvider(
+    key='tiktok',
+    name='TikTok',
+    emoji='🎵',
+    url_regex=re.compile(r'(https?://(?:www\.)?(?:tiktok\.com|vm\.tiktok\.com)/\S+)', re.IGNORECASE),
+    domains=('tiktok.com',),
+    validate_url=validate_tiktok_url,
+    extract_video_id=extract_tiktok_video_id,
+    is_short_link=is_tiktok_short_link,
+    canonical_url=canonical_tiktok_url,
+))
+
+
+# --- Instagram ---
+
+def validate_instagram_url(url):
+    """
+    Validate and sanitize an Instagram URL.
+    Returns the validated/sanitized URL. Logs a warning if URL doesn't match expected patterns.
+    """
+    # Instagram URL patterns we expect
+    patterns = [
+        r'^https?://(?:www\.)?instagram\.com/p/[\w\-]+',  # Posts
+        r'^https?://(?:www\.)?instagram\.com/reels?/[\w\-]+',  # Reels (reel or reels)
+        r'^https?://(?:www\.)?instagram\.com/tv/[\w\-]+',  # IGTV
+        r'^https?://(?:www\.)?instagram\.com/stories/[\w\.]+/\d+',  # Stories
+        r'^https?://(?:www\.)?instagr\.am/p/[\w\-]+',  # Short URL posts
+        r'^https?://(?:www\.)?instagr\.am/reels?/[\w\-]+',  # Short URL reels
+    ]
+
+    # Check if URL matches any valid pattern
+    matched = False
+    for pattern in patterns:
+        if re.match(pattern, url, re.IGNORECASE):
+            matched = True
+            break
+
+    if not matched:
+        logger.warning(f"Instagram URL doesn't match expected patterns: {url}")
+
+    # Basic sanitization - remove any trailing fragments or suspicious characters
+    # Keep only the base URL components
+    return re.sub(r'[^\w\.\/\:\-\?\&\=\%]', '', url)
+
+
+def extract_instagram_video_id(url):
+    """Return the Instagram shortcode (or story media ID) from a URL, or None"""
+    match = re.search(r'(?:instagram\.com|instagr\.am)/(?:p|reels?|tv)/([\w\-]+)', url, re.IGNORECASE)
+    if match:
+        return match.group(1)
+    match = re.search(r'instagram\.com/stories/[\w\.]+/(\d+)', url, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+register_provider(MediaProvider(
+    key='instagram',
+    name='Instagram',
+    emoji='📸',
+    # Matches posts, reels, stories, and short URLs
+    url_regex=re.compile(r'(https?://(?:www\.)?(?:instagram\.com|instagr\.am)/(?:p|reels?|tv|stories)/\S+)', re.IGNORECASE),
+    domains=('instagram.com', 'instagr.am'),
+    validate_url=validate_instagram_url,
+    extract_video_id=extract_instagram_video_id,
+))
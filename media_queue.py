@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Media job queue configuration (via environment variables)
+MEDIA_QUEUE_WORKERS = int(os.getenv('MEDIA_QUEUE_WORKERS', '2'))  # Messages processed concurrently
+MEDIA_QUEUE_MAX_LENGTH = int(os.getenv('MEDIA_QUEUE_MAX_LENGTH', '50'))  # Waiting messages before new links are refused
+MEDIA_MESSAGE_CONCURRENCY = int(os.getenv('MEDIA_MESSAGE_CONCURRENCY', '3'))  # Links of one message fetched at once
+MEDIA_GUILD_CONCURRENCY = int(os.getenv('MEDIA_GUILD_CONCURRENCY', '4'))  # Links of one server fetched at once
+
+# Number of recent jobs used for the wait/service time figures
+TIMING_SAMPLES = 200
+
+
+class MediaJob:
+    """The video links of one message, as (provider, url) pairs in the order they appeared"""
+    __slots__ = ('message', 'links', 'enqueued_at', 'started_at')
+
+    def __init__(self, message, links):
+        self.message = message
+        self.links = list(links)
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+
+    def __repr__(self):
+        return f"<MediaJob message={self.message.id} links={len(self.links)}>"
+
+
+def summarize_timings(samples):
+    """Return (average, p95) of a sequence of durations in seconds, or (0.0, 0.0)"""
+    if not samples:
+        return 0.0, 0.0
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return sum(ordered) / len(ordered), p95
+
+
+class MediaJobQueue:
+    """
+    Bounded queue of media jobs drained by a fixed number of worker tasks.
+    Each job is one message; the handler may fetch that message's links concurrently.
+
+    The gateway event handler only calls submit(), which never waits: when the queue is
+    full the job is refused (backpressure) instead of piling up downloads and temporary
+    files. Workers run the handler given to start() for one job at a time.
+    """
+
+    def __init__(self, workers, max_length):
+        self.worker_count = max(1, workers)
+        self.max_length = max(1, max_length)
+        self.queue = None  # Created in start(), inside the running event loop
+        self.workers = []
+        self.handler = None
+        self.active = 0
+        self.guild_semaphores = {}  # Maps guild ID to the semaphore bounding its concurrent fetches
+        self.wait_times = collections.deque(maxlen=TIMING_SAMPLES)
+        self.service_times = collections.deque(maxlen=TIMING_SAMPLES)
+        self.stats = {
+            'enqueued': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'max_depth': 0,
+        }
+
+    @property
+    def started(self):
+        return bool(self.workers)
+
+    def start(self, handler):
+        """Start the worker tasks (safe to call again on reconnect)"""
+        if self.started:
+            return
+        self.handler = handler
+        self.queue = asyncio.Queue(maxsize=self.max_length)
+        self.workers = [
+            asyncio.create_task(self._worker(index), name=f"media-worker-{index}")
+            for index in range(self.worker_count)
+        ]
+        logger.info(f"Started {self.worker_count} media worker(s), queue limit {self.max_length}")
+
+    def guild_slots(self, guild_id):
+        """Return the semaphore limiting concurrent fetches for a guild (None for DMs)"""
+        semaphore = self.guild_semaphores.get(guild_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(MEDIA_GUILD_CONCURRENCY)
+            self.guild_semaphores[guild_id] = semaphore
+        return semaphore
+
+    def submit(self, job):
+        """
+        Queue a job without waiting.
+
+        Returns:
+            bool: False if the queue is full (or not started) and the job was refused.
+        """
+        if not self.started:
+            logger.error(f"Media queue not started, refusing {job}")
+            self.stats['rejected'] += 1
+            return False
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            logger.warning(f"Media queue full ({self.max_length} jobs waiting), refusing {job}")
+            return False
+        self.stats['enqueued'] += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.queue.qsize())
+        return True
+
+    async def _worker(self, index):
+        while True:
+            job = await self.queue.get()
+            job.started_at = time.monotonic()
+            self.wait_times.append(job.started_at - job.enqueued_at)
+            self.active += 1
+            try:
+                await self.handler(job)
+                self.stats['completed'] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.exception(f"Media worker {index} failed on {job}: {e}")
+            finally:
+                self.active -= 1
+                self.service_times.append(time.monotonic() - job.started_at)
+                self.queue.task_done()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['depth'] = self.queue.qsize() if self.queue else 0
+        stats['active'] = self.active
+        stats['workers'] = self.worker_count
+        stats['max_length'] = self.max_length
+        stats['avg_wait'], stats['p95_wait'] = summarize_timings(self.wait_times)
+        stats['avg_service'], stats['p95_service'] = summarize_timings(self.service_times)
+        return stats
+
+
+media_queue = MediaJobQueue(MEDIA_QUEUE_WORKERS, MEDIA_QUEUE_MAX_LENGTH)
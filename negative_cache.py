@@ -0,0 +1,198 @@
+import collections
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Negative cache configuration (via environment variables)
+NEGATIVE_CACHE_ENABLED = os.getenv('NEGATIVE_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.getenv('NEGATIVE_CACHE_MAX_ENTRIES', '2048'))
+
+# How long each kind of failure is remembered (seconds). Removed videos don't come back,
+# while private posts, login walls and timeouts may be gone on the next share. Errors
+# nobody recognised are not cached: they may well be the bot's own problem.
+# Overridable with NEGATIVE_CACHE_TTLS, e.g. "private=600,timeout=30" (0 disables a class).
+DEFAULT_FAILURE_TTLS = {
+    'removed': 24 * 3600,
+    'unsupported': 24 * 3600,
+    'geo_blocked': 6 * 3600,
+    'private': 3600,
+    'login_required': 1800,
+    'timeout': 45,
+    'unknown': 0,
+    'rate_limited': 0,  # Throttling is about the bot, not the video
+    'internal': 0,  # File system errors, crashed workers and format selection are the bot's own problem
+}
+
+# yt-dlp error messages and the failure class they indicate, checked in order. Only the
+# extractors' own wording is matched: anything looser (e.g. "not available", "cookies",
+# a bare HTTP 404 from a CDN or API hiccup) also matches transient or bot-side errors
+# and would block a working video for hours.
+FAILURE_PATTERNS = (
+    ('internal', re.compile(
+        r'^File system error|worker exited unexpectedly|^Unknown provider|'
+        r'Requested format is not available|format is not available|ffmpeg (?:is )?not (?:found|installed)',
+        re.IGNORECASE,
+    )),
+    # Instagram's answer for login-walled posts also mentions rate limits
+    ('login_required', re.compile(r'rate-limit reached or login required', re.IGNORECASE)),
+    ('rate_limited', re.compile(r'HTTP Error 429|Too Many Requests', re.IGNORECASE)),
+    ('login_required', re.compile(
+        r'login required|locked behind the login page|only available for registered users|'
+        r'log in for access|requires authentication',
+        re.IGNORECASE,
+    )),
+    ('private', re.compile(
+        r'This (?:video|account|post) is private|Private video|only available (?:to|for) (?:followers|friends)',
+        re.IGNORECASE,
+    )),
+    ('geo_blocked', re.compile(
+        r'not (?:made this video )?available in your country|geo.?restrict|'
+        r'Your IP address is blocked from accessing this post',
+        re.IGNORECASE,
+    )),
+    ('removed', re.compile(
+        r'Video unavailable|This video has been removed|has been removed for violating|'
+        r'Video not available, status code|This post may have been removed',
+        re.IGNORECASE,
+    )),
+    ('unsupported', re.compile(r'Unsupported URL|No video formats found|There is no video in this post', re.IGNORECASE)),
+)
+
+
+def parse_failure_ttls(spec, defaults=DEFAULT_FAILURE_TTLS):
+    """Apply a "class=seconds,..." override string to the default TTL table"""
+    ttls = dict(defaults)
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        error_class, _, seconds = item.partition('=')
+        error_class = error_class.strip()
+        if error_class not in ttls:
+            logger.warning(f"Ignoring TTL for unknown failure class '{error_class}'")
+            continue
+        try:
+            ttls[error_class] = max(0, int(seconds))
+        except ValueError:
+            logger.warning(f"Ignoring invalid TTL '{item}' in NEGATIVE_CACHE_TTLS")
+    return ttls
+
+
+NEGATIVE_CACHE_TTLS = parse_failure_ttls(os.getenv('NEGATIVE_CACHE_TTLS'))
+
+
+def classify_failure(error):
+    """Return the failure class of a download error message"""
+    for error_class, pattern in FAILURE_PATTERNS:
+        if pattern.search(error or ''):
+            return error_class
+    return 'unknown'
+
+
+class NegativeEntry:
+    """One remembered download failure"""
+    __slots__ = ('error_class', 'error', 'url', 'created', 'expires', 'hits')
+
+    def __init__(self, error_class, error, url, created, expires):
+        self.error_class = error_class
+        self.error = error
+        self.url = url
+        self.created = created
+        self.expires = expires
+        self.hits = 0  # Shares answered from this entry
+
+
+class NegativeCache:
+    """
+    Remembers videos whose download failed, so the next share fails without running yt-dlp.
+
+    Entries are keyed by provider and canonical video ID (the URL when the ID isn't known)
+    and kept for a TTL that depends on the failure class: a removed video is remembered
+    for a day, a timeout for seconds, and failures caused by the bot itself (rate limits,
+    file system errors) not at all. The least recently stored entries are evicted past
+    max_entries. Admins can list and purge entries with /negative_cache.
+    """
+
+    def __init__(self, ttls, max_entries, enabled=True):
+        self.ttls = ttls
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.entries = collections.OrderedDict()  # Maps (provider key, video ID or URL) to NegativeEntry
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'stored': 0,
+            'expired': 0,
+            'purged': 0,
+        }
+        self.hits_by_class = collections.Counter()
+
+    def get(self, provider_key, key):
+        """Return the live failure entry for a video, or None"""
+        if not self.enabled:
+            return None
+        entry = self.entries.get((provider_key, key))
+        if entry is not None and entry.expires <= time.time():
+            del self.entries[(provider_key, key)]
+            self.stats['expired'] += 1
+            entry = None
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        entry.hits += 1
+        self.stats['hits'] += 1
+        self.hits_by_class[entry.error_class] += 1
+        return entry
+
+    def peek(self, provider_key, key):
+        """Like get(), without counting a hit or miss (for inspection)"""
+        entry = self.entries.get((provider_key, key))
+        return entry if entry is not None and entry.expires > time.time() else None
+
+    def record(self, provider_key, key, error, url, error_class=None):
+        """
+        Remember a failed download. The failure class is taken from the error message
+        unless given. Returns the stored entry, or None if the class isn't cached.
+        """
+        error_class = error_class or classify_failure(error)
+        ttl = self.ttls.get(error_class, 0)
+        if not self.enabled or not ttl:
+            return None
+        now = time.time()
+        entry = NegativeEntry(error_class, error, url, now, now + ttl)
+        self.entries.pop((provider_key, key), None)
+        self.entries[(provider_key, key)] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.stats['stored'] += 1
+        logger.info(f"Caching {error_class} failure of {provider_key} video {key} for {ttl}s")
+        return entry
+
+    def purge(self, provider_key=None, key=None, error_class=None):
+        """Remove the entries matching every given filter (all entries without filters); returns the count"""
+        matching = [
+            entry_key for entry_key, entry in self.entries.items()
+            if (provider_key is None or entry_key[0] == provider_key)
+            and (key is None or entry_key[1] == key)
+            and (error_class is None or entry.error_class == error_class)
+        ]
+        for entry_key in matching:
+            del self.entries[entry_key]
+        self.stats['purged'] += len(matching)
+        return len(matching)
+
+    def snapshot(self, limit=None):
+        """Live entries as ((provider key, key), entry) pairs, most recently stored first"""
+        now = time.time()
+        live = [(entry_key, entry) for entry_key, entry in reversed(self.entries.items()) if entry.expires > now]
+        return live[:limit] if limit else live
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        now = time.time()
+        stats['entries'] = sum(1 for entry in self.entries.values() if entry.expires > now)
+        stats['hits_by_class'] = dict(self.hits_by_class)
+        return stats
+
+
+negative_cache = NegativeCache(NEGATIVE_CACHE_TTLS, NEGATIVE_CACHE_MAX_ENTRIES, NEGATIVE_CACHE_ENABLED)
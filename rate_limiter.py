@@ -0,0 +1,163 @@
+import logging
+import os
+import time
+from collections import OrderedDict
+from link_scanner import TWITTER
+
+logger = logging.getLogger(__name__)
+
+# Rate limiting configuration (via environment variables)
+RATE_LIMIT_SECONDS = int(os.getenv('RATE_LIMIT_SECONDS', '10'))  # Per user: one conversion every N seconds
+GLOBAL_RATE_LIMIT = int(os.getenv('GLOBAL_RATE_LIMIT', '30'))  # Twitter/X link conversions per minute across all users
+MEDIA_GLOBAL_RATE_LIMIT = int(os.getenv('MEDIA_GLOBAL_RATE_LIMIT', '10'))  # Video downloads per minute, per platform
+GUILD_RATE_LIMIT = int(os.getenv('GUILD_RATE_LIMIT', '20'))  # Conversions per minute per server
+CHANNEL_RATE_LIMIT = int(os.getenv('CHANNEL_RATE_LIMIT', '10'))  # Conversions per minute per channel
+
+# Lazily expire at most this many idle entries per decision, keeping every call O(1)
+SWEEP_BATCH = 4
+
+
+class TokenBucket:
+    """
+    Token buckets for one scope (e.g. per user), keyed by an arbitrary id.
+
+    Uses the GCRA formulation: each key stores a single float, the time at which its
+    bucket will be full again. A key whose bucket is full is indistinguishable from an
+    unknown key, so those entries are dropped lazily and memory only grows with the
+    number of keys that were active within the last refill window.
+    """
+    __slots__ = ('name', 'capacity', 'interval', 'window', 'full_at')
+
+    def __init__(self, name, capacity, per_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.interval = per_seconds / capacity  # Seconds to refill one token
+        self.window = per_seconds  # Time for an empty bucket to refill completely
+        # Maps key to the time its bucket is full again, oldest update first. An OrderedDict
+        # rather than a dict because popping from the front of a plain dict leaves holes that
+        # every later next(iter()) has to skip over, making the lazy sweep quadratic.
+        self.full_at = OrderedDict()
+
+    def peek(self, key, now, cost=1):
+        """Return the new full_at value if cost tokens are available for key, otherwise None"""
+        full_at = self.full_at.get(key, now)
+        if full_at < now:
+            full_at = now
+        new_full_at = full_at + cost * self.interval
+        if new_full_at - now > self.window:
+            return None
+        return new_full_at
+
+    def commit(self, key, new_full_at):
+        # Move to the end so the dict stays ordered by last update, which is what the sweep walks
+        self.full_at[key] = new_full_at
+        self.full_at.move_to_end(key)
+
+    def sweep(self, now, limit=SWEEP_BATCH):
+        """Drop up to limit leading entries whose buckets have refilled completely"""
+        full_at = self.full_at
+        removed = 0
+        while full_at and removed < limit:
+            key_full_at = full_at[next(iter(full_at))]
+            if key_full_at > now:
+                break
+            full_at.popitem(last=False)
+            removed += 1
+        return removed
+
+    def purge(self, now):
+        """Drop every entry whose bucket has refilled completely"""
+        expired = [key for key, full_at in self.full_at.items() if full_at <= now]
+        for key in expired:
+            del self.full_at[key]
+        return len(expired)
+
+    def retry_after(self, key, now, cost=1):
+        """Seconds until cost tokens are available for key"""
+        full_at = max(self.full_at.get(key, now), now)
+        return max(0.0, full_at + cost * self.interval - self.window - now)
+
+    def __len__(self):
+        return len(self.full_at)
+
+
+class RateLimiter:
+    """
+    Layered rate limiting at global (per platform), per-guild, per-channel and per-user scope.
+
+    A request is only admitted if every scope has a token available; tokens are taken from
+    all scopes at once, so a request rejected by one scope doesn't use up the others.
+    """
+
+    def __init__(self):
+        self.global_buckets = {}  # Maps platform to its global TokenBucket
+        self.guilds = TokenBucket('guild', GUILD_RATE_LIMIT, 60)
+        self.channels = TokenBucket('channel', CHANNEL_RATE_LIMIT, 60)
+        self.users = TokenBucket('user', 1, RATE_LIMIT_SECONDS)
+        self.stats = {'allowed': 0}
+        self.drops = {}  # Maps "scope:platform" to the number of dropped requests
+
+    def get_global_limit(self, platform):
+        """Return the per-minute budget for a platform: cheap Twitter/X rewrites or expensive video downloads"""
+        return GLOBAL_RATE_LIMIT if platform == TWITTER else MEDIA_GLOBAL_RATE_LIMIT
+
+    def _global_bucket(self, platform):
+        bucket = self.global_buckets.get(platform)
+        if bucket is None:
+            bucket = TokenBucket('global', self.get_global_limit(platform), 60)
+            self.global_buckets[platform] = bucket
+        return bucket
+
+    def check(self, platform, user_id, guild_id=None, channel_id=None, now=None):
+        """
+        Decide whether a request may proceed, consuming one token from every scope if so.
+        Scopes whose id is None are skipped (e.g. a user already charged for the message).
+
+        Returns:
+            tuple: (allowed, scope) where scope names the limit that rejected the request, or None.
+        """
+        if now is None:
+            now = time.monotonic()
+        checks = [('global', self._global_bucket(platform), platform)]
+        if user_id is not None:
+            checks.append(('user', self.users, user_id))
+        if guild_id is not None:
+            checks.append(('guild', self.guilds, guild_id))
+        if channel_id is not None:
+            checks.append(('channel', self.channels, channel_id))
+
+        pending = []
+        for scope, bucket, key in checks:
+            bucket.sweep(now)
+            new_full_at = bucket.peek(key, now)
+            if new_full_at is None:
+                drop_key = f"{scope}:{platform}"
+                self.drops[drop_key] = self.drops.get(drop_key, 0) + 1
+                return False, scope
+            pending.append((bucket, key, new_full_at))
+
+        for bucket, key, new_full_at in pending:
+            bucket.commit(key, new_full_at)
+        self.stats['allowed'] += 1
+        return True, None
+
+    def sweep(self, now=None):
+        """Fully expire idle entries in every scope (periodic maintenance)"""
+        if now is None:
+            now = time.monotonic()
+        buckets = [self.guilds, self.channels, self.users, *self.global_buckets.values()]
+        return sum(bucket.purge(now) for bucket in buckets)
+
+    def get_state(self):
+        """Return a snapshot of tracked entries and counters for status reporting"""
+        return {
+            'allowed': self.stats['allowed'],
+            'dropped': sum(self.drops.values()),
+            'drops': dict(self.drops),
+            'tracked_users': len(self.users),
+            'tracked_channels': len(self.channels),
+            'tracked_guilds': len(self.guilds),
+        }
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,94 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One running call and the callers waiting for it"""
+    __slots__ = ('task', 'waiters', 'delivered', 'listeners')
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.delivered = 0  # Callers that have received the result
+        self.listeners = []  # Progress callbacks of every waiting caller
+
+    def report(self, fraction):
+        for listener in list(self.listeners):
+            try:
+                listener(fraction)
+            except Exception as e:
+                logger.debug(f"Progress callback failed: {e}")
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it runs wait for the
+    same result (or exception) instead of repeating the work. Progress reported by the call
+    goes to every waiting caller. The call is cancelled only when every caller waiting for
+    it has been cancelled, so one caller going away doesn't fail the others.
+    """
+
+    def __init__(self):
+        self.flights = {}  # Maps key to the Flight running for it
+        self.stats = {
+            'calls': 0,
+            'executions': 0,
+            'coalesced': 0,  # Calls that joined a running execution
+            'abandoned': 0,  # Executions cancelled because every caller went away
+        }
+
+    async def do(self, key, func, on_progress=None):
+        """
+        Run func(report) once per key at a time, where report(fraction) forwards progress.
+
+        Returns:
+            tuple: (result, shared). shared is False for exactly one caller, the first to
+                receive the result (usually the one that started the call), and True for
+                the others, which received the same result object.
+        """
+        self.stats['calls'] += 1
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.stats['coalesced'] += 1
+        else:
+            flight = Flight()
+            flight.task = asyncio.ensure_future(func(flight.report))
+            self.flights[key] = flight
+            self.stats['executions'] += 1
+            flight.task.add_done_callback(lambda _: self._finished(key, flight))
+
+        flight.waiters += 1
+        if on_progress is not None:
+            flight.listeners.append(on_progress)
+        try:
+            result = await asyncio.shield(flight.task)
+            flight.delivered += 1
+            return result, flight.delivered > 1
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                self.stats['abandoned'] += 1
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+            if on_progress is not None:
+                flight.listeners.remove(on_progress)
+
+    def _finished(self, key, flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+        if flight.task.cancelled():
+            return
+        error = flight.task.exception()
+        if error is not None and flight.waiters == 0:
+            # Nobody is left to receive it; log instead of "exception was never retrieved"
+            logger.warning(f"Coalesced call {key} failed: {error}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['in_flight'] = len(self.flights)
+        return stats
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+# Threads per pipeline stage and how many jobs each stage admits at once (running + queued in the pool).
+# Callers beyond the admission limit wait on the event loop without tying up a thread.
+STAGE_CONFIG = {
+    'extract': (int(os.getenv('EXTRACT_WORKERS', '4')), int(os.getenv('EXTRACT_MAX_PENDING', '8'))),
+    'probe': (int(os.getenv('PROBE_WORKERS', '4')), int(os.getenv('PROBE_MAX_PENDING', '16'))),
+    'io': (int(os.getenv('IO_WORKERS', '2')), int(os.getenv('IO_MAX_PENDING', '16'))),
+}
+
+
+class StageExecutor:
+    """
+    A named, separately sized thread pool for one pipeline stage.
+
+    Stages don't share threads, so a backlog of long ffmpeg jobs can't delay ffprobe calls
+    or downloads. Stages whose work is already async (ffprobe/ffmpeg subprocesses) use
+    slot() for the same limit and gauges without occupying a thread. A job holds its
+    admission slot until its thread actually finishes, even if the caller stopped
+    waiting, so the limit bounds real work rather than awaiters.
+    """
+
+    def __init__(self, name, max_workers, max_pending):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max(self.max_workers, max_pending)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"stage-{name}")
+        self.admission = None  # Created on first use, inside the running event loop
+        self.concurrency = None  # Bounds async work holding a slot(); also created on first use
+        self.lock = threading.Lock()
+        self.created = time.monotonic()
+        self.waiting = 0  # Callers waiting for admission
+        self.queued = 0  # Admitted jobs waiting for a thread
+        self.running = 0
+        self.busy_seconds = 0.0
+        self.leaked = 0  # Jobs whose caller gave up (e.g. timed out) while their thread keeps running
+        self.stats = {
+            'completed': 0,
+            'failed': 0,
+            'abandoned': 0,
+            'max_depth': 0,
+        }
+
+    def _call(self, func, args):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        started = time.monotonic()
+        outcome = 'failed'
+        try:
+            result = func(*args)
+            outcome = 'completed'
+            return result
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.busy_seconds += time.monotonic() - started
+                self.stats[outcome] += 1
+
+    async def run(self, func, *args):
+        """Run func(*args) on this stage's threads once the stage admits it"""
+        if self.admission is None:
+            self.admission = asyncio.Semaphore(self.max_pending)
+        self.waiting += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.waiting + self.queued)
+        try:
+            await self.admission.acquire()
+        finally:
+            self.waiting -= 1
+        with self.lock:
+            self.queued += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, self._call, func, args)
+        future.add_done_callback(lambda _: self.admission.release())
+        try:
+            # Shielded so a timed-out caller doesn't mark the job finished while its thread still runs
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.done():
+                # Threads can't be cancelled; count the job until it actually finishes
+                self.stats['abandoned'] += 1
+                self.leaked += 1
+                future.add_done_callback(self._leaked_job_finished)
+            raise
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one of this stage's max_workers slots for async work (e.g. an asyncio subprocess)
+        that needs the stage's concurrency limit and gauges but no thread.
+        """
+        if self.concurrency is None:
+            self.concurrency = asyncio.Semaphore(self.max_workers)
+        self.waiting += 1
+        self.stats['max_depth'] = max(self.stats['max_depth'], self.waiting + self.queued)
+        try:
+            await self.concurrency.acquire()
+        finally:
+            self.waiting -= 1
+        with self.lock:
+            self.running += 1
+        started = time.monotonic()
+        outcome = 'failed'
+        try:
+            yield
+            outcome = 'completed'
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.busy_seconds += time.monotonic() - started
+                self.stats[outcome] += 1
+            self.concurrency.release()
+
+    def _leaked_job_finished(self, future):
+        self.leaked -= 1
+
+    def get_stats(self):
+        with self.lock:
+            running = self.running
+            busy_seconds = self.busy_seconds
+            queued = self.queued
+            stats = dict(self.stats)
+        elapsed = max(time.monotonic() - self.created, 1e-9)
+        stats['workers'] = self.max_workers
+        stats['max_pending'] = self.max_pending
+        stats['running'] = running
+        stats['leaked'] = self.leaked
+        stats['depth'] = self.waiting + queued
+        stats['utilization'] = running / self.max_workers
+        stats['avg_utilization'] = min(1.0, busy_seconds / (elapsed * self.max_workers))
+        return stats
+
+
+STAGE_EXECUTORS = {name: StageExecutor(name, workers, pending) for name, (workers, pending) in STAGE_CONFIG.items()}
+
+
+def get_executor(name):
+    return STAGE_EXECUTORS[name]
+
+
+def get_executor_stats():
+    """Return a stats dict per stage"""
+    return {name: executor.get_stats() for name, executor in STAGE_EXECUTORS.items()}
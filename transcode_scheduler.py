@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def available_cores():
+    """CPU cores this process may run on (honours CPU affinity / container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+# Transcode scheduler configuration (via environment variables)
+TRANSCODE_CORES = int(os.getenv('TRANSCODE_CORES', str(available_cores())))  # Cores ffmpeg encodes may use in total
+# libx264 scales well up to a few threads per encode; past that, running more encodes side by side is faster
+TRANSCODE_THREADS_PER_ENCODE = int(os.getenv('TRANSCODE_THREADS_PER_ENCODE', str(min(4, TRANSCODE_CORES))))
+TRANSCODE_MAX_CONCURRENT = int(os.getenv(
+    'TRANSCODE_MAX_CONCURRENT', str(max(1, TRANSCODE_CORES // max(1, TRANSCODE_THREADS_PER_ENCODE)))
+))
+TRANSCODE_LOAD_AWARE = os.getenv('TRANSCODE_LOAD_AWARE', 'true').lower() in ('true', '1', 'yes')
+
+# How often a queued encode held back only by host load re-reads the load average
+LOAD_RECHECK_SECONDS = 1.0
+
+# Number of recent queue waits used for the wait time figures
+WAIT_SAMPLES = 200
+
+
+def host_load():
+    """1-minute load average, or None where the platform doesn't report it"""
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+class TranscodeScheduler:
+    """
+    Admission control for ffmpeg encode processes.
+
+    Every libx264 process (a whole-file encode or one segment of a segmented encode) waits
+    for a slot and is told how many -threads to use. At most max_concurrent encodes run at
+    once with threads_per_encode threads each, so encodes share the cores instead of each
+    starting a thread per core and thrashing. With load_aware set, an encode also waits
+    while other work on the host (the load average minus our own encodes) leaves too few
+    idle cores. One encode is always allowed to run so a busy host can't starve the queue.
+    Waiters are served in arrival order.
+    """
+
+    def __init__(self, cores, threads_per_encode, max_concurrent, load_aware=True):
+        self.cores = max(1, cores)
+        self.threads_per_encode = max(1, threads_per_encode)
+        self.max_concurrent = max(1, max_concurrent)
+        self.load_aware = load_aware
+        self.running = 0
+        self.waiters = collections.deque()  # Futures of queued encodes, in arrival order
+        self.wait_times = collections.deque(maxlen=WAIT_SAMPLES)
+        self.stats = {
+            'encodes': 0,
+            'queued': 0,  # Encodes that had to wait for a slot
+            'load_deferrals': 0,  # Times the head of the queue was held back by host load alone
+        }
+
+    def configure(self, threads_per_encode=None, max_concurrent=None):
+        """Change the limits at runtime (used by the concurrency benchmark)"""
+        if threads_per_encode is not None:
+            self.threads_per_encode = max(1, threads_per_encode)
+        if max_concurrent is not None:
+            self.max_concurrent = max(1, max_concurrent)
+        self._wake_next()
+
+    def _external_load(self):
+        load = host_load()
+        if load is None:
+            return 0.0
+        # Our own running encodes are part of the load average; don't count them twice
+        return max(0.0, load - self.running * self.threads_per_encode)
+
+    def _can_start(self):
+        if self.running == 0:
+            return True
+        if self.running >= self.max_concurrent:
+            return False
+        if self.load_aware:
+            wanted = (self.running + 1) * self.threads_per_encode
+            if self._external_load() + wanted > self.cores:
+                self.stats['load_deferrals'] += 1
+                return False
+        return True
+
+    def _wake_next(self):
+        """Hand free slots to queued encodes in arrival order; a slot is reserved when granted"""
+        while self.waiters and self._can_start():
+            waiter = self.waiters.popleft()
+            if waiter.done():
+                continue  # Its task was cancelled while queued
+            self.running += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for an encode slot; yields the number of threads the encode should use"""
+        started = time.monotonic()
+        if self.waiters or not self._can_start():
+            self.stats['queued'] += 1
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            try:
+                while not waiter.done():
+                    try:
+                        # Slots freed by finishing encodes wake us; load changes are polled
+                        await asyncio.wait_for(asyncio.shield(waiter), timeout=LOAD_RECHECK_SECONDS)
+                    except asyncio.TimeoutError:
+                        if self.load_aware and self.waiters and self.waiters[0] is waiter:
+                            self._wake_next()
+            except BaseException:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted a slot just as we were cancelled: pass it on
+                    self.running -= 1
+                    self._wake_next()
+                else:
+                    waiter.cancel()
+                    if waiter in self.waiters:
+                        self.waiters.remove(waiter)
+                raise
+        else:
+            self.running += 1
+        self.wait_times.append(time.monotonic() - started)
+        self.stats['encodes'] += 1
+        try:
+            yield self.threads_per_encode
+        finally:
+            self.running -= 1
+            self._wake_next()
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['running'] = self.running
+        stats['waiting'] = len(self.waiters)
+        stats['cores'] = self.cores
+        stats['threads_per_encode'] = self.threads_per_encode
+        stats['max_concurrent'] = self.max_concurrent
+        stats['load'] = host_load()
+        stats['avg_wait'] = sum(self.wait_times) / len(self.wait_times) if self.wait_times else 0.0
+        return stats
+
+
+transcode_scheduler = TranscodeScheduler(
+    TRANSCODE_CORES, TRANSCODE_THREADS_PER_ENCODE, TRANSCODE_MAX_CONCURRENT, TRANSCODE_LOAD_AWARE
+)
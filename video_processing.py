@@ -0,0 +1,564 @@
+import asyncio
+import collections
+import logging
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import uuid
+from encode_planner import encode_planner
+from transcode_scheduler import transcode_scheduler
+
+logger = logging.getLogger(__name__)
+
+# Timeouts for ffprobe/ffmpeg runs (seconds)
+FFPROBE_TIMEOUT_SECONDS = int(os.getenv("FFPROBE_TIMEOUT_SECONDS", "15"))
+FFMPEG_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_TIMEOUT_SECONDS", "120"))
+
+# Lines of ffmpeg's stderr kept for error messages (the rest is discarded as it streams)
+STDERR_TAIL_LINES = 20
+
+# Number of recent encodes used for the speed figures
+SPEED_SAMPLES = 100
+
+# Codecs Discord plays inline from an MP4; anything else needs a full encode
+UPLOAD_VIDEO_CODECS = ('h264',)
+UPLOAD_AUDIO_CODECS = ('aac', 'mp3')
+
+# Container overhead assumed when estimating the size of a remuxed file
+REMUX_OVERHEAD = 1.02
+
+# Segment-parallel encoding: long videos are cut at keyframes and the pieces encoded at once
+SEGMENT_ENCODE_MIN_SECONDS = float(os.getenv("SEGMENT_ENCODE_MIN_SECONDS", "90"))  # 0 disables it
+SEGMENT_ENCODE_PARALLELISM = int(os.getenv("SEGMENT_ENCODE_PARALLELISM", str(min(8, transcode_scheduler.max_concurrent))))
+MIN_SEGMENT_SECONDS = 10
+
+# Allowed difference between the concatenated output's duration and the source's
+SEGMENT_DURATION_TOLERANCE = 0.02
+
+# Per-encode statistics for metrics
+encode_stats = {
+    'encodes': 0,
+    'failed': 0,
+    'killed': 0,
+    'media_seconds': 0.0,  # Seconds of video encoded successfully
+    'wall_seconds': 0.0,  # ...and the time it took
+    'remuxes': 0,
+    'remux_failed': 0,
+    'remux_seconds': 0.0,  # Wall time spent on stream-copy remuxes
+    'segmented': 0,  # Encodes split into segments encoded in parallel
+    'segment_fallbacks': 0,  # ...that failed validation and were encoded in one piece instead
+}
+recent_speeds = collections.deque(maxlen=SPEED_SAMPLES)  # x realtime of recent successful encodes
+
+
+async def _drain_lines(stream, on_line):
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        on_line(line.decode('utf-8', errors='replace').rstrip())
+
+
+async def run_process(args, timeout_seconds, on_stdout_line=None):
+    """
+    Run a command as an asyncio subprocess without buffering its whole output.
+
+    stdout is passed line by line to on_stdout_line (or collected if it is None) and only
+    the last STDERR_TAIL_LINES of stderr are kept. The process is killed if it runs past
+    timeout_seconds (raising asyncio.TimeoutError) or if the awaiting task is cancelled.
+
+    Returns:
+        str: The collected stdout when on_stdout_line is None, otherwise an empty string.
+
+    Raises:
+        subprocess.CalledProcessError: If the process exits with a non-zero status
+            (with the stderr tail as its stderr).
+    """
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout_lines = []
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
+    readers = asyncio.gather(
+        _drain_lines(process.stdout, on_stdout_line or stdout_lines.append),
+        _drain_lines(process.stderr, stderr_tail.append),
+    )
+    try:
+        await asyncio.wait_for(asyncio.shield(readers), timeout=timeout_seconds)
+        returncode = await process.wait()
+    except BaseException:
+        # Timeout or cancellation: don't leave the process running on its own
+        if process.returncode is None:
+            try:
+                process.kill()
+            except ProcessLookupError:
+                pass
+            await process.wait()
+        readers.cancel()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, args[0], stderr="\n".join(stderr_tail))
+    return "\n".join(stdout_lines)
+
+
+def read_top_level_boxes(filepath, max_boxes=32):
+    """Return the types of the top-level boxes of an MP4/MOV file, in file order"""
+    boxes = []
+    try:
+        with open(filepath, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            file_size = f.tell()
+            offset = 0
+            while offset + 8 <= file_size and len(boxes) < max_boxes:
+                f.seek(offset)
+                size, box_type = struct.unpack('>I4s', f.read(8))
+                if size == 1:
+                    size = struct.unpack('>Q', f.read(8))[0]
+                elif size == 0:
+                    size = file_size - offset  # Box extends to the end of the file
+                if size < 8:
+                    break
+                boxes.append(box_type.decode('latin-1'))
+                offset += size
+    except (OSError, struct.error) as e:
+        logger.debug(f"Could not read MP4 boxes of {filepath}: {e}")
+    return boxes
+
+
+def is_faststart_mp4(filepath):
+    """True if the file is an MP4 whose moov atom comes before the media data (plays while loading)"""
+    boxes = read_top_level_boxes(filepath)
+    if 'moov' not in boxes:
+        return False
+    return 'mdat' not in boxes or boxes.index('moov') < boxes.index('mdat')
+
+
+def is_upload_compatible(probe):
+    """True if a probed file's first video and audio stream can be uploaded without re-encoding"""
+    if probe is None:
+        return False
+    video, audio = probe.video, probe.audio
+    if video is None or video.codec_name not in UPLOAD_VIDEO_CODECS:
+        return False
+    return audio is None or audio.codec_name in UPLOAD_AUDIO_CODECS
+
+
+def plan_remux(probe, file_size, max_size_bytes, faststart):
+    """
+    Decide whether a stream-copy remux (no re-encoding) is enough to make a file uploadable.
+
+    The first video and first audio stream are kept; everything else (extra audio tracks,
+    data/timecode tracks, subtitles, cover art) is dropped and the result is a faststart MP4.
+
+    Args:
+        probe: The file's MediaProbe (or None if probing failed)
+
+    Returns:
+        str: Why a remux helps ('drop_tracks', 'container' or 'faststart'), or None if the
+            file is fine as it is or needs a full encode.
+    """
+    if not is_upload_compatible(probe):
+        return None
+    video, audio = probe.video, probe.audio
+
+    if file_size > max_size_bytes:
+        kept = [stream for stream in (video, audio) if stream is not None]
+        if len(probe.streams) == len(kept):
+            return None  # Nothing to drop: only a re-encode can make it smaller
+        if probe.duration is None or any(stream.bit_rate is None for stream in kept):
+            return None
+        estimated_size = sum(stream.bit_rate for stream in kept) * probe.duration / 8 * REMUX_OVERHEAD
+        return 'drop_tracks' if estimated_size <= max_size_bytes else None
+
+    # Already small enough: a remux only helps playback in Discord's client
+    if not probe.is_mp4:
+        return 'container'
+    if not faststart:
+        return 'faststart'
+    return None
+
+
+def _derived_path(filepath, suffix, ext):
+    """
+    Unique path next to filepath for an output made from it. Concurrent jobs can work on
+    the same video, so outputs never get a name that another job could also pick.
+    """
+    output_dir = os.path.dirname(filepath) or "."
+    base_name, _ = os.path.splitext(os.path.basename(filepath))
+    return os.path.join(output_dir, f"{base_name}_{suffix}_{uuid.uuid4().hex[:8]}{ext}")
+
+
+async def _stream_copy(filepath, output_path, extra_args=()):
+    """Copy the first video and audio stream into output_path without re-encoding"""
+    faststart = ["-movflags", "+faststart"] if output_path.endswith(".mp4") else []
+    await run_process(
+        [
+            "ffmpeg",
+            "-y",
+            "-nostats",
+            "-i", filepath,
+            *extra_args,
+            "-map", "0:v:0",
+            "-map", "0:a:0?",
+            "-c", "copy",
+            "-dn", "-sn",
+            *faststart,
+            output_path,
+        ],
+        FFMPEG_TIMEOUT_SECONDS,
+    )
+
+
+async def remux_video(filepath):
+    """
+    Stream-copy the first video and audio stream into a faststart MP4.
+    Returns the remuxed filepath, or None on failure.
+    """
+    remuxed_path = _derived_path(filepath, "remux", ".mp4")
+    started = time.monotonic()
+    try:
+        await _stream_copy(filepath, remuxed_path)
+    except asyncio.CancelledError:
+        _remove_partial_output(remuxed_path)
+        raise
+    except Exception as e:
+        encode_stats['remux_failed'] += 1
+        logger.warning(f"Remux failed for {filepath}: {e}")
+        _remove_partial_output(remuxed_path)
+        return None
+    elapsed = time.monotonic() - started
+    encode_stats['remuxes'] += 1
+    encode_stats['remux_seconds'] += elapsed
+    logger.info(f"Remuxed {filepath} in {elapsed * 1000:.0f} ms")
+    return remuxed_path
+
+
+async def clip_video(filepath, seconds, to_mp4=True):
+    """
+    Stream-copy the first `seconds` of a video. The cut starts on the first frame, which is
+    always a keyframe, so no re-encoding is needed. With to_mp4 False the clip is written
+    as MKV, which takes any codec (for clips that get encoded afterwards).
+    Returns the clip's filepath, or None on failure.
+    """
+    clip_path = _derived_path(filepath, f"clip{seconds}", ".mp4" if to_mp4 else ".mkv")
+    try:
+        await _stream_copy(filepath, clip_path, ["-t", str(seconds)])
+    except asyncio.CancelledError:
+        _remove_partial_output(clip_path)
+        raise
+    except Exception as e:
+        logger.warning(f"Clipping {filepath} to {seconds}s failed: {e}")
+        _remove_partial_output(clip_path)
+        return None
+    return clip_path
+
+
+class FFmpegProgress:
+    """Parses ffmpeg's -progress key=value stream and reports the encoded fraction"""
+
+    def __init__(self, duration, on_progress=None):
+        self.duration = duration
+        self.on_progress = on_progress
+        self.out_seconds = 0.0
+        self.speed = None
+
+    def feed(self, line):
+        key, _, value = line.partition('=')
+        if key == 'out_time_us' or key == 'out_time_ms':
+            # Both are in microseconds (out_time_ms is misnamed by ffmpeg)
+            try:
+                self.out_seconds = max(0.0, int(value) / 1_000_000)
+            except ValueError:
+                pass
+        elif key == 'speed':
+            try:
+                self.speed = float(value.rstrip('x'))
+            except ValueError:
+                pass
+        elif key == 'progress' and self.on_progress is not None:
+            # One 'progress=continue' (or 'end') line closes every progress block
+            fraction = 1.0 if value == 'end' else min(1.0, self.out_seconds / self.duration)
+            try:
+                self.on_progress(fraction)
+            except Exception as e:
+                logger.debug(f"Progress callback failed: {e}")
+
+
+def _video_rate_args(plan):
+    return [
+        "-b:v", str(plan.video_bitrate),
+        "-maxrate", str(plan.video_bitrate),
+        "-bufsize", str(plan.video_bitrate * 2),
+    ]
+
+
+def _audio_args(plan):
+    return ["-c:a", "aac", "-b:a", str(plan.audio_bitrate)] if plan.audio_bitrate else ["-an"]
+
+
+async def run_encode(args, output_path, on_stdout_line=None):
+    """
+    Run an ffmpeg encode once the transcode scheduler admits it, with the number of
+    threads the scheduler hands out. args is the command line without the output path.
+    """
+    async with transcode_scheduler.slot() as threads:
+        await run_process([*args, "-threads", str(threads), output_path], FFMPEG_TIMEOUT_SECONDS, on_stdout_line)
+
+
+def plan_segments(plan, use_nvidia_gpu=False):
+    """Number of segments to encode a plan's video in (1 means a normal single encode)"""
+    if use_nvidia_gpu or SEGMENT_ENCODE_MIN_SECONDS <= 0 or plan.duration < SEGMENT_ENCODE_MIN_SECONDS:
+        return 1
+    return max(1, min(SEGMENT_ENCODE_PARALLELISM, int(plan.duration // MIN_SEGMENT_SECONDS)))
+
+
+async def _encode_single(filepath, output_path, plan, use_nvidia_gpu, on_progress):
+    """Run one encode for a plan, falling back from NVENC to libx264. Returns the encoder used."""
+
+    async def run_ffmpeg(video_codec, preset, extra_args=None):
+        if extra_args is None:
+            extra_args = []
+        ffmpeg_args = [
+            "ffmpeg",
+            "-y",
+            "-nostats",
+            "-progress", "pipe:1",
+            "-i", filepath,
+            *plan.video_filter_args(),
+            "-c:v", video_codec,
+            *extra_args,
+            *_video_rate_args(plan),
+            "-preset", preset,
+            *_audio_args(plan),
+        ]
+        progress = FFmpegProgress(plan.duration, on_progress)
+        await run_encode(ffmpeg_args, output_path, progress.feed)
+
+    if use_nvidia_gpu:
+        try:
+            await run_ffmpeg("h264_nvenc", "p4", ["-gpu", "0"])
+            return "h264_nvenc"
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"NVENC compression failed, falling back to libx264: {e.stderr}")
+    await run_ffmpeg("libx264", "veryfast")
+    return "libx264"
+
+
+async def _encode_segmented(filepath, output_path, plan, segments, on_progress):
+    """
+    Cut the video at keyframes (stream copy), encode the pieces concurrently with the plan's
+    rate control while the audio is encoded in one piece, then concatenate without re-encoding.
+
+    Returns:
+        bool: False if the split or the result didn't check out (the caller encodes in one piece).
+    """
+    work_folder = tempfile.mkdtemp(prefix="vxtwitter_segments_", dir=os.path.dirname(output_path) or ".")
+    try:
+        # The segment muxer can only cut at keyframes, so pieces are close to, not exactly, this long
+        segment_seconds = plan.duration / segments
+        await run_process(
+            [
+                "ffmpeg", "-y", "-nostats",
+                "-i", filepath,
+                "-map", "0:v:0", "-c", "copy",
+                "-f", "segment",
+                "-segment_time", f"{segment_seconds:.3f}",
+                "-reset_timestamps", "1",
+                os.path.join(work_folder, "source_%03d.mp4"),
+            ],
+            FFMPEG_TIMEOUT_SECONDS,
+        )
+        pieces = sorted(name for name in os.listdir(work_folder) if name.startswith("source_"))
+        if len(pieces) < 2:
+            logger.info(f"{filepath} has too few keyframes to split, encoding it in one piece")
+            return False
+
+        progresses = [FFmpegProgress(plan.duration) for _ in pieces]
+
+        def report(_):
+            if on_progress is not None:
+                on_progress(min(1.0, sum(progress.out_seconds for progress in progresses) / plan.duration))
+
+        jobs = []
+        encoded = []
+        for index, piece in enumerate(pieces):
+            progresses[index].on_progress = report
+            encoded_path = os.path.join(work_folder, f"encoded_{index:03d}.mp4")
+            encoded.append(encoded_path)
+            # Pieces queue on the transcode scheduler like any other encode
+            jobs.append(run_encode(
+                [
+                    "ffmpeg", "-y", "-nostats",
+                    "-progress", "pipe:1",
+                    "-i", os.path.join(work_folder, piece),
+                    *plan.video_filter_args(),
+                    "-c:v", "libx264",
+                    *_video_rate_args(plan),
+                    "-preset", "veryfast",
+                ],
+                encoded_path,
+                progresses[index].feed,
+            ))
+        audio_path = os.path.join(work_folder, "audio.m4a")
+        if plan.audio_bitrate:
+            jobs.append(run_process(
+                ["ffmpeg", "-y", "-nostats", "-i", filepath, "-vn", *_audio_args(plan), audio_path],
+                FFMPEG_TIMEOUT_SECONDS,
+            ))
+        tasks = [asyncio.ensure_future(job) for job in jobs]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # One failed (or we were cancelled): stop the others; run_process kills their ffmpeg
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        list_path = os.path.join(work_folder, "segments.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in encoded:
+                f.write(f"file '{path}'\n")
+        audio_inputs = ["-i", audio_path, "-map", "0:v", "-map", "1:a"] if plan.audio_bitrate else []
+        concat_progress = FFmpegProgress(plan.duration)
+        await run_process(
+            [
+                "ffmpeg", "-y", "-nostats",
+                "-progress", "pipe:1",
+                "-f", "concat", "-safe", "0", "-i", list_path,
+                *audio_inputs,
+                "-c", "copy",
+                "-movflags", "+faststart",
+                output_path,
+            ],
+            FFMPEG_TIMEOUT_SECONDS,
+            concat_progress.feed,
+        )
+        # Missing or duplicated pieces show up as a duration mismatch
+        if abs(concat_progress.out_seconds - plan.duration) > max(0.5, plan.duration * SEGMENT_DURATION_TOLERANCE):
+            logger.warning(
+                f"Segmented encode of {filepath} is {concat_progress.out_seconds:.2f}s long, "
+                f"expected {plan.duration:.2f}s"
+            )
+            _remove_partial_output(output_path)
+            return False
+        logger.info(f"Encoded {filepath} in {len(pieces)} parallel segments")
+        return True
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+
+async def encode_with_plan(filepath, output_path, plan, segments=1, use_nvidia_gpu=False, on_progress=None):
+    """
+    Encode a video according to an EncodePlan, in parallel segments if segments > 1.
+    Returns the encoder used; ffmpeg failures and timeouts propagate.
+    """
+    if segments > 1:
+        try:
+            # Every ffmpeg run in it has its own timeout; waiting for scheduler slots doesn't count
+            if await _encode_segmented(filepath, output_path, plan, segments, on_progress):
+                encode_stats['segmented'] += 1
+                return "libx264"
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Segmented encode of {filepath} failed, encoding it in one piece: {e.stderr}")
+        _remove_partial_output(output_path)
+        encode_stats['segment_fallbacks'] += 1
+    return await _encode_single(filepath, output_path, plan, use_nvidia_gpu, on_progress)
+
+
+async def compress_video_to_limit(filepath, max_size_bytes, probe, on_progress=None):
+    """
+    Compress a video using ffmpeg to fit within max_size_bytes.
+
+    probe is the file's MediaProbe. The encode planner picks resolution, frame rate and
+    bitrate from its ladder; if the output still comes out too large, the video is encoded
+    once more at a lower rung.
+    on_progress, if given, is called with the encoded fraction (0.0 - 1.0) as ffmpeg reports it.
+    Returns the compressed filepath, or None on failure.
+    """
+    use_nvidia_gpu = os.getenv('USE_NVIDIA_GPU', 'false').lower() in ('true', '1', 'yes')
+    if use_nvidia_gpu and os.name != "nt":
+        if not (os.path.exists("/dev/nvidia0") or os.path.exists("/dev/nvidiactl")):
+            logger.warning("NVIDIA device nodes not found; skipping NVENC and using libx264")
+            use_nvidia_gpu = False
+
+    plan = encode_planner.plan(probe, max_size_bytes, "h264_nvenc" if use_nvidia_gpu else "libx264")
+    if plan is None:
+        return None
+
+    compressed_path = _derived_path(filepath, "compressed", ".mp4")
+
+    for attempt in range(2):
+        logger.info(f"Encoding {filepath} with {plan}")
+        started = time.monotonic()
+        try:
+            plan.encoder = await encode_with_plan(
+                filepath, compressed_path, plan, plan_segments(plan, use_nvidia_gpu), use_nvidia_gpu, on_progress
+            )
+        except asyncio.TimeoutError:
+            encode_stats['killed'] += 1
+            logger.error(f"FFmpeg compression timed out for {filepath}, killed it")
+            _remove_partial_output(compressed_path)
+            return None
+        except asyncio.CancelledError:
+            encode_stats['killed'] += 1
+            _remove_partial_output(compressed_path)
+            raise
+        except subprocess.CalledProcessError as e:
+            encode_stats['failed'] += 1
+            logger.error(f"FFmpeg compression failed for {filepath}: {e.stderr}")
+            _remove_partial_output(compressed_path)
+            return None
+        except Exception as e:
+            encode_stats['failed'] += 1
+            logger.error(f"FFmpeg compression failed for {filepath}: {e}")
+            _remove_partial_output(compressed_path)
+            return None
+
+        try:
+            output_size = os.path.getsize(compressed_path)
+        except OSError:
+            logger.error(f"Compressed file not created: {compressed_path}")
+            return None
+
+        elapsed = time.monotonic() - started
+        duration = plan.duration
+        encode_stats['encodes'] += 1
+        encode_stats['media_seconds'] += duration
+        encode_stats['wall_seconds'] += elapsed
+        if elapsed > 0:
+            recent_speeds.append(duration / elapsed)
+        logger.info(f"Compressed {filepath} ({duration:.1f}s of video) in {elapsed:.1f}s ({duration / max(elapsed, 1e-9):.1f}x realtime)")
+
+        encode_planner.record(plan, output_size, max_size_bytes, retry=attempt > 0)
+        if output_size <= max_size_bytes or attempt > 0:
+            return compressed_path
+        logger.warning(f"Compressed {filepath} to {output_size} bytes, over the {max_size_bytes} byte limit; retrying one rung lower")
+        plan = encode_planner.replan(probe, plan, output_size, max_size_bytes)
+        if plan is None:
+            return compressed_path
+    return compressed_path
+
+
+def _remove_partial_output(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except OSError as e:
+        logger.warning(f"Failed to remove partial ffmpeg output {path}: {e}")
+
+
+def get_encode_stats():
+    """Return encode counters plus overall and recent average speed (x realtime)"""
+    stats = dict(encode_stats)
+    stats['avg_speed'] = stats['media_seconds'] / stats['wall_seconds'] if stats['wall_seconds'] else 0.0
+    stats['recent_speed'] = sum(recent_speeds) / len(recent_speeds) if recent_speeds else 0.0
+    stats['avg_encode_seconds'] = stats['wall_seconds'] / stats['encodes'] if stats['encodes'] else 0.0
+    stats['avg_remux_seconds'] = stats['remux_seconds'] / stats['remuxes'] if stats['remuxes'] else 0.0
+    return stats
@@ -0,0 +1,231 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import stat
+import time
+import discord
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+# Webhook cache configuration (via environment variables)
+WEBHOOK_CACHE_ENABLED = os.getenv('WEBHOOK_CACHE_ENABLED', 'true').lower() in ('true', '1', 'yes')
+# Holds webhook tokens, so it lives in the bot's own data directory rather than a shared temp directory
+WEBHOOK_CACHE_PATH = os.getenv('WEBHOOK_CACHE_PATH') or data_path('webhooks.json')
+
+# Name of the bot-owned webhook used for user emulation in each channel
+WEBHOOK_NAME = "VXTwitter Emulation"
+
+# A create + delete pair is what every emulated send used to cost on top of the send itself
+REST_CALLS_PER_UNCACHED_SEND = 2
+
+# Window used for the "REST calls saved per minute" metric
+SAVINGS_WINDOW_SECONDS = 60
+
+
+class WebhookCache:
+    """
+    One long-lived, bot-owned webhook per channel for user emulation.
+
+    The webhook id and token are kept per channel id (and persisted, so restarts don't
+    create new webhooks). Entries are trusted until Discord says otherwise: a 404 on send
+    means the webhook was deleted, so it is recreated once and the send retried; a 403
+    means the bot lost access, so the entry is evicted and the error propagated.
+    """
+
+    def __init__(self, cache_path, enabled=True):
+        self.cache_path = cache_path
+        self.enabled = enabled
+        self.entries = {}  # Maps channel ID (str) to {'id', 'token', 'guild_id'}
+        self.locks = {}  # Maps channel ID to an asyncio.Lock serializing webhook creation
+        self.recent_savings = collections.deque()  # (timestamp, calls saved) within the savings window
+        self.stats = {
+            'sends': 0,
+            'created': 0,
+            'adopted': 0,
+            'revalidations': 0,
+            'evictions': 0,
+            'rest_calls': 0,
+            'rest_calls_saved': 0,
+        }
+        if self.enabled:
+            self._load()
+
+    @staticmethod
+    def _untrusted_reason(path):
+        """Why a cache file can't be trusted (another user could have planted or edited it), or None"""
+        info = os.lstat(path)
+        if not stat.S_ISREG(info.st_mode):
+            return "not a regular file"
+        if hasattr(os, 'getuid') and info.st_uid != os.getuid():
+            return f"owned by uid {info.st_uid}, not the bot's user"
+        if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            return "writable by other users"
+        return None
+
+    @staticmethod
+    def _valid_entries(data):
+        """Keep only well-formed {channel_id: {'id': int, 'token': str, 'guild_id': int or None}} entries"""
+        if not isinstance(data, dict):
+            return {}
+        entries = {}
+        for channel_id, entry in data.items():
+            if not (isinstance(channel_id, str) and channel_id.isdigit() and isinstance(entry, dict)):
+                continue
+            webhook_id, token, guild_id = entry.get('id'), entry.get('token'), entry.get('guild_id')
+            if type(webhook_id) is not int or not isinstance(token, str) or not token:
+                continue
+            if guild_id is not None and type(guild_id) is not int:
+                continue
+            entries[channel_id] = {'id': webhook_id, 'token': token, 'guild_id': guild_id}
+        return entries
+
+    def _load(self):
+        if not os.path.lexists(self.cache_path):
+            return
+        try:
+            reason = self._untrusted_reason(self.cache_path)
+            if reason:
+                logger.warning(f"Ignoring webhook cache {self.cache_path}: {reason}")
+                return
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable webhook cache {self.cache_path}: {e}")
+            return
+        self.entries = self._valid_entries(data)
+        dropped = len(data) - len(self.entries) if isinstance(data, dict) else 1
+        if dropped:
+            logger.warning(f"Dropped {dropped} malformed entr{'y' if dropped == 1 else 'ies'} from webhook cache {self.cache_path}")
+        logger.info(f"Loaded webhook cache with {len(self.entries)} channel(s)")
+
+    def _save(self):
+        # Webhook tokens are credentials, so the file is only readable by the bot's user
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to save webhook cache: {e}")
+
+    def _lock_for(self, channel_id):
+        lock = self.locks.get(channel_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[channel_id] = lock
+        return lock
+
+    async def _create_entry(self, channel, client):
+        """Adopt an existing webhook this bot created in the channel, or create a new one"""
+        webhook = None
+        try:
+            self.stats['rest_calls'] += 1
+            for existing in await channel.webhooks():
+                if existing.token and existing.user and existing.user.id == client.user.id:
+                    webhook = existing
+                    self.stats['adopted'] += 1
+                    break
+        except discord.Forbidden:
+            raise
+        except discord.HTTPException as e:
+            logger.debug(f"Could not list webhooks in channel {channel.id}: {e}")
+
+        if webhook is None:
+            self.stats['rest_calls'] += 1
+            webhook = await channel.create_webhook(name=WEBHOOK_NAME)
+            self.stats['created'] += 1
+            logger.info(f"Created emulation webhook in channel {channel.id}")
+
+        self.entries[str(channel.id)] = {
+            'id': webhook.id,
+            'token': webhook.token,
+            'guild_id': channel.guild.id if channel.guild else None,
+        }
+        self._save()
+        return webhook
+
+    async def get_webhook(self, channel, client):
+        """Return the cached webhook for a channel, creating it on first use"""
+        key = str(channel.id)
+        entry = self.entries.get(key)
+        if entry:
+            return discord.Webhook.partial(entry['id'], entry['token'], client=client)
+        async with self._lock_for(key):
+            # Another message in the same channel may have created it while we waited
+            entry = self.entries.get(key)
+            if entry:
+                return discord.Webhook.partial(entry['id'], entry['token'], client=client)
+            return await self._create_entry(channel, client)
+
+    async def _send_with_temporary_webhook(self, channel, **kwargs):
+        """Create a webhook, send once and delete it again (behaviour with the cache disabled)"""
+        webhook = await channel.create_webhook(name="TempWebhook")
+        try:
+            return await webhook.send(**kwargs)
+        finally:
+            try:
+                await webhook.delete()
+            except Exception as e:
+                logger.warning(f"Failed to delete temporary webhook in channel {channel.id}: {e}")
+
+    async def send(self, channel, client, **kwargs):
+        """
+        Send a message through the channel's emulation webhook.
+        Raises discord.Forbidden if the bot can no longer use webhooks in the channel.
+        """
+        if not self.enabled:
+            return await self._send_with_temporary_webhook(channel, **kwargs)
+        calls_before = self.stats['rest_calls']
+        webhook = await self.get_webhook(channel, client)
+        try:
+            sent_message = await webhook.send(**kwargs)
+        except discord.NotFound:
+            # The webhook was deleted from Discord's side; recreate it once and retry
+            logger.info(f"Cached webhook for channel {channel.id} no longer exists, recreating it")
+            self.stats['revalidations'] += 1
+            self.invalidate(channel.id, "webhook not found")
+            webhook = await self.get_webhook(channel, client)
+            sent_message = await webhook.send(**kwargs)
+        except discord.Forbidden:
+            self.invalidate(channel.id, "permission denied")
+            raise
+
+        self.stats['sends'] += 1
+        saved = REST_CALLS_PER_UNCACHED_SEND - (self.stats['rest_calls'] - calls_before)
+        if saved > 0:
+            self.stats['rest_calls_saved'] += saved
+            self.recent_savings.append((time.monotonic(), saved))
+        return sent_message
+
+    def invalidate(self, channel_id, reason=None):
+        """Forget the webhook for a channel (channel deleted, permissions lost, webhook gone)"""
+        if self.entries.pop(str(channel_id), None) is None:
+            return False
+        self.locks.pop(str(channel_id), None)
+        self.stats['evictions'] += 1
+        self._save()
+        logger.info(f"Evicted cached webhook for channel {channel_id}" + (f" ({reason})" if reason else ""))
+        return True
+
+    def invalidate_guild(self, guild_id, reason=None):
+        """Forget every cached webhook in a guild (e.g. the bot was removed from it)"""
+        channel_ids = [channel_id for channel_id, entry in self.entries.items() if entry.get('guild_id') == guild_id]
+        for channel_id in channel_ids:
+            self.invalidate(channel_id, reason)
+        return len(channel_ids)
+
+    def get_stats(self):
+        cutoff = time.monotonic() - SAVINGS_WINDOW_SECONDS
+        while self.recent_savings and self.recent_savings[0][0] < cutoff:
+            self.recent_savings.popleft()
+        stats = dict(self.stats)
+        stats['channels'] = len(self.entries)
+        stats['rest_calls_saved_per_minute'] = sum(saved for _, saved in self.recent_savings)
+        return stats
+
+
+webhook_cache = WebhookCache(WEBHOOK_CACHE_PATH, WEBHOOK_CACHE_ENABLED)
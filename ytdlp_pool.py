@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+# YoutubeDL pool configuration (via environment variables)
+YTDLP_POOL_ENABLED = os.getenv('YTDLP_POOL_ENABLED', 'true').lower() in ('true', '1', 'yes')
+YTDLP_POOL_SIZE = int(os.getenv('YTDLP_POOL_SIZE', '2'))  # Warm instances per platform
+YTDLP_POOL_MAX_USES = int(os.getenv('YTDLP_POOL_MAX_USES', '50'))  # Recycle an instance after this many jobs
+YTDLP_POOL_MAX_AGE_SECONDS = int(os.getenv('YTDLP_POOL_MAX_AGE_SECONDS', '1800'))  # ...or after this long
+
+
+def close_youtubedl(ydl):
+    """Close a YoutubeDL instance, releasing its cookie jar and HTTP connections"""
+    try:
+        close = getattr(ydl, 'close', None)
+        if close is not None:
+            close()
+        else:
+            ydl.__exit__(None, None, None)
+    except Exception as e:
+        logger.warning(f"Error closing YoutubeDL instance: {e}")
+
+
+class PooledYoutubeDL:
+    """A long-lived YoutubeDL instance plus the bookkeeping needed to recycle it"""
+
+    def __init__(self, ydl_opts):
+        self.ydl = yt_dlp.YoutubeDL(ydl_opts)
+        self.created = time.monotonic()
+        self.uses = 0
+
+
+class YoutubeDLPool:
+    """
+    Pool of pre-configured YoutubeDL instances for one platform.
+
+    Instances keep their extractors, cookie jar and HTTP keep-alive connections between
+    jobs, so repeat downloads from the same CDN hosts skip connection setup. Each instance
+    is checked out by one job at a time and recycled after max_uses jobs or max_age seconds
+    (or after a job raised) to keep memory from growing.
+    """
+
+    def __init__(self, name, ydl_opts, size, max_uses, max_age_seconds):
+        self.name = name
+        self.ydl_opts = dict(ydl_opts)
+        self.size = size
+        self.max_uses = max_uses
+        self.max_age_seconds = max_age_seconds
+        # LIFO so the most recently used instance (with the warmest connections) is reused first
+        self.idle = queue.LifoQueue()
+        self.lock = threading.Lock()
+        self.pooled = 0  # Instances owned by the pool (idle or checked out)
+        self.stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'overflow': 0,
+        }
+
+    def _should_recycle(self, item):
+        return item.uses >= self.max_uses or time.monotonic() - item.created >= self.max_age_seconds
+
+    def _acquire(self):
+        """Return (item, pooled) - an idle or new instance, or a throwaway one if the pool is exhausted"""
+        while True:
+            try:
+                item = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            if not self._should_recycle(item):
+                return item, True
+            self._discard(item)
+
+        with self.lock:
+            self.stats['created'] += 1
+            pooled = self.pooled < self.size
+            if pooled:
+                self.pooled += 1
+            else:
+                self.stats['overflow'] += 1
+        return PooledYoutubeDL(self.ydl_opts), pooled
+
+    def _discard(self, item):
+        close_youtubedl(item.ydl)
+        with self.lock:
+            self.pooled -= 1
+            self.stats['recycled'] += 1
+
+    @contextmanager
+    def checkout(self):
+        """Check out a YoutubeDL instance for the duration of one job"""
+        item, pooled = self._acquire()
+        with self.lock:
+            self.stats['checkouts'] += 1
+        failed = False
+        try:
+            yield item.ydl
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            item.uses += 1
+            if not pooled:
+                close_youtubedl(item.ydl)
+            elif failed or self._should_recycle(item):
+                # A job that raised may leave per-download state behind, so start fresh next time
+                self._discard(item)
+            else:
+                self.idle.put(item)
+
+    def close(self):
+        """Close every idle instance"""
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                break
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['pooled'] = self.pooled
+        stats['idle'] = self.idle.qsize()
+        return stats
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name, ydl_opts):
+    """Return the pool for a platform and option set, creating it on first use"""
+    key = (name, repr(sorted(ydl_opts.items())))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = YoutubeDLPool(name, ydl_opts, YTDLP_POOL_SIZE, YTDLP_POOL_MAX_USES, YTDLP_POOL_MAX_AGE_SECONDS)
+            _pools[key] = pool
+            logger.info(f"Created YoutubeDL pool for {name} (size {YTDLP_POOL_SIZE})")
+        return pool
+
+
+@contextmanager
+def youtubedl_session(name, ydl_opts, pooled=None):
+    """
+    Yield a YoutubeDL instance for one job.
+
+    Uses the warm per-platform pool when pooling is enabled, otherwise constructs a fresh
+    instance that is closed when the job finishes.
+    """
+    if pooled is None:
+        pooled = YTDLP_POOL_ENABLED
+    if pooled:
+        with get_pool(name, ydl_opts).checkout() as ydl:
+            yield ydl
+    else:
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            yield ydl
+
+
+def get_pool_stats():
+    """Return aggregated statistics across all pools"""
+    totals = {'checkouts': 0, 'created': 0, 'recycled': 0, 'overflow': 0, 'pooled': 0, 'idle': 0}
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for key, value in pool.get_stats().items():
+            totals[key] += value
+    totals['pools'] = len(pools)
+    return totals
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Worker process configuration (via environment variables)
+YTDLP_WORKERS_ENABLED = os.getenv('YTDLP_WORKERS_ENABLED', 'true').lower() in ('true', '1', 'yes')
+YTDLP_WORKERS = int(os.getenv('YTDLP_WORKERS', '3'))  # Worker processes (concurrent downloads)
+YTDLP_WORKER_MAX_JOBS = int(os.getenv('YTDLP_WORKER_MAX_JOBS', '25'))  # Recycle a worker after this many downloads
+
+# Running this file directly starts a worker; parent and worker exchange one JSON object per line
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+# How long a recycled worker gets to exit on its own before it is killed
+RETIRE_TIMEOUT_SECONDS = 5
+
+# Stats each worker reports with every result (its metadata cache and YoutubeDL pools live in
+# the worker, not in the parent). Counters are kept when a worker exits; gauges are not.
+REMOTE_STATS_GAUGES = {
+    'info_cache': ('entries',),
+    'pool': ('pooled', 'idle', 'pools'),
+}
+
+
+def add_counts(stats, other):
+    """Add the numbers in other to stats, key by key (returns stats)"""
+    for key, value in other.items():
+        stats[key] = stats.get(key, 0) + value
+    return stats
+
+
+class YtdlpWorker:
+    """One worker process and the private folder it downloads into"""
+
+    def __init__(self, process, output_folder):
+        self.process = process
+        self.output_folder = output_folder
+        self.jobs = 0
+        self.remote_stats = {}  # Latest stats the worker reported, by REMOTE_STATS_GAUGES group
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+
+class YtdlpWorkerPool:
+    """
+    Warm yt-dlp worker processes, each handling one download at a time.
+
+    Threads can't be cancelled, so a download run with asyncio.to_thread keeps going (and
+    keeps its temp files) after its caller timed out. A worker process can be killed.
+
+    Every worker has its own output folder, so whatever is in it belongs to the job the
+    worker is running. Finished downloads are moved out to the shared temp directory and
+    anything left behind (partial files, fragments) is removed. On timeout or cancellation
+    the worker's whole process group is killed and its folder deleted. Workers are
+    recycled after max_jobs downloads to keep yt-dlp's memory from growing. Workers report
+    their metadata cache and YoutubeDL pool stats with each result, and get_stats() sums them.
+    """
+
+    def __init__(self, size, max_jobs):
+        self.size = max(1, size)
+        self.max_jobs = max(1, max_jobs)
+        self.idle = []
+        self.alive = 0
+        self.workers = set()  # Every running worker, busy or idle
+        self.exited_remote_stats = {group: {} for group in REMOTE_STATS_GAUGES}  # Counters of exited workers
+        self.slots = None  # Created on first use, inside the running event loop
+        self.reaping = set()  # Tasks waiting for killed workers to exit, so they don't linger as zombies
+        self.stats = {
+            'jobs': 0,
+            'spawned': 0,
+            'recycled': 0,
+            'kills': 0,
+            'crashes': 0,
+            'cleaned_files': 0,
+        }
+
+    async def _spawn(self):
+        output_folder = tempfile.mkdtemp(prefix='vxtwitter_ytdlp_')
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT, output_folder,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            cwd=os.path.dirname(WORKER_SCRIPT),
+            # Own process group, so a kill also takes down any ffmpeg yt-dlp started
+            start_new_session=(os.name != 'nt'),
+        )
+        self.alive += 1
+        self.stats['spawned'] += 1
+        logger.info(f"Started yt-dlp worker {process.pid}")
+        worker = YtdlpWorker(process, output_folder)
+        self.workers.add(worker)
+        return worker
+
+    def _forget(self, worker):
+        """Keep the counters of a worker that exited, since its process took them along"""
+        self.workers.discard(worker)
+        for group, gauges in REMOTE_STATS_GAUGES.items():
+            totals = self.exited_remote_stats[group]
+            for key, value in worker.remote_stats.get(group, {}).items():
+                if key not in gauges:
+                    totals[key] = totals.get(key, 0) + value
+
+    def _clean_folder(self, worker, remove=False):
+        """Delete leftover files in a worker's folder (and the folder itself if remove)"""
+        try:
+            names = os.listdir(worker.output_folder)
+        except OSError:
+            return
+        self.stats['cleaned_files'] += len(names)
+        if remove:
+            shutil.rmtree(worker.output_folder, ignore_errors=True)
+            return
+        for name in names:
+            path = os.path.join(worker.output_folder, name)
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+            except OSError as e:
+                logger.warning(f"Failed to remove leftover worker file {path}: {e}")
+
+    def _kill(self, worker):
+        """Kill a worker (and its children) immediately; returns without waiting for it"""
+        try:
+            if os.name != 'nt':
+                os.killpg(worker.pid, signal.SIGKILL)
+            else:
+                worker.process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+        reaper = asyncio.ensure_future(worker.process.wait())
+        self.reaping.add(reaper)
+        reaper.add_done_callback(self.reaping.discard)
+        self.alive -= 1
+        self._forget(worker)
+        self._clean_folder(worker, remove=True)
+
+    async def _retire(self, worker):
+        """Let a worker that reached max_jobs exit cleanly, killing it if it doesn't"""
+        self.stats['recycled'] += 1
+        try:
+            worker.process.stdin.close()
+            await asyncio.wait_for(worker.process.wait(), timeout=RETIRE_TIMEOUT_SECONDS)
+        except (asyncio.TimeoutError, OSError):
+            self._kill(worker)
+            return
+        self.alive -= 1
+        self._forget(worker)
+        self._clean_folder(worker, remove=True)
+        logger.info(f"Recycled yt-dlp worker {worker.pid} after {worker.jobs} jobs")
+
+    def _claim_result_file(self, result):
+        """Move a finished download out of the worker's folder before the folder is reused"""
+        filepath = result['filepath']
+        # Unique name: two workers may download the same video (e.g. for different size limits)
+        base_name, ext = os.path.splitext(os.path.basename(filepath))
+        destination = os.path.join(tempfile.gettempdir(), f"{base_name}_{uuid.uuid4().hex[:8]}{ext}")
+        os.replace(filepath, destination)
+        result['filepath'] = destination
+
+    async def download(self, provider_key, url, max_size_bytes=None, timeout_seconds=None):
+        """
+        Download a video in a worker process.
+
+        Returns the same dict as media_extraction.download_with_ytdlp. Raises
+        asyncio.TimeoutError after killing the worker if the download takes too long.
+        """
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.size)
+        async with self.slots:
+            worker = self.idle.pop() if self.idle else await self._spawn()
+            request = json.dumps({'provider': provider_key, 'url': url, 'max_size': max_size_bytes}) + '\n'
+            try:
+                worker.process.stdin.write(request.encode('utf-8'))
+                await worker.process.stdin.drain()
+                line = await asyncio.wait_for(worker.process.stdout.readline(), timeout=timeout_seconds)
+            except asyncio.TimeoutError:
+                self.stats['kills'] += 1
+                logger.warning(f"Killing yt-dlp worker {worker.pid} after {timeout_seconds}s on {url}")
+                self._kill(worker)
+                raise
+            except asyncio.CancelledError:
+                self.stats['kills'] += 1
+                self._kill(worker)
+                raise
+            except (BrokenPipeError, ConnectionResetError) as e:
+                line = b''
+                logger.error(f"Lost connection to yt-dlp worker {worker.pid}: {e}")
+
+            if not line:
+                self.stats['crashes'] += 1
+                logger.error(f"yt-dlp worker {worker.pid} exited unexpectedly while downloading {url}")
+                self._kill(worker)
+                return {'success': False, 'error': 'yt-dlp worker exited unexpectedly'}
+
+            worker.jobs += 1
+            self.stats['jobs'] += 1
+            result = json.loads(line)
+            worker.remote_stats = result.pop('stats', None) or worker.remote_stats
+            if result.get('success'):
+                try:
+                    self._claim_result_file(result)
+                except OSError as e:
+                    result = {'success': False, 'error': f"File system error: {str(e)}"}
+            self._clean_folder(worker)
+
+            if worker.jobs >= self.max_jobs:
+                await self._retire(worker)
+            else:
+                self.idle.append(worker)
+            return result
+
+    async def close(self):
+        """Stop every idle worker"""
+        while self.idle:
+            await self._retire(self.idle.pop())
+
+    def get_remote_stats(self, group):
+        """Sum one group of worker-reported stats (e.g. 'info_cache') over running and exited workers"""
+        totals = dict(self.exited_remote_stats[group])
+        for worker in self.workers:
+            add_counts(totals, worker.remote_stats.get(group, {}))
+        return totals
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['alive'] = self.alive
+        stats['idle'] = len(self.idle)
+        stats['size'] = self.size
+        for group in REMOTE_STATS_GAUGES:
+            stats[group] = self.get_remote_stats(group)
+        return stats
+
+
+ytdlp_workers = YtdlpWorkerPool(YTDLP_WORKERS, YTDLP_WORKER_MAX_JOBS)
+
+
+def worker_main(output_folder):
+    """Serve download requests from stdin until it is closed"""
+    # Keep the protocol stream to ourselves: anything printed to stdout goes to stderr instead
+    protocol = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - ytdlp-worker[{os.getpid()}] - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    from media_providers import get_provider
+    from media_extraction import download_with_ytdlp, info_cache
+    from ytdlp_pool import get_pool_stats
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        provider = get_provider(request['provider'])
+        if provider is None:
+            result = {'success': False, 'error': f"Unknown provider: {request['provider']}"}
+        else:
+            result = download_with_ytdlp(
+                request['url'], provider.ydl_opts(output_folder), output_folder, provider.name, request.get('max_size')
+            )
+        result['stats'] = {'info_cache': info_cache.get_stats(), 'pool': get_pool_stats()}
+        protocol.write(json.dumps(result) + '\n')
+        protocol.flush()
+
+
+if __name__ == '__main__':
+    worker_main(sys.argv[1])